@@ -0,0 +1,64 @@
+"""
+Measures barcode detection on synthetic photos with and without an EAN-13,
+and what it adds to the fingerprint of an uploaded image.
+
+Usage:
+	python -m benchmarks.barcode_benchmark --repeat 10
+"""
+import argparse
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.corpus import make_barcode_photo, make_food_corpus
+from benchmarks.e2e_benchmark import percentile
+from src.utils.analysis_cache import image_fingerprint
+from src.utils.barcode import barcode_scan_size
+
+CODE = "3017620422003"
+
+# (file name, photo size, barcode width as a share of the photo, rotation)
+BARCODE_SPECS = [
+	("barcode_12mp.jpg", (4032, 3024), 0.3, 0),
+	("barcode_12mp_small.jpg", (4032, 3024), 0.18, 0),
+	("barcode_12mp_vertical.jpg", (4032, 3024), 0.3, 90),
+	("barcode_12mp_tilted.jpg", (4032, 3024), 0.3, 12),
+	("barcode_1024.jpg", (1024, 768), 0.4, 0),
+]
+
+
+def timed(func, repeat):
+	latencies = []
+	for _ in range(repeat):
+		start = time.perf_counter()
+		result = func()
+		latencies.append(time.perf_counter() - start)
+	latencies.sort()
+	return result, percentile(latencies, 50) * 1000
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--repeat", type=int, default=10)
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as directory:
+		images = []
+		for name, size, width, angle in BARCODE_SPECS:
+			path = Path(directory, name)
+			make_barcode_photo(path, CODE, size, barcode_width=width, angle=angle)
+			images.append((path, CODE))
+		images += [(Path(path), None) for path in make_food_corpus(os.path.join(directory, "corpus"))]
+
+		print(f"Scan size {barcode_scan_size} px, median of {args.repeat} runs")
+		print(f"{'image':<30}{'barcode':>15}{'fingerprint ms':>16}{'with barcode ms':>17}{'added ms':>10}")
+		for path, expected in images:
+			_, fingerprint_ms = timed(lambda: image_fingerprint(path), args.repeat)
+			fingerprint, both_ms = timed(lambda: image_fingerprint(path, barcode_size=barcode_scan_size), args.repeat)
+			status = fingerprint.barcode or "-"
+			if fingerprint.barcode != expected:
+				status += " (wrong)"
+			print(f"{path.name:<30}{status:>15}{fingerprint_ms:>16.1f}{both_ms:>17.1f}{both_ms - fingerprint_ms:>10.1f}")
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,61 @@
+"""
+Shows that simultaneous sessions are served in parallel by the async Bedrock path.
+
+Usage:
+	python -m benchmarks.concurrency_benchmark --sessions 16 --latency 0.5
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks.stubs import FakeBedrockRuntime, NullTrace
+from src.config.schemas import get_analysis_schema
+import src.model.query_claude_3_7 as query_claude_3_7
+
+
+def run_serialized(sessions):
+	"""
+	Runs the sessions back to back with the blocking API, as the event loop used to.
+	"""
+	start = time.perf_counter()
+	for i in range(sessions):
+		query_claude_3_7.function_calling_query(
+			input_text=f"Session {i}: what is this?",
+			json_schema=get_analysis_schema(),
+			trace=NullTrace()
+		)
+	return time.perf_counter() - start
+
+async def run_concurrent(sessions):
+	"""
+	Runs the sessions simultaneously with the awaitable API.
+	"""
+	start = time.perf_counter()
+	await asyncio.gather(*[
+		query_claude_3_7.function_calling_query_async(
+			input_text=f"Session {i}: what is this?",
+			json_schema=get_analysis_schema(),
+			trace=NullTrace()
+		)
+		for i in range(sessions)
+	])
+	return time.perf_counter() - start
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument("--sessions", type=int, default=16)
+	parser.add_argument("--latency", type=float, default=0.5, help="Fake Bedrock latency per call in seconds")
+	args = parser.parse_args()
+
+	query_claude_3_7.bedrock_runtime = FakeBedrockRuntime(latency=args.latency)
+
+	serialized = run_serialized(args.sessions)
+	concurrent = asyncio.run(run_concurrent(args.sessions))
+
+	print(f"Sessions: {args.sessions}, Bedrock latency: {args.latency:.2f}s, 2 calls per session")
+	print(f"Serialized (blocking): {serialized:.2f}s")
+	print(f"Concurrent (async):    {concurrent:.2f}s")
+	print(f"Speedup: {serialized / concurrent:.1f}x")
+
+if __name__ == "__main__":
+	main()
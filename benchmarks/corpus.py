@@ -0,0 +1,126 @@
+"""
+Sample food photos for the benchmarks.
+
+No photos are shipped with the repository: a synthetic corpus covering the
+formats users upload is generated on demand, or a directory of real photos
+can be used instead.
+"""
+import os
+
+from PIL import Image, ImageDraw, ImageFilter
+
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+# (file name, size, format): phone photos, a resized photo, a screenshot and a transparent PNG
+CORPUS_SPECS = [
+	("phone_12mp.jpg", (4032, 3024), "JPEG"),
+	("phone_12mp_portrait.jpg", (3024, 4032), "JPEG"),
+	("phone_3mp.jpg", (2016, 1512), "JPEG"),
+	("resized_1024.jpg", (1024, 768), "JPEG"),
+	("label_screenshot.png", (1170, 2532), "PNG"),
+	("packshot_transparent.png", (1600, 1600), "PNG"),
+]
+
+
+def make_phone_photo(path, size=(4032, 3024)):
+	"""
+	Writes a JPEG with the size and roughly the entropy of a 12 MP phone photo.
+	"""
+	width, height = size
+	noise = Image.effect_noise(size, 60).filter(ImageFilter.GaussianBlur(1))
+	horizontal = Image.linear_gradient("L").resize(size)
+	vertical = Image.linear_gradient("L").rotate(90).resize(size)
+	img = Image.merge("RGB", (noise, horizontal, Image.blend(noise, vertical, 0.5)))
+	img.save(path, format="JPEG", quality=92)
+
+def _make_label(path, size):
+	"""
+	Writes a nutrition-label-like screenshot: flat background, lines of text.
+	"""
+	img = Image.new("RGB", size, "white")
+	draw = ImageDraw.Draw(img)
+	for i, y in enumerate(range(40, size[1] - 40, 48)):
+		draw.text((40, y), f"Nutrient {i}: {i * 7 % 100} g per 100 g", fill="black")
+		draw.line((40, y + 36, size[0] - 40, y + 36), fill="gray")
+	img.save(path, format="PNG")
+
+def _make_packshot(path, size):
+	"""
+	Writes a product photo on a transparent background.
+	"""
+	img = Image.new("RGBA", size, (0, 0, 0, 0))
+	product = Image.effect_noise((size[0] // 2, size[1] * 2 // 3), 40).convert("RGBA")
+	img.paste(product, (size[0] // 4, size[1] // 6))
+	img.save(path, format="PNG")
+
+def ean13_modules(code):
+	"""
+	Returns the 95 modules of an EAN-13 symbol, 1 for a bar.
+	"""
+	from src.utils.barcode import DIGIT_WIDTHS, FIRST_DIGIT
+
+	parity = {first: pattern for pattern, first in FIRST_DIGIT.items()}[code[0]]
+	modules = "101"
+	for position, digit in enumerate(code[1:]):
+		widths = [int(width) for width in DIGIT_WIDTHS[int(digit)]]
+		if position == 6:
+			modules += "01010"
+		if position < 6 and parity[position] == "G":
+			widths = widths[::-1]
+		# Left digits start with a space, right digits with a bar
+		colors = "0101" if position < 6 else "1010"
+		modules += "".join(color * width for color, width in zip(colors, widths))
+	return modules + "101"
+
+def make_barcode_photo(path, code, size=(4032, 3024), barcode_width=0.3, angle=0, blur=1.0):
+	"""
+	Writes a phone photo with an EAN-13 label on it.
+
+	Args:
+		code: 13 digits
+		barcode_width: Width of the symbol as a share of the photo's width
+		angle: Rotation of the label in degrees
+	"""
+	img = Image.effect_noise(size, 40).convert("RGB")
+	module = max(1, int(size[0] * barcode_width / 95))
+	label = Image.new("L", (module * 115, module * 70), 255)
+	draw = ImageDraw.Draw(label)
+	for i, bar in enumerate(ean13_modules(code)):
+		if bar == "1":
+			x = (10 + i) * module
+			draw.rectangle((x, 5 * module, x + module - 1, 60 * module), fill=20)
+	label = label.rotate(angle, expand=True, fillcolor=255)
+	img.paste(label.convert("RGB"), ((size[0] - label.width) // 2, (size[1] - label.height) // 2))
+	img.filter(ImageFilter.GaussianBlur(blur)).save(path, format="JPEG", quality=90)
+
+def make_food_corpus(directory):
+	"""
+	Writes the synthetic corpus to `directory`, reusing files already there.
+
+	Returns:
+		List of image paths
+	"""
+	os.makedirs(directory, exist_ok=True)
+	paths = []
+	for name, size, img_format in CORPUS_SPECS:
+		path = os.path.join(directory, name)
+		if not os.path.exists(path):
+			if img_format == "JPEG":
+				make_phone_photo(path, size)
+			elif name.startswith("label"):
+				_make_label(path, size)
+			else:
+				_make_packshot(path, size)
+		paths.append(path)
+	return paths
+
+def load_corpus(directory):
+	"""
+	Returns the paths of the images in `directory`, sorted by name.
+	"""
+	return sorted(
+		os.path.join(directory, name)
+		for name in os.listdir(directory)
+		if name.lower().endswith(IMAGE_EXTENSIONS)
+	)
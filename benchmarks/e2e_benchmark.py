@@ -0,0 +1,240 @@
+"""
+End-to-end benchmark of the image pipeline, the structured data extraction and
+process_message, against a local Bedrock stand-in.
+
+Each scenario runs in a fresh process and reports p50/p95/p99 latency,
+throughput and peak RSS. Results can be saved and compared with a baseline;
+the exit code is 1 when a scenario regressed beyond the tolerance.
+
+Bedrock stand-ins:
+	fake    canned tool_use/text responses with a fixed latency (default)
+	record  forwards to the real Bedrock (AWS credentials needed) and records to --recording
+	replay  serves the calls recorded in --recording with their recorded latency
+
+Usage:
+	python -m benchmarks.e2e_benchmark --requests 40 --concurrency 8
+	python -m benchmarks.e2e_benchmark --bedrock record --recording calls.jsonl --requests 6
+	python -m benchmarks.e2e_benchmark --bedrock replay --recording calls.jsonl --json results.json
+	python -m benchmarks.e2e_benchmark --baseline results.json --tolerance 0.2
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.corpus import load_corpus, make_food_corpus
+
+SCENARIOS = ["compress", "function_calling_query", "process_message"]
+
+
+def percentile(sorted_values, q):
+	"""
+	Nearest-rank percentile of an already sorted list.
+	"""
+	if not sorted_values:
+		return 0.0
+	rank = max(1, round(q / 100 * len(sorted_values) + 0.5))
+	return sorted_values[min(rank, len(sorted_values)) - 1]
+
+def _install_bedrock(config):
+	"""
+	Points the model module at the configured Bedrock stand-in.
+	"""
+	import src.model.query_claude_3_7 as query_claude_3_7
+	from benchmarks.recording import RecordingBedrockRuntime, ReplayBedrockRuntime
+	from benchmarks.stubs import FakeBedrockRuntime
+
+	if config["bedrock"] == "record":
+		query_claude_3_7.bedrock_runtime = RecordingBedrockRuntime(query_claude_3_7.bedrock_runtime, config["recording"])
+	elif config["bedrock"] == "replay":
+		query_claude_3_7.bedrock_runtime = ReplayBedrockRuntime(
+			config["recording"], strict=config["strict"], speed=config["replay_speed"]
+		)
+	else:
+		query_claude_3_7.bedrock_runtime = FakeBedrockRuntime(latency=config["latency"])
+
+def _make_operation(scenario, config):
+	"""
+	Returns a coroutine function running one operation of the scenario on an image Path.
+	"""
+	from benchmarks.stubs import NullTrace
+	from src.config.schemas import get_analysis_schema
+
+	if scenario == "compress":
+		from src.utils.image_processor import prepare_image_base64_async
+
+		async def operation(path):
+			assert await prepare_image_base64_async(path)
+
+	elif scenario == "function_calling_query":
+		from src.model.query_claude_3_7 import function_calling_query_async
+
+		async def operation(path):
+			result = await function_calling_query_async(
+				input_text="How many calories are in this?",
+				json_schema=get_analysis_schema(),
+				images=[path],
+				trace=NullTrace()
+			)
+			assert "structured_data" in result
+
+	else:
+		import chainlit as cl
+		from chainlit.context import init_http_context
+		from src.handlers.message_handler import process_message
+
+		async def operation(path):
+			# Elements need a Chainlit context; an HTTP one does not emit anything
+			init_http_context()
+			message = cl.Message(
+				content="Is this a healthy choice?",
+				elements=[cl.Image(path=str(path), name=Path(path).name)]
+			)
+			response_text, _, _, products = await process_message(message, NullTrace())
+			assert response_text and products
+
+	return operation
+
+async def _run_scenario(operation, paths, requests, concurrency):
+	slots = asyncio.Semaphore(concurrency)
+	latencies = []
+
+	async def timed(path):
+		async with slots:
+			start = time.perf_counter()
+			await operation(path)
+			latencies.append(time.perf_counter() - start)
+
+	# A str would be taken for base64 data, images are referenced by Path
+	paths = [Path(path) for path in paths]
+	start = time.perf_counter()
+	await asyncio.gather(*[timed(paths[i % len(paths)]) for i in range(requests)])
+	return latencies, time.perf_counter() - start
+
+def _measure(scenario, config, paths, results):
+	try:
+		results.put(_measure_scenario(scenario, config, paths))
+	except Exception as e:
+		# Report the failure rather than leaving the parent waiting
+		results.put({"error": f"{type(e).__name__}: {e}"})
+
+def _measure_scenario(scenario, config, paths):
+	_install_bedrock(config)
+	operation = _make_operation(scenario, config)
+	if not config["warm_cache"]:
+		import src.utils.analysis_cache as analysis_cache
+		# Every request misses, as for first-time uploads
+		analysis_cache._analysis_cache = analysis_cache.AnalysisCache(max_entries=0, phash_distance=0)
+
+	# Imports are done, so the peak RSS delta only covers the scenario itself
+	rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+		latencies, wall = asyncio.run(_run_scenario(operation, paths, config["requests"], config["concurrency"]))
+	rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+	latencies.sort()
+	return {
+		"p50_ms": percentile(latencies, 50) * 1000,
+		"p95_ms": percentile(latencies, 95) * 1000,
+		"p99_ms": percentile(latencies, 99) * 1000,
+		"throughput": len(latencies) / wall,
+		"peak_rss_mb": (rss_after - rss_before) / 1024,
+	}
+
+def run(scenario, config, paths):
+	"""
+	Runs a scenario in a fresh process and returns its results.
+	"""
+	context = multiprocessing.get_context("spawn")
+	results = context.Queue()
+	process = context.Process(target=_measure, args=(scenario, config, paths, results))
+	process.start()
+	result = results.get()
+	process.join()
+	return result
+
+def find_regressions(results, baseline, tolerance):
+	"""
+	Lists the metrics that are worse than the baseline by more than `tolerance`.
+	"""
+	regressions = []
+	for scenario, result in results.items():
+		previous = baseline.get(scenario)
+		if not previous:
+			continue
+		for metric in ("p50_ms", "p95_ms", "p99_ms", "peak_rss_mb"):
+			if previous[metric] > 0 and result[metric] > previous[metric] * (1 + tolerance):
+				regressions.append(f"{scenario} {metric}: {previous[metric]:.1f} -> {result[metric]:.1f}")
+		if result["throughput"] < previous["throughput"] * (1 - tolerance):
+			regressions.append(f"{scenario} throughput: {previous['throughput']:.1f} -> {result['throughput']:.1f}")
+	return regressions
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma separated subset of " + ", ".join(SCENARIOS))
+	parser.add_argument("--requests", type=int, default=24)
+	parser.add_argument("--concurrency", type=int, default=4)
+	parser.add_argument("--corpus", help="Directory of food photos, a synthetic corpus is generated otherwise")
+	parser.add_argument("--bedrock", choices=["fake", "record", "replay"], default="fake")
+	parser.add_argument("--latency", type=float, default=0.3, help="Latency of the fake Bedrock per call in seconds")
+	parser.add_argument("--recording", default="bedrock_recording.jsonl", help="JSONL file of recorded Bedrock calls")
+	parser.add_argument("--replay-speed", type=float, default=1.0, help="2.0 replays twice as fast, 0 without latency")
+	parser.add_argument("--lenient", action="store_true", help="Replay the next recorded response for unrecorded requests")
+	parser.add_argument("--warm-cache", action="store_true", help="Keep the analysis cache, repeated images become hits")
+	parser.add_argument("--json", help="Write the results to this file")
+	parser.add_argument("--baseline", help="Results file to compare with")
+	parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression vs. the baseline")
+	args = parser.parse_args()
+
+	if args.corpus:
+		paths = load_corpus(args.corpus)
+	else:
+		paths = make_food_corpus(os.path.join(tempfile.gettempdir(), "nutritrack_benchmark_corpus"))
+	config = {
+		"bedrock": args.bedrock,
+		"latency": args.latency,
+		"recording": args.recording,
+		"replay_speed": args.replay_speed,
+		"strict": not args.lenient,
+		"warm_cache": args.warm_cache,
+		"requests": args.requests,
+		"concurrency": args.concurrency,
+	}
+
+	print(f"Corpus: {len(paths)} images, {args.requests} requests, concurrency {args.concurrency}, Bedrock: {args.bedrock}")
+	print(f"{'scenario':<24}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'req/s':>8}{'peak RSS MB':>13}")
+	results = {}
+	failed = False
+	for scenario in args.scenarios.split(","):
+		r = run(scenario, config, paths)
+		if "error" in r:
+			print(f"{scenario:<24}failed: {r['error']}")
+			failed = True
+			continue
+		results[scenario] = r
+		print(f"{scenario:<24}{r['p50_ms']:>9.0f}{r['p95_ms']:>9.0f}{r['p99_ms']:>9.0f}{r['throughput']:>8.1f}{r['peak_rss_mb']:>13.1f}")
+
+	if args.json:
+		with open(args.json, "w") as output:
+			json.dump(results, output, indent=2)
+
+	if args.baseline:
+		with open(args.baseline) as baseline_file:
+			regressions = find_regressions(results, json.load(baseline_file), args.tolerance)
+		for regression in regressions:
+			print(f"REGRESSION {regression}")
+		if regressions:
+			sys.exit(1)
+		print("No regression beyond the tolerance")
+	if failed:
+		sys.exit(1)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,107 @@
+"""
+Compares the legacy base64 compression path with the single-decode image pipeline
+on a synthetic 12 MP phone photo.
+
+Each variant runs in a fresh process so that peak RSS can be compared.
+
+Usage:
+	python -m benchmarks.image_pipeline_benchmark --runs 5
+	python -m benchmarks.image_pipeline_benchmark --image path/to/photo.jpg
+"""
+import argparse
+import base64
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+from io import BytesIO
+
+from PIL import Image
+
+from benchmarks.corpus import make_phone_photo
+
+
+def legacy_pipeline(path):
+	"""
+	The ingestion path before the single-decode pipeline: read and base64 encode
+	in extract_images, then decode, resize to 2048 px and re-encode in compress_image.
+	"""
+	with open(path, "rb") as img_file:
+		base64_image = base64.b64encode(img_file.read()).decode("utf-8")
+
+	img_data = base64.b64decode(base64_image)
+	img = Image.open(BytesIO(img_data))
+	img.thumbnail((2048, 2048), Image.LANCZOS)
+	buffer = BytesIO()
+	img.save(buffer, format="JPEG", quality=80, optimize=True)
+	compressed_data = buffer.getvalue()
+	if len(compressed_data) > 2048 * 1024:
+		img.thumbnail((1600, 1600), Image.LANCZOS)
+		buffer = BytesIO()
+		img.save(buffer, format="JPEG", quality=70, optimize=True)
+		compressed_data = buffer.getvalue()
+	return base64.b64encode(compressed_data).decode("utf-8")
+
+def single_decode_pipeline(path):
+	"""
+	The current path: prepare_image straight from the file, base64 encoded once.
+	"""
+	from src.utils.image_processor import prepare_image
+	image_bytes, media_type = prepare_image(path)
+	return base64.b64encode(image_bytes).decode("utf-8")
+
+VARIANTS = {
+	"legacy": legacy_pipeline,
+	"single-decode": single_decode_pipeline,
+}
+
+def _measure(variant, path, runs, results):
+	# Import everything first so that only the pipeline itself shows in the peak RSS delta
+	import src.utils.image_processor  # noqa: F401
+	import contextlib
+	func = VARIANTS[variant]
+
+	rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	wall = cpu = 0.0
+	output_size = 0
+	with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+		for _ in range(runs):
+			wall_start, cpu_start = time.perf_counter(), time.process_time()
+			output_size = len(func(path))
+			wall += time.perf_counter() - wall_start
+			cpu += time.process_time() - cpu_start
+	rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+	results.put({
+		"wall_ms": wall / runs * 1000,
+		"cpu_ms": cpu / runs * 1000,
+		"peak_rss_mb": (rss_after - rss_before) / 1024,
+		"output_kb": output_size * 3 / 4 / 1024,
+	})
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument("--runs", type=int, default=5)
+	parser.add_argument("--image", help="JPEG to use instead of a synthetic 12 MP photo")
+	args = parser.parse_args()
+
+	path = args.image
+	if path is None:
+		path = os.path.join(tempfile.mkdtemp(), "phone_photo.jpg")
+		make_phone_photo(path)
+	with Image.open(path) as img:
+		print(f"Image: {img.size[0]}x{img.size[1]}, {os.path.getsize(path) / 1024:.0f} KB, {args.runs} runs")
+
+	context = multiprocessing.get_context("spawn")
+	print(f"{'pipeline':<16}{'wall ms':>10}{'cpu ms':>10}{'peak RSS MB':>14}{'output KB':>12}")
+	for variant in VARIANTS:
+		results = context.Queue()
+		process = context.Process(target=_measure, args=(variant, path, args.runs, results))
+		process.start()
+		r = results.get()
+		process.join()
+		print(f"{variant:<16}{r['wall_ms']:>10.0f}{r['cpu_ms']:>10.0f}{r['peak_rss_mb']:>14.1f}{r['output_kb']:>12.0f}")
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,402 @@
+"""
+Load test of the running Chainlit app with many concurrent chat sessions.
+
+Each simulated user logs in through the password auth, opens a socket.io
+session like the browser does and then runs a mix of actions: photo uploads
+with a question, follow-up questions, "add product" clicks and starter
+commands. The number of sessions is ramped up stage by stage; each stage
+reports per-action latency percentiles and throughput, and the saturation
+point is the last stage that still raised the throughput noticeably.
+
+By default the app is started locally on benchmarks/stub_app.py, i.e. with
+the fake Bedrock and without tracing, so no AWS or Langfuse access is needed.
+
+Usage:
+	python -m benchmarks.load_test --stages 1,2,4,8,16 --actions 10
+	python -m benchmarks.load_test --latency 1.0 --think 0.5 --json load.json
+	python -m benchmarks.load_test --url http://localhost:8000 --stages 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import secrets
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+import socketio
+
+from benchmarks.corpus import load_corpus, make_food_corpus
+from benchmarks.e2e_benchmark import percentile
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Accounts known to auth_callback in main.py
+CREDENTIALS = [("admin", "admin"), ("user", "user"), ("user1", "password1"), ("user2", "password2")]
+
+# Relative frequency of each action in a session
+ACTION_MIX = {
+	"analyze": 3,
+	"follow_up": 3,
+	"add_product": 1,
+	"!nutrition_summary": 1,
+	"!view_consumption": 1,
+	"!weekly_report": 1,
+}
+
+QUESTIONS = [
+	"How many calories are in this?",
+	"Is this a healthy choice?",
+	"What are the main ingredients?",
+]
+
+FOLLOW_UPS = [
+	"How much protein does it have?",
+	"Is it high in sugar?",
+	"Can I eat this every day?",
+	"What would be a healthier alternative?",
+]
+
+MIME_TYPES = {".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png", ".webp": "image/webp"}
+
+
+class ChatSession:
+	"""
+	One simulated user: an HTTP client for login, uploads and actions, and a
+	socket.io client for messages.
+	"""
+
+	def __init__(self, base_url, credentials, timeout=120.0):
+		self.base_url = base_url.rstrip("/")
+		self.credentials = credentials
+		self.timeout = timeout
+		self.session_id = str(uuid.uuid4())
+		self.http = httpx.AsyncClient(base_url=self.base_url, timeout=timeout)
+		self.sio = socketio.AsyncClient(reconnection=False)
+		self.cookie = None
+		# Latest "add product" actions sent by the app
+		self.product_actions = []
+		self._done = asyncio.Event()
+		self._first_token = None
+
+		self.sio.on("task_end", self._on_task_end)
+		self.sio.on("stream_token", self._on_token)
+		self.sio.on("action", self._on_action)
+
+	async def _on_task_end(self, data):
+		self._done.set()
+
+	async def _on_token(self, data):
+		if self._first_token is None:
+			self._first_token = time.perf_counter()
+
+	async def _on_action(self, action):
+		if action.get("name") == "add_product":
+			self.product_actions.append(action)
+
+	async def login(self):
+		"""
+		Logs in and opens the chat session, as the browser does on page load.
+		"""
+		username, password = self.credentials
+		response = await self.http.post("/login", data={"username": username, "password": password})
+		response.raise_for_status()
+		# The auth cookie may be marked secure, so it is passed on explicitly rather than through a cookie jar
+		self.cookie = "; ".join(f"{name}={value}" for name, value in response.cookies.items())
+		await self.sio.connect(
+			self.base_url,
+			headers={"Cookie": self.cookie},
+			auth={"clientType": "webapp", "sessionId": self.session_id, "threadId": None, "userEnv": "{}", "chatProfile": None},
+			socketio_path="/ws/socket.io",
+			transports=["websocket"],
+			wait_timeout=self.timeout,
+		)
+		self._done.clear()
+		await self.sio.emit("connection_successful")
+		await asyncio.wait_for(self._done.wait(), self.timeout)
+
+	async def send(self, content, image=None):
+		"""
+		Sends a message, with an optional uploaded image, and waits until the app has answered.
+
+		Returns:
+			Seconds to the first streamed token, or None when nothing was streamed
+		"""
+		file_references = []
+		if image is not None:
+			response = await self.http.post(
+				"/project/file",
+				params={"session_id": self.session_id},
+				files={"file": (image.name, image.read_bytes(), MIME_TYPES.get(image.suffix.lower(), "image/jpeg"))},
+				headers={"Cookie": self.cookie},
+			)
+			response.raise_for_status()
+			file_references.append({"id": response.json()["id"]})
+
+		now = datetime.now(timezone.utc).isoformat()
+		message = {
+			"id": str(uuid.uuid4()),
+			"threadId": "",
+			"name": self.credentials[0],
+			"type": "user_message",
+			"output": content,
+			"createdAt": now,
+		}
+		self._done.clear()
+		self._first_token = None
+		start = time.perf_counter()
+		await self.sio.emit("client_message", {"message": message, "fileReferences": file_references or None})
+		await asyncio.wait_for(self._done.wait(), self.timeout)
+		return None if self._first_token is None else self._first_token - start
+
+	async def click(self, action):
+		"""
+		Runs an action button callback, e.g. "add product".
+		"""
+		response = await self.http.post(
+			"/project/action",
+			json={"sessionId": self.session_id, "action": action},
+			headers={"Cookie": self.cookie},
+		)
+		response.raise_for_status()
+
+	async def close(self):
+		if self.sio.connected:
+			await self.sio.disconnect()
+		await self.http.aclose()
+
+
+async def run_action(session, action, images, rng):
+	"""
+	Runs one action of the mix.
+
+	Returns:
+		Tuple (action name, seconds to the first token or None)
+	"""
+	if action == "add_product" and not session.product_actions:
+		# Nothing to add yet, the user analyses a product first
+		action = "analyze"
+	if action == "analyze":
+		return action, await session.send(rng.choice(QUESTIONS), image=rng.choice(images))
+	if action == "follow_up":
+		return action, await session.send(rng.choice(FOLLOW_UPS))
+	if action == "add_product":
+		await session.click(session.product_actions.pop())
+		return action, None
+	return action, await session.send(action)
+
+
+async def run_user(base_url, credentials, images, config, rng, samples, errors):
+	session = ChatSession(base_url, credentials, timeout=config["timeout"])
+	try:
+		start = time.perf_counter()
+		try:
+			await session.login()
+		except Exception as e:
+			errors.append(("login", f"{type(e).__name__}: {e}"))
+			return
+		samples.append(("login", time.perf_counter() - start, None))
+
+		names = list(ACTION_MIX)
+		weights = list(ACTION_MIX.values())
+		for _ in range(config["actions"]):
+			if config["think"] > 0:
+				await asyncio.sleep(rng.expovariate(1 / config["think"]))
+			action = rng.choices(names, weights)[0]
+			start = time.perf_counter()
+			try:
+				action, first_token = await run_action(session, action, images, rng)
+			except Exception as e:
+				errors.append((action, f"{type(e).__name__}: {e}"))
+				continue
+			samples.append((action, time.perf_counter() - start, first_token))
+	finally:
+		await session.close()
+
+
+async def run_stage(base_url, sessions, images, config, seed):
+	"""
+	Runs `sessions` concurrent users through their actions.
+
+	Returns:
+		Dict with the wall time, the (action, latency, first token) samples and the errors
+	"""
+	samples, errors = [], []
+	start = time.perf_counter()
+	await asyncio.gather(*[
+		# User i runs the same actions in every stage, so stages differ only in concurrency
+		run_user(base_url, CREDENTIALS[i % len(CREDENTIALS)], images, config, random.Random(seed + i), samples, errors)
+		for i in range(sessions)
+	])
+	return {"wall": time.perf_counter() - start, "samples": samples, "errors": errors}
+
+
+def summarize(stage):
+	"""
+	Per-action latency percentiles and the throughput of a stage's chat actions.
+	"""
+	actions = {}
+	for action, latency, first_token in stage["samples"]:
+		entry = actions.setdefault(action, {"latencies": [], "first_tokens": []})
+		entry["latencies"].append(latency)
+		if first_token is not None:
+			entry["first_tokens"].append(first_token)
+
+	summary = {}
+	for action, entry in sorted(actions.items()):
+		latencies = sorted(entry["latencies"])
+		first_tokens = sorted(entry["first_tokens"])
+		summary[action] = {
+			"count": len(latencies),
+			"p50_ms": percentile(latencies, 50) * 1000,
+			"p95_ms": percentile(latencies, 95) * 1000,
+			"p99_ms": percentile(latencies, 99) * 1000,
+			"first_token_p50_ms": percentile(first_tokens, 50) * 1000 if first_tokens else None,
+		}
+	completed = sum(1 for action, _, _ in stage["samples"] if action != "login")
+	return {
+		"throughput": completed / stage["wall"] if stage["wall"] else 0.0,
+		"errors": len(stage["errors"]),
+		"actions": summary,
+	}
+
+
+def find_saturation(results, min_gain):
+	"""
+	Returns the session count after which adding sessions raised the
+	throughput by less than `min_gain`, or None if it never levelled off.
+	"""
+	for previous, current in zip(results, results[1:]):
+		if current["throughput"] < previous["throughput"] * (1 + min_gain):
+			return previous
+	return None
+
+
+def _free_port():
+	with socket.socket() as sock:
+		sock.bind(("127.0.0.1", 0))
+		return sock.getsockname()[1]
+
+
+def start_app(config, log_path):
+	"""
+	Starts benchmarks/stub_app.py with Chainlit on a free local port.
+
+	Returns:
+		Tuple (process, base URL)
+	"""
+	port = _free_port()
+	env = dict(os.environ)
+	env.setdefault("CHAINLIT_AUTH_SECRET", secrets.token_hex(32))
+	env["BENCHMARK_BEDROCK"] = config["bedrock"]
+	env["BENCHMARK_LATENCY"] = str(config["latency"])
+	env["BENCHMARK_RECORDING"] = config["recording"]
+	env["BENCHMARK_WARM_CACHE"] = "true" if config["warm_cache"] else "false"
+	with open(log_path, "w") as log:
+		process = subprocess.Popen(
+			[sys.executable, "-m", "chainlit", "run", "benchmarks/stub_app.py", "--headless", "--host", "127.0.0.1", "--port", str(port)],
+			cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT,
+		)
+	return process, f"http://127.0.0.1:{port}"
+
+
+def wait_until_ready(base_url, process=None, timeout=60.0):
+	deadline = time.monotonic() + timeout
+	while time.monotonic() < deadline:
+		if process is not None and process.poll() is not None:
+			raise RuntimeError(f"The app exited with code {process.returncode}")
+		try:
+			if httpx.get(f"{base_url}/auth/config", timeout=1.0).status_code == 200:
+				return
+		except httpx.HTTPError:
+			pass
+		time.sleep(0.25)
+	raise TimeoutError(f"The app did not answer on {base_url} within {timeout:.0f} s")
+
+
+def print_stage(sessions, summary):
+	print(f"\n{sessions} sessions: {summary['throughput']:.2f} actions/s, {summary['errors']} errors")
+	print(f"  {'action':<20}{'count':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'1st token p50':>15}")
+	for action, values in summary["actions"].items():
+		first_token = "" if values["first_token_p50_ms"] is None else f"{values['first_token_p50_ms']:.0f}"
+		print(
+			f"  {action:<20}{values['count']:>7}{values['p50_ms']:>9.0f}{values['p95_ms']:>9.0f}"
+			f"{values['p99_ms']:>9.0f}{first_token:>15}"
+		)
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--url", help="Base URL of a running app; by default benchmarks/stub_app.py is started")
+	parser.add_argument("--stages", default="1,2,4,8,16", help="Comma separated numbers of concurrent sessions")
+	parser.add_argument("--actions", type=int, default=8, help="Actions per session and stage")
+	parser.add_argument("--think", type=float, default=0.0, help="Mean think time between two actions in seconds")
+	parser.add_argument("--timeout", type=float, default=120.0, help="Seconds to wait for an answer")
+	parser.add_argument("--min-gain", type=float, default=0.1, help="Throughput gain below which the app counts as saturated")
+	parser.add_argument("--corpus", help="Directory of food photos, a synthetic corpus is generated otherwise")
+	parser.add_argument("--bedrock", choices=["fake", "replay"], default="fake", help="Bedrock stand-in of the started app")
+	parser.add_argument("--latency", type=float, default=0.3, help="Latency of the fake Bedrock per call in seconds")
+	parser.add_argument("--recording", default="bedrock_recording.jsonl", help="JSONL file of recorded Bedrock calls to replay")
+	parser.add_argument("--warm-cache", action="store_true", help="Keep the analysis cache, repeated images become hits")
+	parser.add_argument("--seed", type=int, default=0)
+	parser.add_argument("--json", help="Write the results to this file")
+	args = parser.parse_args()
+
+	if args.corpus:
+		images = [Path(path) for path in load_corpus(args.corpus)]
+	else:
+		images = [Path(path) for path in make_food_corpus(os.path.join(tempfile.gettempdir(), "nutritrack_benchmark_corpus"))]
+	config = {
+		"actions": args.actions,
+		"think": args.think,
+		"timeout": args.timeout,
+		"bedrock": args.bedrock,
+		"latency": args.latency,
+		"recording": os.path.abspath(args.recording),
+		"warm_cache": args.warm_cache,
+	}
+
+	process = None
+	base_url = args.url
+	if base_url is None:
+		log_path = os.path.join(tempfile.gettempdir(), "nutritrack_load_test_app.log")
+		process, base_url = start_app(config, log_path)
+		print(f"Started the app on {base_url} with the {args.bedrock} Bedrock, log: {log_path}")
+	try:
+		wait_until_ready(base_url, process)
+		results = []
+		for sessions in (int(n) for n in args.stages.split(",")):
+			stage = asyncio.run(run_stage(base_url, sessions, images, config, args.seed))
+			summary = summarize(stage)
+			summary["sessions"] = sessions
+			results.append(summary)
+			print_stage(sessions, summary)
+			for action, error in stage["errors"][:3]:
+				print(f"  error in {action}: {error}")
+	finally:
+		if process is not None:
+			process.terminate()
+			process.wait(timeout=30)
+
+	saturation = find_saturation(results, args.min_gain)
+	if saturation is None:
+		print(f"\nNo saturation up to {results[-1]['sessions']} sessions")
+	else:
+		print(f"\nSaturation at about {saturation['sessions']} sessions ({saturation['throughput']:.2f} actions/s)")
+
+	if args.json:
+		with open(args.json, "w") as output:
+			json.dump({"stages": results, "saturation_sessions": saturation and saturation["sessions"]}, output, indent=2)
+	if any(result["errors"] for result in results):
+		sys.exit(1)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,94 @@
+"""
+Builds a nutrition index from a synthetic Open Food Facts JSONL export and
+measures barcode and product name lookups.
+
+Usage:
+	python -m benchmarks.nutrition_index_benchmark --products 100000 --lookups 2000
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.e2e_benchmark import percentile
+from src.storage.nutrition_index import NutritionIndex, read_open_food_facts
+
+BRANDS = ["Alpina", "Nordfarm", "Casa Verde", "Golden Fields", "Mirabel", "Sunvalley", "Kronberg", "Belle Ferme"]
+KINDS = ["Yogurt", "Granola", "Crackers", "Chocolate Bar", "Pasta", "Tomato Sauce", "Muesli", "Cheese", "Biscuits", "Juice"]
+FLAVOURS = ["Strawberry", "Hazelnut", "Vanilla", "Whole Wheat", "Dark", "Classic", "Honey", "Organic", "Lemon", "Spicy"]
+
+
+def synthetic_products(count, seed):
+	rng = random.Random(seed)
+	for i in range(count):
+		yield {
+			"code": f"{4000000000000 + i * 7919 % 999999999999:013d}",
+			"product_name": f"{rng.choice(FLAVOURS)} {rng.choice(KINDS)} {i}",
+			"brands": rng.choice(BRANDS),
+			"origins": rng.choice(["France", "Italy", "Switzerland", ""]),
+			"ingredients_text": "wheat flour, sugar, palm oil (10%), salt, emulsifier (soy lecithin)",
+			"product_quantity": rng.choice(["", "125", "250", "400", "1000"]),
+			"nutriments": {
+				"energy-kcal_100g": rng.uniform(20, 550),
+				"proteins_100g": rng.uniform(0, 25),
+				"fat_100g": rng.uniform(0, 35),
+				"carbohydrates_100g": rng.uniform(0, 80),
+				"sugars_100g": rng.uniform(0, 50),
+				"fiber_100g": rng.uniform(0, 10),
+				"sodium_100g": rng.uniform(0, 1.5),
+			},
+		}
+
+def time_lookups(func, queries):
+	latencies = []
+	hits = 0
+	for query in queries:
+		start = time.perf_counter()
+		result = func(query)
+		latencies.append(time.perf_counter() - start)
+		hits += bool(result)
+	latencies.sort()
+	return hits, latencies
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--products", type=int, default=100000)
+	parser.add_argument("--lookups", type=int, default=2000)
+	parser.add_argument("--seed", type=int, default=0)
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as directory:
+		export = os.path.join(directory, "products.jsonl.gz")
+		with gzip.open(export, "wt", encoding="utf-8") as file:
+			for product in synthetic_products(args.products, args.seed):
+				file.write(json.dumps(product) + "\n")
+
+		db_path = os.path.join(directory, "nutrition_index.db")
+		start = time.perf_counter()
+		index = NutritionIndex(db_path, read_only=False)
+		_, indexed = index.import_products(read_open_food_facts(export))
+		index.close()
+		build = time.perf_counter() - start
+		print(f"Built index of {indexed} products in {build:.1f}s ({indexed / build:.0f} products/s), {os.path.getsize(db_path) / 1e6:.1f} MB")
+
+		index = NutritionIndex(db_path)
+		products = list(synthetic_products(args.products, args.seed))
+		rng = random.Random(args.seed + 1)
+		sample = [rng.choice(products) for _ in range(args.lookups)]
+		scenarios = {
+			"barcode": (index.lookup_barcode, [product["code"] for product in sample]),
+			"name (exact)": (index.match, [product["product_name"] for product in sample]),
+			"name (brand first)": (index.match, [f"{product['brands']} {product['product_name']}" for product in sample]),
+			"name (unknown)": (index.match, [f"Imported {rng.choice(KINDS)} Deluxe" for _ in sample]),
+		}
+		print(f"{'lookup':<20}{'hits':>7}{'p50 ms':>9}{'p99 ms':>9}")
+		for name, (func, queries) in scenarios.items():
+			hits, latencies = time_lookups(func, queries)
+			print(f"{name:<20}{hits:>7}{percentile(latencies, 50) * 1000:>9.3f}{percentile(latencies, 99) * 1000:>9.3f}")
+		index.close()
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,141 @@
+"""
+Measures the serialization of Bedrock request bodies: the legacy path, which
+rebuilds the tool definitions and runs json.dumps over the whole payload,
+against the pre-encoded templates spliced by encode_payload(), with the json
+module and, when installed, orjson.
+
+Each variant runs in a fresh process, the JSON backend being chosen at import.
+Times include building the payload; allocations are the peak traced by
+tracemalloc while building and encoding one body.
+
+Usage:
+	python -m benchmarks.payload_benchmark --runs 200
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from benchmarks.corpus import make_food_corpus
+from benchmarks.e2e_benchmark import percentile
+
+QUESTION = "How many calories are in this?"
+GOAL = "Extract structured data"
+
+# Variant -> JSON_BACKEND of its process
+VARIANTS = {
+	"legacy json.dumps": "json",
+	"templates, json": "json",
+	"templates, orjson": "orjson",
+}
+
+
+def make_noise_photo(path, size=(1800, 1350)):
+	"""
+	Writes a photo that hardly compresses, so its body stays close to the 2 MB image limit.
+	"""
+	pixels = np.random.default_rng(0).integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)
+	Image.fromarray(pixels).save(path, "JPEG", quality=90)
+
+def legacy_body(input_text, images):
+	"""
+	The body as built before the templates: tools rebuilt around the schema,
+	then json.dumps of the whole payload, encoded to bytes by botocore.
+	"""
+	import json
+	from src.config.schemas import get_analysis_schema
+	from src.model import query_claude_3_7
+
+	if images:
+		tools = query_claude_3_7._create_structured_data_tools(get_analysis_schema())
+		payload = query_claude_3_7.create_bedrock_payload(input_text, images, query_claude_3_7.STRUCTURED_DATA_SYSTEM_PROMPT, tools)
+	else:
+		payload = query_claude_3_7._create_explanation_payload(input_text, {"product": {"name": "Greek yogurt"}})
+	_, payload = query_claude_3_7._route_payload(payload, GOAL)
+	return json.dumps(payload).encode("utf-8")
+
+def template_body(input_text, images):
+	"""
+	The current body: pre-encoded system prompt, tools and parameters spliced with the request's parts.
+	"""
+	from src.config.schemas import get_analysis_schema
+	from src.model import query_claude_3_7
+	from src.utils.payload_encoder import encode_payload
+
+	if images:
+		payload = query_claude_3_7._create_structured_data_payload(input_text, get_analysis_schema(), images)
+	else:
+		payload = query_claude_3_7._create_explanation_payload(input_text, {"product": {"name": "Greek yogurt"}})
+	_, payload = query_claude_3_7._route_payload(payload, GOAL)
+	return encode_payload(payload)
+
+def _measure(variant, images, runs, results):
+	os.environ["JSON_BACKEND"] = VARIANTS[variant]
+	from src.utils import payload_encoder
+	from src.utils.image_processor import prepare_image_base64
+
+	if VARIANTS[variant] == "orjson" and not payload_encoder.use_orjson:
+		results[variant] = None
+		return
+	build = legacy_body if variant.startswith("legacy") else template_body
+	measurements = {}
+	for name, path in images:
+		prepared = [prepare_image_base64(Path(path))] if path else None
+		build(QUESTION, prepared)
+
+		latencies = []
+		for _ in range(runs):
+			start = time.perf_counter()
+			body = build(QUESTION, prepared)
+			latencies.append(time.perf_counter() - start)
+		latencies.sort()
+
+		tracemalloc.start()
+		build(QUESTION, prepared)
+		_, peak = tracemalloc.get_traced_memory()
+		tracemalloc.stop()
+		measurements[name] = (percentile(latencies, 50), peak, len(body))
+	results[variant] = measurements
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--runs", type=int, default=200)
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as directory:
+		corpus = {Path(path).name: path for path in make_food_corpus(directory)}
+		images = [
+			("no image (explanation)", None),
+			("1024 px photo", corpus["resized_1024.jpg"]),
+			("12 MP photo", corpus["phone_12mp.jpg"]),
+			("noisy photo", os.path.join(directory, "noise.jpg")),
+		]
+		make_noise_photo(images[-1][1])
+
+		context = multiprocessing.get_context("spawn")
+		with context.Manager() as manager:
+			results = manager.dict()
+			for variant in VARIANTS:
+				process = context.Process(target=_measure, args=(variant, images, args.runs, results))
+				process.start()
+				process.join()
+			results = dict(results)
+
+	print(f"Median of {args.runs} runs per request body")
+	print(f"{'payload':<26}{'variant':<22}{'body KB':>10}{'p50 us':>10}{'peak alloc KB':>15}")
+	for name, _ in images:
+		for variant in VARIANTS:
+			if results.get(variant) is None:
+				print(f"{name:<26}{variant:<22}{'orjson not installed':>35}")
+				continue
+			seconds, peak, size = results[variant][name]
+			print(f"{name:<26}{variant:<22}{size / 1024:>10.1f}{seconds * 1e6:>10.0f}{peak / 1024:>15.0f}")
+
+if __name__ == "__main__":
+	main()
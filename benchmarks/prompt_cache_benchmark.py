@@ -0,0 +1,127 @@
+"""
+Measures the effect of Bedrock prompt caching against a stubbed Bedrock that
+charges a prefill time per uncached input token.
+
+Two call sites are measured, with caching off and on:
+- extraction: the structured data call, cached prefix = tool schema + system prompt
+- follow-up: streamed follow-up questions on the same product, cached prefix = product JSON
+
+Prefixes shorter than --min-cache-tokens are not cached, like on Bedrock
+(1024 tokens for Claude 3.7 Sonnet). Pass --min-cache-tokens 0 to see the
+savings a prefix above the minimum would bring.
+
+Usage:
+	python -m benchmarks.prompt_cache_benchmark --requests 10 --prefill 0.3
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.stubs import SAMPLE_STRUCTURED_DATA, FakeBedrockRuntime, NullTrace, _cached_prefix, _estimate_tokens
+from src.config.schemas import get_analysis_schema
+import src.model.query_claude_3_7 as query_claude_3_7
+
+
+def make_stub(args):
+	stub = FakeBedrockRuntime(
+		latency=args.latency,
+		prefill_per_1k=args.prefill,
+		min_cache_tokens=args.min_cache_tokens
+	)
+	query_claude_3_7.bedrock_runtime = stub
+	return stub
+
+def summarize(stub, elapsed, requests):
+	return {
+		"latency_ms": elapsed / requests * 1000,
+		"input_tokens": stub.input_tokens / requests,
+		"cache_read": stub.cache_read_input_tokens / requests,
+		"cache_write": stub.cache_creation_input_tokens / requests,
+	}
+
+async def run_extraction(args, prompt_cache):
+	"""
+	Runs single-call extractions one after the other, as for successive uploads.
+	"""
+	stub = make_stub(args)
+	start = time.perf_counter()
+	for _ in range(args.requests):
+		result = await query_claude_3_7.function_calling_query_async(
+			input_text="How many calories are in this?",
+			json_schema=get_analysis_schema(),
+			trace=NullTrace(),
+			single_call=True,
+			prompt_cache=prompt_cache
+		)
+		assert result["explanation"]
+	return summarize(stub, time.perf_counter() - start, args.requests)
+
+async def run_follow_up(args, prompt_cache):
+	"""
+	Streams follow-up questions on the same products and measures the time to first token.
+	"""
+	stub = make_stub(args)
+	products = {"products": [SAMPLE_STRUCTURED_DATA] * args.context_products}
+	context = f"Here is the last known product information:\n\n```json\n{json.dumps(products, indent=2)}\n```"
+
+	first_token_times = []
+	start = time.perf_counter()
+	for i in range(args.requests):
+		sent_at = time.perf_counter()
+		first_token_at = None
+
+		async def on_text(token):
+			nonlocal first_token_at
+			if first_token_at is None:
+				first_token_at = time.perf_counter()
+
+		await query_claude_3_7.query_claude_3_7_async(
+			f"Question {i}: is this healthy?",
+			trace=NullTrace(),
+			goal="Answer user question",
+			on_text=on_text,
+			context=context,
+			prompt_cache=prompt_cache
+		)
+		first_token_times.append(first_token_at - sent_at)
+	result = summarize(stub, time.perf_counter() - start, args.requests)
+	result["ttft_ms"] = sum(first_token_times) / len(first_token_times) * 1000
+	return result
+
+def prefix_tokens(args):
+	"""
+	Estimated size of each cached prefix, to compare with the caching minimum.
+	"""
+	extraction = query_claude_3_7._create_structured_data_payload(
+		"How many calories are in this?", get_analysis_schema(), with_answer=True, cache_prefix=True
+	)
+	products = {"products": [SAMPLE_STRUCTURED_DATA] * args.context_products}
+	follow_up = query_claude_3_7.create_bedrock_payload(
+		"Question", context=json.dumps(products, indent=2), cache_context=True
+	)
+	return _estimate_tokens(_cached_prefix(extraction)), _estimate_tokens(_cached_prefix(follow_up))
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument("--requests", type=int, default=10)
+	parser.add_argument("--latency", type=float, default=0.2, help="Fake Bedrock latency per call in seconds")
+	parser.add_argument("--prefill", type=float, default=0.3, help="Seconds per 1000 uncached input tokens")
+	parser.add_argument("--min-cache-tokens", type=int, default=1024, help="Shortest prefix the stub caches")
+	parser.add_argument("--context-products", type=int, default=3, help="Products in the follow-up context")
+	args = parser.parse_args()
+
+	extraction_prefix, follow_up_prefix = prefix_tokens(args)
+	print(f"Estimated cached prefix: extraction {extraction_prefix} tokens, follow-up {follow_up_prefix} tokens "
+		  f"(minimum {args.min_cache_tokens})")
+	print()
+	print(f"{'site':<12}{'cache':<7}{'latency ms':>12}{'ttft ms':>10}{'in tokens':>12}{'read':>8}{'write':>8}")
+	for site, run in (("extraction", run_extraction), ("follow-up", run_follow_up)):
+		for name, prompt_cache in (("off", False), ("on", True)):
+			r = asyncio.run(run(args, prompt_cache))
+			ttft = f"{r['ttft_ms']:.0f}" if "ttft_ms" in r else "-"
+			print(f"{site:<12}{name:<7}{r['latency_ms']:>12.0f}{ttft:>10}{r['input_tokens']:>12.0f}"
+				  f"{r['cache_read']:>8.0f}{r['cache_write']:>8.0f}")
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,143 @@
+"""
+Record/replay stand-ins for the bedrock-runtime client.
+
+RecordingBedrockRuntime wraps a real client and appends every request/response
+pair to a JSONL file. ReplayBedrockRuntime serves those pairs back, with the
+recorded latency, so benchmarks run offline on real model output.
+"""
+import hashlib
+import json
+import threading
+import time
+from io import BytesIO
+
+
+def request_key(body):
+	"""
+	Identifies a request by the SHA-256 of its JSON body.
+	"""
+	if isinstance(body, str):
+		body = body.encode("utf-8")
+	return hashlib.sha256(body).hexdigest()
+
+def _uses_tools(body):
+	return bool(json.loads(body).get("tools"))
+
+
+class RecordingBedrockRuntime:
+	"""
+	Forwards calls to a real bedrock-runtime client and records them.
+	"""
+
+	def __init__(self, client, path):
+		"""
+		Args:
+			client: boto3 bedrock-runtime client
+			path: JSONL file the calls are appended to
+		"""
+		self.client = client
+		self.path = path
+		self._lock = threading.Lock()
+
+	def _write(self, record):
+		with self._lock, open(self.path, "a", encoding="utf-8") as recording:
+			recording.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+	def invoke_model(self, modelId, body, contentType=None, accept=None):
+		start = time.perf_counter()
+		response = self.client.invoke_model(modelId=modelId, body=body, contentType=contentType, accept=accept)
+		response_body = json.loads(response["body"].read())
+		self._write({
+			"key": request_key(body),
+			"kind": "invoke",
+			"tools": _uses_tools(body),
+			"latency": time.perf_counter() - start,
+			"response": response_body,
+		})
+		return {"body": BytesIO(json.dumps(response_body).encode("utf-8"))}
+
+	def invoke_model_with_response_stream(self, modelId, body, contentType=None, accept=None):
+		start = time.perf_counter()
+		response = self.client.invoke_model_with_response_stream(
+			modelId=modelId, body=body, contentType=contentType, accept=accept
+		)
+		return {"body": self._record_stream(response["body"], body, start)}
+
+	def _record_stream(self, stream, body, start):
+		events = []
+		for event in stream:
+			chunk = event.get("chunk")
+			if chunk:
+				events.append([time.perf_counter() - start, json.loads(chunk["bytes"])])
+			yield event
+		self._write({
+			"key": request_key(body),
+			"kind": "stream",
+			"tools": _uses_tools(body),
+			"events": events,
+		})
+
+
+class ReplayBedrockRuntime:
+	"""
+	Serves recorded responses, matched on the exact request body.
+
+	With `strict=False`, a request that was not recorded gets the next recorded
+	response of the same kind (plain or streamed, with or without tools), which
+	keeps replays usable when prompts or images change.
+	"""
+
+	def __init__(self, path, strict=True, speed=1.0):
+		"""
+		Args:
+			path: JSONL file written by RecordingBedrockRuntime
+			strict: Raise on requests that were not recorded
+			speed: Replay speed, 2.0 halves the recorded latencies and 0 removes them
+		"""
+		self.strict = strict
+		self.speed = speed
+		self.calls = 0
+		self._records = {}
+		self._by_kind = {}
+		self._next = {}
+		self._lock = threading.Lock()
+		with open(path, encoding="utf-8") as recording:
+			for line in recording:
+				if line.strip():
+					record = json.loads(line)
+					self._records.setdefault((record["kind"], record["key"]), record)
+					self._by_kind.setdefault((record["kind"], record["tools"]), []).append(record)
+
+	def _find(self, kind, body):
+		record = self._records.get((kind, request_key(body)))
+		if record is not None:
+			return record
+		candidates = self._by_kind.get((kind, _uses_tools(body)))
+		if self.strict or not candidates:
+			raise KeyError(f"No recorded {kind} response for this request")
+		with self._lock:
+			index = self._next.get((kind, _uses_tools(body)), 0)
+			self._next[(kind, _uses_tools(body))] = index + 1
+		return candidates[index % len(candidates)]
+
+	def _sleep(self, seconds):
+		if self.speed > 0 and seconds > 0:
+			time.sleep(seconds / self.speed)
+
+	def invoke_model(self, modelId, body, contentType=None, accept=None):
+		self.calls += 1
+		record = self._find("invoke", body)
+		self._sleep(record["latency"])
+		return {"body": BytesIO(json.dumps(record["response"]).encode("utf-8"))}
+
+	def invoke_model_with_response_stream(self, modelId, body, contentType=None, accept=None):
+		self.calls += 1
+		record = self._find("stream", body)
+		return {"body": self._replay_stream(record["events"])}
+
+	def _replay_stream(self, events):
+		elapsed = 0.0
+		for offset, event in events:
+			self._sleep(offset - elapsed)
+			elapsed = offset
+			yield {"chunk": {"bytes": json.dumps(event).encode("utf-8")}}
@@ -0,0 +1,54 @@
+"""
+Compares the two-call and single-call modes of function_calling_query against a stubbed Bedrock.
+
+Usage:
+	python -m benchmarks.single_call_benchmark --requests 20 --latency 0.3
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks.stubs import FakeBedrockRuntime, NullTrace
+from src.config.schemas import get_analysis_schema
+import src.model.query_claude_3_7 as query_claude_3_7
+
+
+async def run_mode(requests, latency, single_call, answer_rate):
+	"""
+	Runs the requests one after the other and returns latency and token totals.
+	"""
+	stub = FakeBedrockRuntime(latency=latency, answer_rate=answer_rate)
+	query_claude_3_7.bedrock_runtime = stub
+
+	start = time.perf_counter()
+	for i in range(requests):
+		result = await query_claude_3_7.function_calling_query_async(
+			input_text="How many calories are in this?",
+			json_schema=get_analysis_schema(),
+			trace=NullTrace(),
+			single_call=single_call
+		)
+		assert result["explanation"]
+	elapsed = time.perf_counter() - start
+
+	return {
+		"latency_ms": elapsed / requests * 1000,
+		"calls": stub.calls / requests,
+		"input_tokens": stub.input_tokens / requests,
+		"output_tokens": stub.output_tokens / requests,
+	}
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument("--requests", type=int, default=20)
+	parser.add_argument("--latency", type=float, default=0.3, help="Fake Bedrock latency per call in seconds")
+	parser.add_argument("--answer-rate", type=float, default=0.95, help="Share of single calls returning an answer")
+	args = parser.parse_args()
+
+	print(f"{'mode':<12}{'latency ms':>12}{'calls':>8}{'in tokens':>12}{'out tokens':>12}")
+	for name, single_call in (("two-call", False), ("single-call", True)):
+		r = asyncio.run(run_mode(args.requests, args.latency, single_call, args.answer_rate))
+		print(f"{name:<12}{r['latency_ms']:>12.0f}{r['calls']:>8.2f}{r['input_tokens']:>12.0f}{r['output_tokens']:>12.0f}")
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,38 @@
+"""
+Chainlit entry point serving the app against a local Bedrock stand-in, for load tests.
+
+Tracing is off unless TRACING_MODE is set. The stand-in is chosen with:
+	BENCHMARK_BEDROCK     fake (default) or replay
+	BENCHMARK_LATENCY     seconds per call of the fake Bedrock (default 0.3)
+	BENCHMARK_RECORDING   JSONL file replayed with BENCHMARK_BEDROCK=replay
+	BENCHMARK_WARM_CACHE  "true" keeps the analysis cache, so repeated images become hits
+
+Usage:
+	chainlit run benchmarks/stub_app.py --headless
+"""
+import os
+import sys
+from pathlib import Path
+
+# Chainlit loads this file by path, the repository root is not on sys.path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("TRACING_MODE", "off")
+
+import src.model.query_claude_3_7 as query_claude_3_7
+import src.utils.analysis_cache as analysis_cache
+from benchmarks.recording import ReplayBedrockRuntime
+from benchmarks.stubs import FakeBedrockRuntime
+
+if os.getenv("BENCHMARK_BEDROCK", "fake") == "replay":
+	query_claude_3_7.bedrock_runtime = ReplayBedrockRuntime(
+		os.getenv("BENCHMARK_RECORDING", "bedrock_recording.jsonl"), strict=False
+	)
+else:
+	query_claude_3_7.bedrock_runtime = FakeBedrockRuntime(latency=float(os.getenv("BENCHMARK_LATENCY", "0.3")))
+
+if os.getenv("BENCHMARK_WARM_CACHE", "false").lower() != "true":
+	# Every upload misses, as for first-time photos
+	analysis_cache._analysis_cache = analysis_cache.AnalysisCache(max_entries=0, phash_distance=0)
+
+# Registers the Chainlit callbacks of the app
+import main  # noqa: E402,F401
@@ -0,0 +1,251 @@
+"""
+Local stand-ins for Bedrock and Langfuse used by the benchmarks.
+"""
+import hashlib
+import json
+import threading
+import time
+from io import BytesIO
+
+from botocore.exceptions import ClientError
+
+
+SAMPLE_STRUCTURED_DATA = {
+	"product": {
+		"name": "Greek yogurt",
+		"origin": "Switzerland",
+		"ingredients": ["milk", "cream", "live cultures"],
+		"nutritive_value": {
+			"calories": 120,
+			"protein": 10,
+			"fat": 5,
+			"carbohydrates": 8,
+			"sugar": 6,
+			"fiber": 0,
+			"sodium": 50
+		}
+	}
+}
+
+SAMPLE_EXPLANATION = "This yogurt provides 120 kcal and 10 g of protein per serving. It is a good source of protein with moderate sugar."
+
+
+def _estimate_tokens(value):
+	return len(json.dumps(value)) // 4
+
+
+def _cached_prefix(payload):
+	"""
+	Returns the prefix up to the last cache_control breakpoint, walking tools,
+	system and message content in the order Bedrock caches them.
+	"""
+	blocks = list(payload.get("tools") or [])
+	if isinstance(payload.get("system"), list):
+		blocks += payload["system"]
+	elif payload.get("system"):
+		blocks.append(payload["system"])
+	for message in payload.get("messages", []):
+		blocks += message["content"]
+
+	prefix = []
+	for index, block in enumerate(blocks):
+		if isinstance(block, dict) and "cache_control" in block:
+			prefix = blocks[:index + 1]
+	return prefix
+
+
+class FakeBedrockRuntime:
+	"""
+	Mimics the boto3 bedrock-runtime client with a fixed latency per call,
+	plus an optional prefill time per uncached input token and a prompt cache.
+	"""
+
+	def __init__(self, latency=0.5, answer_rate=1.0, prefill_per_1k=0.0, min_cache_tokens=1024, cache_ttl=300):
+		"""
+		Args:
+			latency: Seconds each call takes
+			answer_rate: Share of tool calls filling the optional `answer` field when the tool offers it
+			prefill_per_1k: Extra seconds per 1000 input tokens not read from the prompt cache
+			min_cache_tokens: Shortest prefix that is cached, shorter breakpoints are ignored
+			cache_ttl: Seconds a cached prefix lives after its last use
+		"""
+		self.latency = latency
+		self.answer_rate = answer_rate
+		self.prefill_per_1k = prefill_per_1k
+		self.min_cache_tokens = min_cache_tokens
+		self.cache_ttl = cache_ttl
+		self.calls = 0
+		self.input_tokens = 0
+		self.output_tokens = 0
+		self.cache_read_input_tokens = 0
+		self.cache_creation_input_tokens = 0
+		self._tool_calls = 0
+		self._prompt_cache = {}
+
+	def _cache_usage(self, payload):
+		"""
+		Splits the input tokens into uncached, cache read and cache write tokens.
+		"""
+		total = _estimate_tokens(payload)
+		prefix = _cached_prefix(payload)
+		prefix_tokens = _estimate_tokens(prefix) if prefix else 0
+		usage = {"input_tokens": total}
+		if prefix_tokens < self.min_cache_tokens or not prefix_tokens:
+			return usage
+
+		now = time.time()
+		key = hashlib.sha256(json.dumps(prefix, sort_keys=True).encode("utf-8")).hexdigest()
+		if self._prompt_cache.get(key, 0) > now:
+			usage["cache_read_input_tokens"] = prefix_tokens
+			usage["cache_creation_input_tokens"] = 0
+		else:
+			usage["cache_read_input_tokens"] = 0
+			usage["cache_creation_input_tokens"] = prefix_tokens
+		self._prompt_cache[key] = now + self.cache_ttl
+		usage["input_tokens"] = total - prefix_tokens
+		return usage
+
+	def _prefill_time(self, usage):
+		# Cache reads skip the prefill, cache writes cost the same as plain input
+		uncached = usage["input_tokens"] + usage.get("cache_creation_input_tokens", 0)
+		return self.prefill_per_1k * uncached / 1000
+
+	def _response_body(self, payload):
+		if payload.get("tools"):
+			tool_input = {"structured_data": SAMPLE_STRUCTURED_DATA}
+			if "answer" in payload["tools"][0]["input_schema"]["properties"]:
+				# Deterministically fill the answer for answer_rate of the calls
+				self._tool_calls += 1
+				if int(self._tool_calls * self.answer_rate) > int((self._tool_calls - 1) * self.answer_rate):
+					tool_input["answer"] = SAMPLE_EXPLANATION
+			content = [{
+				"type": "tool_use",
+				"id": "toolu_fake",
+				"name": payload["tools"][0]["name"],
+				"input": tool_input
+			}]
+		else:
+			content = [{"type": "text", "text": SAMPLE_EXPLANATION}]
+		usage = self._cache_usage(payload)
+		usage["output_tokens"] = _estimate_tokens(content)
+		self.input_tokens += usage["input_tokens"]
+		self.output_tokens += usage["output_tokens"]
+		self.cache_read_input_tokens += usage.get("cache_read_input_tokens", 0)
+		self.cache_creation_input_tokens += usage.get("cache_creation_input_tokens", 0)
+		return {
+			"id": "msg_fake",
+			"type": "message",
+			"role": "assistant",
+			"model": "fake",
+			"content": content,
+			"usage": usage
+		}
+
+	def invoke_model(self, modelId, body, contentType=None, accept=None):
+		self.calls += 1
+		payload = json.loads(body)
+		response_body = self._response_body(payload)
+		time.sleep(self.latency + self._prefill_time(response_body["usage"]))
+		return {"body": BytesIO(json.dumps(response_body).encode("utf-8"))}
+
+	def _stream_events(self, response_body, token_interval):
+		def chunk(event):
+			return {"chunk": {"bytes": json.dumps(event).encode("utf-8")}}
+
+		yield chunk({
+			"type": "message_start",
+			"message": {
+				"id": response_body["id"],
+				"model": response_body["model"],
+				"usage": {**response_body["usage"], "output_tokens": 1}
+			}
+		})
+		yield chunk({"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}})
+		for word in response_body["content"][0]["text"].split(" "):
+			time.sleep(token_interval)
+			yield chunk({"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": word + " "}})
+		yield chunk({"type": "content_block_stop", "index": 0})
+		yield chunk({
+			"type": "message_delta",
+			"delta": {"stop_reason": "end_turn"},
+			"usage": {"output_tokens": response_body["usage"]["output_tokens"]}
+		})
+		yield chunk({"type": "message_stop"})
+
+	def invoke_model_with_response_stream(self, modelId, body, contentType=None, accept=None):
+		"""
+		Streams the text response word by word; the first word arrives after a tenth
+		of the latency plus the prefill time.
+		"""
+		self.calls += 1
+		payload = json.loads(body)
+		response_body = self._response_body(payload)
+		time.sleep(self.latency / 10 + self._prefill_time(response_body["usage"]))
+		words = len(response_body["content"][0]["text"].split(" "))
+		return {"body": self._stream_events(response_body, self.latency * 0.9 / words)}
+
+
+class ThrottlingBedrockRuntime:
+	"""
+	Wraps a Bedrock stand-in with an account quota: calls beyond `rate` per
+	second (token bucket of `burst` calls) fail with a ThrottlingException,
+	after `reject_latency` seconds, like Bedrock on-demand throughput.
+	"""
+
+	def __init__(self, client, rate=10.0, burst=None, reject_latency=0.02):
+		self.client = client
+		self.rate = rate
+		self.burst = burst if burst is not None else rate
+		self.reject_latency = reject_latency
+		self.attempts = 0
+		self.throttled = 0
+		self._tokens = self.burst
+		self._updated = time.monotonic()
+		self._lock = threading.Lock()
+
+	def _admit(self):
+		with self._lock:
+			self.attempts += 1
+			now = time.monotonic()
+			self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+			self._updated = now
+			if self._tokens >= 1:
+				self._tokens -= 1
+				return
+			self.throttled += 1
+		time.sleep(self.reject_latency)
+		raise ClientError(
+			{"Error": {"Code": "ThrottlingException", "Message": "Too many requests, please wait before trying again."}},
+			"InvokeModel"
+		)
+
+	def invoke_model(self, **kwargs):
+		self._admit()
+		return self.client.invoke_model(**kwargs)
+
+	def invoke_model_with_response_stream(self, **kwargs):
+		self._admit()
+		return self.client.invoke_model_with_response_stream(**kwargs)
+
+
+class _NullObservation:
+	def end(self, **kwargs):
+		pass
+
+	def update(self, **kwargs):
+		pass
+
+
+class NullTrace:
+	"""
+	Langfuse trace replacement that records nothing.
+	"""
+
+	def span(self, **kwargs):
+		return _NullObservation()
+
+	def generation(self, **kwargs):
+		return _NullObservation()
+
+	def update(self, **kwargs):
+		pass
@@ -0,0 +1,88 @@
+"""
+Compares how the Bedrock calls fare against an account quota without retries,
+with retries only, and with retries behind the adaptive concurrency limiter.
+
+The fake Bedrock throttles calls beyond --quota per second. Half of the
+sessions make interactive calls, the other half bulk calls, to show the
+priority given to interactive ones.
+
+Usage:
+	python -m benchmarks.throttling_benchmark --sessions 32 --calls 10 --quota 10 --latency 0.3
+"""
+import argparse
+import asyncio
+import time
+
+import src.model.query_claude_3_7 as query_claude_3_7
+import src.utils.bedrock_limiter as bedrock_limiter
+from benchmarks.e2e_benchmark import percentile
+from benchmarks.stubs import FakeBedrockRuntime, NullTrace, ThrottlingBedrockRuntime
+from src.config.model_routes import get_model_route
+from src.utils.bedrock_runtime import bedrock_max_in_flight
+
+GOAL = "Answer user question"
+PAYLOAD = {
+	"anthropic_version": "bedrock-2023-05-31",
+	"max_tokens": 200,
+	"messages": [{"role": "user", "content": [{"type": "text", "text": "Is a banana a healthy snack?"}]}],
+}
+
+
+def make_guard(mode, circuit_reset):
+	breaker = bedrock_limiter.CircuitBreaker(failure_threshold=5, reset_timeout=circuit_reset)
+	if mode == "none":
+		return bedrock_limiter.BedrockGuard(max_attempts=1)
+	if mode == "retry":
+		return bedrock_limiter.BedrockGuard(breaker=breaker, max_attempts=4)
+	limiter = bedrock_limiter.AdaptiveLimiter(initial_limit=bedrock_max_in_flight, max_limit=bedrock_max_in_flight)
+	return bedrock_limiter.BedrockGuard(limiter=limiter, breaker=breaker, max_attempts=4)
+
+async def run_mode(sessions, calls):
+	latencies = {"interactive": [], "bulk": []}
+	failures = {}
+
+	async def session(priority):
+		with bedrock_limiter.bedrock_priority(priority):
+			for _ in range(calls):
+				start = time.perf_counter()
+				try:
+					await query_claude_3_7.invoke_claude_model_async(PAYLOAD, NullTrace(), goal=GOAL)
+				except Exception as e:
+					name = bedrock_limiter.error_code(e) or type(e).__name__
+					failures[name] = failures.get(name, 0) + 1
+				else:
+					latencies[priority].append(time.perf_counter() - start)
+
+	start = time.perf_counter()
+	await asyncio.gather(*[session("interactive" if i % 2 == 0 else "bulk") for i in range(sessions)])
+	return latencies, failures, time.perf_counter() - start
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--sessions", type=int, default=32)
+	parser.add_argument("--calls", type=int, default=10, help="Calls per session")
+	parser.add_argument("--quota", type=float, default=10.0, help="Calls per second accepted by the fake Bedrock")
+	parser.add_argument("--latency", type=float, default=0.3, help="Fake Bedrock latency per call in seconds")
+	parser.add_argument("--circuit-reset", type=float, default=5.0, help="Seconds the circuit stays open")
+	args = parser.parse_args()
+
+	print(f"{args.sessions} sessions x {args.calls} calls, quota {args.quota:.0f} calls/s, latency {args.latency:.2f}s")
+	print(f"{'mode':<10}{'ok':>6}{'failed':>8}{'ok/s':>7}{'attempts':>10}{'throttled':>11}{'interactive p95':>17}{'bulk p95':>10}")
+	for mode in ("none", "retry", "adaptive"):
+		bedrock = ThrottlingBedrockRuntime(FakeBedrockRuntime(latency=args.latency), rate=args.quota)
+		query_claude_3_7.bedrock_runtime = bedrock
+		bedrock_limiter._bedrock_guards = {get_model_route(GOAL).model_id: make_guard(mode, args.circuit_reset)}
+
+		latencies, failures, wall = asyncio.run(run_mode(args.sessions, args.calls))
+		succeeded = len(latencies["interactive"]) + len(latencies["bulk"])
+		interactive = sorted(latencies["interactive"])
+		bulk = sorted(latencies["bulk"])
+		print(
+			f"{mode:<10}{succeeded:>6}{sum(failures.values()):>8}{succeeded / wall:>7.1f}{bedrock.attempts:>10}{bedrock.throttled:>11}"
+			f"{percentile(interactive, 95):>16.2f}s{percentile(bulk, 95):>9.2f}s"
+		)
+		if failures:
+			print(f"{'':<10}failures: " + ", ".join(f"{name} x{count}" for name, count in sorted(failures.items())))
+
+if __name__ == "__main__":
+	main()
@@ -1,7 +1,24 @@
 import chainlit as cl
 import asyncio
 
+from src.handlers.history_prompt import get_history_renderer
 from src.handlers.message_handler import process_message
+from src.storage.consumption_store import get_consumption_store
+from src.storage.nutrition_ledger import get_nutrition_ledger
+from src.storage.session_context import get_session_context
+from src.utils.bedrock_limiter import BedrockUnavailableError, is_throttling
+from src.utils.image_executor import get_image_executor
+from src.utils.metrics import (
+	metrics_enabled,
+	metrics_local_only,
+	metrics_loop_lag_interval,
+	metrics_path,
+	monitor_event_loop_lag,
+	mount_metrics,
+	stage_timer,
+)
+from src.utils.progress import ProgressReporter
+from src.utils.tracing import get_tracer
 
 import chainlit as cl
 from chainlit import AskUserMessage, Message, on_chat_start
@@ -9,26 +26,20 @@ from chainlit import AskUserMessage, Message, on_chat_start
 from typing import Optional
 import chainlit as cl
 
-from langfuse import Langfuse
 from dotenv import load_dotenv
 import os
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Retrieve the keys from environment variables
-secret_key = os.getenv("LANGFUSE_SECRET_KEY")
-public_key = os.getenv("LANGFUSE_PUBLIC_KEY")
-host = os.getenv("LANGFUSE_HOST")
+# Stream answers token by token into the chat
+stream_responses = os.getenv("STREAM_RESPONSES", "true").lower() == "true"
 
-langfuse = Langfuse(
-	secret_key=secret_key,
-	public_key=public_key,
-	host=host
-)
+# Langfuse tracing, exported in the background (see src/utils/tracing.py)
+tracer = get_tracer()
 
-# Simple in-memory storage for consumed products
-consumed_products = {}
+# Task measuring the event loop lag for /metrics
+loop_lag_monitor = None
 
 # Simple in-memory storage for user IDs
 dict_user_ids = {}
@@ -48,6 +59,31 @@ def get_or_create_user_id(user_name: str) -> int:
 		dict_user_ids[user_name] = len(dict_user_ids) + 1
 	return dict_user_ids[user_name]
 
+@cl.on_app_startup
+async def on_app_startup():
+	"""
+	Starts shared resources with the Chainlit server.
+	"""
+	global loop_lag_monitor
+
+	get_image_executor().start()
+	get_consumption_store()
+	if metrics_enabled:
+		from chainlit.server import app
+		mount_metrics(app, metrics_path, local_only=metrics_local_only)
+		loop_lag_monitor = asyncio.create_task(monitor_event_loop_lag(metrics_loop_lag_interval))
+
+@cl.on_app_shutdown
+async def on_app_shutdown():
+	"""
+	Releases shared resources when the Chainlit server stops.
+	"""
+	if loop_lag_monitor is not None:
+		loop_lag_monitor.cancel()
+	get_image_executor().shutdown()
+	get_consumption_store().close()
+	tracer.shutdown()
+
 @cl.password_auth_callback
 def auth_callback(username: str, password: str):
 	# Fetch the user matching username from your database
@@ -90,8 +126,6 @@ async def main(message: cl.Message):
 	"""
 	Main entry point for handling incoming messages from Chainlit.
 	"""
-	global last_json_response
-
 	# Intercepter les commandes spéciales des starters
 	if message.content.startswith("!"):
 		await handle_starter_command(message)
@@ -104,118 +138,95 @@ async def main(message: cl.Message):
 	print(f"Received message from {user_name} (session ID: {session_id})")
 	print(f"Message content: {message.content}")
 
-	trace = langfuse.trace(
+	trace = tracer.trace(
 		name="Question",
 		input=message.content,
 		session_id=session_id,
 		user_id=user_id,
 	)
 
-	# Create a loading message with initial text
+	# Create a loading message, updated as each pipeline stage starts
 	loading_msg = cl.Message(content="⏳ Initializing request...")
-	loading_msg_id = await loading_msg.send()
-	
-	# Define progress steps
-	progress_steps = [
-		"🔍 Analyzing your request...",
-		"📸 Processing image data..." if message.elements else "🧠 Thinking...",
-		"📊 Extracting nutritional information...",
-		"📝 Formulating response...",
-		"✨ Almost done..."
-	]
+	await loading_msg.send()
+	progress = ProgressReporter(loading_msg)
+	error_content = None
 	
 	try:
-		# Process each step with visible progress
-		for i, step in enumerate(progress_steps):
-			# Update message with current step
-			loading_msg.content = step
-			await loading_msg.update()
-			
-			# Simulate processing time for each step (except the last one)
-			if i < len(progress_steps) - 1:
-				await asyncio.sleep(1.5)
-		
-		# Initialize consumed_products for this user if it doesn't exist
-		if user_id not in consumed_products:
-			consumed_products[user_id] = []
+		await progress.emit("start")
+
+		# Today's consumption of the user, rendered incrementally within a token budget
+		# Blocking SQLite reads, kept off the event loop
+		consumption_history = await asyncio.to_thread(get_history_renderer().render, user_name)
+		daily_totals = await asyncio.to_thread(get_consumption_store().daily_totals, user_name)
 		
+		# Message the answer is streamed into, then finalized with elements and actions
+		final_msg = cl.Message(content="") if stream_responses else None
+
 		# Process the message and get a response
-		response = await process_message(message, trace, consumed_products[user_id])
+		with stage_timer("process_message"):
+			response = await process_message(
+				message, trace, progress=progress, stream_msg=final_msg, session_id=session_id,
+				daily_totals=daily_totals, consumption_history=consumption_history,
+			)
 		
 		# Unpack the response
 		response_text, elements = response[:2]
 		last_json_response = response[2] if len(response) > 2 else None
+		products = response[3] if len(response) > 3 else []
+		if not products and last_json_response:
+			products = last_json_response.get("products") or [last_json_response]
 
-		# Determine actions based on last_json_response
+		# Determine actions based on the analysed products
 		actions = []
-		if last_json_response:
+		if products:
 			user_id = cl.user_session.get("user").identifier  # Get the user identifier
-			actions = [
-				cl.Action(
+			for product_data in products:
+				label = "✅ Add current product to my list"
+				if len(products) > 1:
+					label = f"✅ Add {product_data.get('product', {}).get('name', 'Unknown Product')} to my list"
+				actions.append(cl.Action(
 					name="add_product", 
-					label="✅ Add current product to my list",
-					payload={"action": "add", "product_data": last_json_response, "user_id": user_id}
-				),
-				cl.Action(
-					name="skip_product", 
-					label="❌ Skip",
-					payload={"action": "skip", "user_id": user_id}
-				)
-			]
+					label=label,
+					payload={"action": "add", "product_data": product_data, "user_id": user_id}
+				))
+			actions.append(cl.Action(
+				name="skip_product", 
+				label="❌ Skip",
+				payload={"action": "skip", "user_id": user_id}
+			))
+
+		await progress.emit("send")
 
 		# Create a new message with the final response and product tracking buttons if applicable
-		final_msg = cl.Message(
-			content=response_text,
-			elements=elements,
-			actions=actions
-		)
-		await final_msg.send()
+		if final_msg is None:
+			final_msg = cl.Message(content="")
+		final_msg.content = response_text
+		final_msg.elements = elements or []
+		final_msg.actions = actions
+		with stage_timer("send"):
+			await final_msg.send()
 		
 		# Remove the loading message
+		await progress.close()
 		await loading_msg.remove()
 
 		# Add repopnse to the trace
 		trace.update(output=response_text)
-		trace.close()
 	except Exception as e:
-		# Update with error message
-		loading_msg.content = f"❌ An error occurred: {str(e)}"
+		if isinstance(e, BedrockUnavailableError) or is_throttling(e):
+			# Still over capacity after the retries
+			error_content = "⏳ The assistant is busy right now, please try again in a moment."
+		else:
+			error_content = f"❌ An error occurred: {str(e)}"
+	finally:
+		# Also when the task is cancelled (Stop button), else the ticker keeps editing the loading message
+		await progress.close()
+
+	if error_content is not None:
+		# Update with error message, once the ticker can no longer overwrite it
+		loading_msg.content = error_content
 		await loading_msg.update()
 
-async def animate_progress(message, message_id, steps):
-	"""
-	Animates the progress message by updating it with different steps.
-	
-	Args:
-		message: The message object to update
-		message_id: The ID of the message
-		steps: List of step messages to display
-	"""
-	try:
-		for step in steps:
-			# Update message with current step
-			message.content = step
-			await message.update()
-			
-			# Wait for a short time before next update
-			await asyncio.sleep(2.5)
-		
-		# If we've gone through all steps but processing is still ongoing,
-		# show a cycling animation
-		dots = 1
-		while True:
-			dot_text = "." * dots
-			message.content = f"⏳ Finalizing{dot_text}"
-			await message.update()
-			dots = (dots % 3) + 1
-			await asyncio.sleep(0.8)
-	except asyncio.CancelledError:
-		# Task was cancelled, which is expected when processing completes
-		pass
-	except Exception as e:
-		# Log any unexpected errors
-		print(f"Animation error: {e}")
-
 @cl.action_callback("add_product")
 async def add_product_callback(action: cl.Action):
 	"""
@@ -230,24 +241,21 @@ async def add_product_callback(action: cl.Action):
 	product_name = product_data.get("product", {}).get("name", "Unknown Product")
 
 	# Add product to the user's list
-	if user_id not in consumed_products:
-		consumed_products[user_id] = []
-	
-	consumed_products[user_id].append(product_data)
+	consumption_store = get_consumption_store()
+	await asyncio.to_thread(consumption_store.add_product, user_id, product_data)
+	# Render the new product into the cached history prompt now rather than on the next question
+	await asyncio.to_thread(get_history_renderer().extend, user_id)
 
 	# Send confirmation message
 	await cl.Message(content=f"✅ {product_name} has been added to your consumed list.").send()
 
 
 	# Optionally, show the current list of consumed products for the user
-	product_list = "\n".join([f"- {product.get('product', {}).get('name', 'Unknown Product')}" for product in consumed_products[user_id]])
+	products = await asyncio.to_thread(consumption_store.list_products, user_id)
+	product_list = "\n".join([f"- {product.get('product', {}).get('name', 'Unknown Product')}" for product in products])
 	
-	# Calculate total calories from all products in the user's list
-	total_calories = 0
-	for product in consumed_products[user_id]:
-		if isinstance(product, dict) and 'product' in product:
-			print(product.get('product', {}).get('nutritive_value', {}).get('calories', 0))
-			total_calories += product.get('product', {}).get('nutritive_value', {}).get('calories', 0)
+	# Total calories are maintained by the store on insert
+	total_calories = (await asyncio.to_thread(consumption_store.daily_totals, user_id))["calories"]
 	
 	await cl.Message(content=f"📋 Your current list:\n{product_list}\n\n"
 					   f"📊 Total calories today: {total_calories} calories").send()
@@ -264,7 +272,8 @@ async def on_chat_end():
 	"""
 	Cleanup tasks when the chat ends.
 	"""
-	pass
+	# Forget the products analysed in this session
+	get_session_context().discard(cl.user_session.get("id"))
 
 @cl.set_starters
 async def set_starters():
@@ -281,31 +290,66 @@ async def set_starters():
 			label="📊 Nutrition summary",
 			message="!nutrition_summary",  # Message spécial qui sera intercepté
 		),
+		cl.Starter(
+			label="📈 Weekly trends",
+			message="!weekly_report",  # Message spécial qui sera intercepté
+		),
+		cl.Starter(
+			label="🗓️ Monthly trends",
+			message="!monthly_report",  # Message spécial qui sera intercepté
+		),
 		cl.Starter(
 			label="💡 Healthy alternatives",
 			message="!healthy_alternatives",  # Message spécial qui sera intercepté
 		)
 	]
 
+def format_trend_report(report):
+	"""
+	Formats a nutrition ledger report as a Markdown message.
+
+	Args:
+		report: Report as returned by NutritionLedger.report()
+
+	Returns:
+		str: The message content
+	"""
+	units = {"calories": "kcal", "sodium": "mg"}
+	lines = [
+		f"📈 **Nutrition Trends — last {report['window_days']} days**",
+		"",
+		f"Logged {report['entries']} products over {report['days_logged']} of {report['window_days']} days.",
+		"",
+		"| Nutrient | Daily average | Target | vs. target | vs. previous period |",
+		"|---|---|---|---|---|",
+	]
+	for nutrient, values in report["nutrients"].items():
+		unit = units.get(nutrient, "g")
+		change = "—" if values["change"] is None else f"{values['change']:+} {unit}"
+		lines.append(
+			f"| {nutrient.capitalize()} | {values['average']} {unit} | {values['target']} {unit} | "
+			f"{values['delta']:+} {unit} | {change} |"
+		)
+	return "\n".join(lines)
+
 async def handle_starter_command(message: cl.Message):
 	"""
 	Handle special commands triggered by starters.
 	"""
 	user_id = cl.user_session.get("user").identifier
 	command = message.content.strip()
+	consumption_store = get_consumption_store()
+	daily_totals = await asyncio.to_thread(consumption_store.daily_totals, user_id)
 
 	if command == "!view_consumption":
 		# Afficher la liste des produits consommés
-		if user_id in consumed_products and consumed_products[user_id]:
+		if daily_totals["count"]:
+			products = await asyncio.to_thread(consumption_store.list_products, user_id)
 			product_list = "\n".join([f"- {product.get('product', {}).get('name', 'Unknown Product')}" 
-									 for product in consumed_products[user_id]])
+									 for product in products])
 			
-			# Calculer le total des calories
-			total_calories = 0
-			for product in consumed_products[user_id]:
-				if isinstance(product, dict) and 'product' in product:
-					print(product)
-					total_calories += product.get('product', {}).get('nutritive_value', {}).get('calories', 0)
+			# Total des calories tenu à jour par le store
+			total_calories = daily_totals["calories"]
 			
 			await cl.Message(content=f"📋 Your daily consumption:\n{product_list}\n\n"
 									   f"📊 Total calories today: {total_calories} calories").send()
@@ -318,20 +362,12 @@ async def handle_starter_command(message: cl.Message):
 	
 	elif command == "!nutrition_summary":
 		# Générer un résumé nutritionnel
-		if user_id in consumed_products and consumed_products[user_id]:
-			# Calculer les totaux nutritionnels
-			total_calories = 0
-			total_protein = 0
-			total_carbs = 0
-			total_fat = 0
-			
-			for product in consumed_products[user_id]:
-				if isinstance(product, dict) and 'product' in product:
-					nutritive_values = product.get('product', {}).get('nutritive_value', {})
-					total_calories += nutritive_values.get('calories', 0)
-					total_protein += nutritive_values.get('protein', 0)
-					total_carbs += nutritive_values.get('carbohydrates', 0)
-					total_fat += nutritive_values.get('fat', 0)
+		if daily_totals["count"]:
+			# Totaux nutritionnels tenus à jour par le store
+			total_calories = daily_totals["calories"]
+			total_protein = daily_totals["protein"]
+			total_carbs = daily_totals["carbohydrates"]
+			total_fat = daily_totals["fat"]
 			
 			summary = f"""📊 **Nutrition Summary for Today**
 
@@ -346,9 +382,17 @@ Based on a 2000 kcal diet, you've consumed approximately {(total_calories/2000)*
 		else:
 			await cl.Message(content="You haven't added any products to your list yet.").send()
 	
+	elif command in ("!weekly_report", "!monthly_report"):
+		# Tendances calculées localement sur l'historique, sans appel au modèle
+		report = await asyncio.to_thread(get_nutrition_ledger().report, user_id, window_days=7 if command == "!weekly_report" else 30)
+		if report["entries"]:
+			await cl.Message(content=format_trend_report(report)).send()
+		else:
+			await cl.Message(content="You haven't added any products in this period yet.").send()
+
 	elif command == "!healthy_alternatives":
 		# Suggérer des alternatives plus saines
-		if user_id in consumed_products and consumed_products[user_id]:
+		if daily_totals["count"]:
 			await cl.Message(content="Analyzing your consumption to suggest healthier alternatives...").send()
 			# Ici, vous pourriez appeler une fonction qui génère des suggestions basées sur les produits consommés
 			# Pour cet exemple, nous utilisons une réponse générique
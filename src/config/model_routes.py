@@ -0,0 +1,78 @@
+import json
+import os
+from collections import namedtuple
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Models calls can be routed to, by alias
+MODELS = {
+	"strong": {
+		"model_id": os.getenv("MODEL_STRONG_ID", "us.anthropic.claude-3-7-sonnet-20250219-v1:0"),
+		# Model name reported to Langfuse
+		"name": os.getenv("MODEL_STRONG_NAME", "claude-3-7-sonnet-latest"),
+		"vision": True,
+	},
+	"fast": {
+		"model_id": os.getenv("MODEL_FAST_ID", "us.anthropic.claude-3-5-haiku-20241022-v1:0"),
+		"name": os.getenv("MODEL_FAST_NAME", "claude-3-5-haiku-latest"),
+		"vision": False,
+	},
+}
+
+# Route of each call purpose, keyed on the `goal` passed to invoke_claude_model
+DEFAULT_ROUTE = {"model": "strong", "max_tokens": 1000, "temperature": 0.7}
+MODEL_ROUTES = {
+	# Reads the photo, needs the vision model; a low temperature keeps the extracted values stable
+	"Extract structured data": {"model": "strong", "max_tokens": 1000, "temperature": 0.2},
+	# Text-only answers of 3-4 sentences from data already extracted
+	"Answer user question": {"model": "fast", "max_tokens": 500, "temperature": 0.7},
+	"Answer based on consumption history": {"model": "fast", "max_tokens": 500, "temperature": 0.7},
+}
+
+# "false" sends every call to the default route, i.e. the strong model
+model_routing = os.getenv("MODEL_ROUTING", "true").lower() == "true"
+# JSON object overriding routes, e.g. {"Answer user question": {"model": "strong"}}
+model_routes_override = os.getenv("MODEL_ROUTES", "")
+
+ModelRoute = namedtuple("ModelRoute", ["goal", "model", "model_id", "name", "max_tokens", "temperature"])
+
+
+def _load_routes():
+	routes = {goal: dict(route) for goal, route in MODEL_ROUTES.items()}
+	if model_routes_override:
+		for goal, override in json.loads(model_routes_override).items():
+			routes[goal] = {**routes.get(goal, DEFAULT_ROUTE), **override}
+	for goal, route in routes.items():
+		if route["model"] not in MODELS:
+			raise ValueError(f"Unknown model '{route['model']}' in the route of '{goal}'")
+	return routes
+
+
+_routes = _load_routes()
+
+
+def get_model_route(goal, has_images=False):
+	"""
+	Returns the model and generation parameters for a call.
+
+	Args:
+		goal: Purpose of the call, e.g. "Answer user question"
+		has_images: The payload carries an image; a route to a text-only model then falls back to the default route
+
+	Returns:
+		ModelRoute: goal, model alias, Bedrock model ID, Langfuse model name, max_tokens and temperature
+	"""
+	route = _routes.get(goal, DEFAULT_ROUTE) if model_routing else DEFAULT_ROUTE
+	if has_images and not MODELS[route["model"]]["vision"]:
+		route = {**route, "model": DEFAULT_ROUTE["model"]}
+	model = MODELS[route["model"]]
+	return ModelRoute(
+		goal=goal,
+		model=route["model"],
+		model_id=model["model_id"],
+		name=model["name"],
+		max_tokens=route["max_tokens"],
+		temperature=route["temperature"],
+	)
@@ -0,0 +1,275 @@
+"""
+Analyses a directory of food photos, or a manifest listing them, without the
+chat UI. Each image goes through the same pipeline as a chat upload (analysis
+cache, barcode lookup, image compression and structured data extraction) at
+the "bulk" Bedrock priority, and its result is appended to a JSONL file.
+
+The output file is the checkpoint: images already analysed successfully are
+skipped when the command is run again.
+
+Usage:
+	python -m src.handlers.bulk_analysis photos/ --output results.jsonl
+	python -m src.handlers.bulk_analysis manifest.csv --output results.jsonl --user-id user1 --concurrency 8
+
+A manifest is a CSV file with a "path" column, a JSONL file with a "path"
+field, or a text file with one path per line. An optional "consumed_at"
+(ISO 8601) sets when the meal was eaten; otherwise the photo's EXIF date or
+modification time is used.
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+from PIL import Image
+
+from src.handlers.message_handler import extract_product_data
+from src.storage.consumption_store import get_consumption_store
+from src.utils.bedrock_limiter import (
+	BedrockUnavailableError,
+	backoff_delay,
+	bedrock_guard_stats,
+	bedrock_priority,
+	error_code,
+	is_retryable,
+)
+from src.utils.tracing import get_tracer
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+# Text sent with each photo, the extraction does not answer it
+BULK_QUESTION = "Identify this food product and its nutritive values."
+
+# EXIF tags of the date a photo was taken
+EXIF_IFD = 0x8769
+EXIF_DATETIME_ORIGINAL = 36867
+EXIF_DATETIME = 306
+
+
+def list_images(source):
+	"""
+	Lists the images of a directory (recursively) or a manifest.
+
+	Returns:
+		List of dicts with "path" and, when the manifest gives it, "consumed_at"
+	"""
+	if os.path.isdir(source):
+		return [
+			{"path": os.path.normpath(os.path.join(root, name))}
+			for root, _, names in sorted(os.walk(source))
+			for name in sorted(names)
+			if name.lower().endswith(IMAGE_EXTENSIONS)
+		]
+
+	base = os.path.dirname(source)
+	with open(source, encoding="utf-8", newline="") as file:
+		if source.endswith(".csv"):
+			entries = list(csv.DictReader(file))
+		elif source.endswith(".jsonl"):
+			entries = [json.loads(line) for line in file if line.strip()]
+		else:
+			entries = [{"path": line.strip()} for line in file if line.strip() and not line.startswith("#")]
+	items = []
+	for entry in entries:
+		item = {"path": os.path.normpath(os.path.join(base, entry["path"]))}
+		if entry.get("consumed_at"):
+			item["consumed_at"] = entry["consumed_at"]
+		items.append(item)
+	return items
+
+def load_checkpoint(output):
+	"""
+	Returns the paths already analysed successfully in an earlier run.
+	"""
+	done = set()
+	if not os.path.exists(output):
+		return done
+	with open(output, encoding="utf-8") as file:
+		for line in file:
+			try:
+				record = json.loads(line)
+			except json.JSONDecodeError:
+				# Line cut short by an interrupted run
+				continue
+			if record.get("status") == "ok":
+				done.add(record["path"])
+	return done
+
+def photo_time(path):
+	"""
+	Returns when a photo was taken, from its EXIF data, else its modification time.
+	"""
+	try:
+		with Image.open(path) as img:
+			exif = img.getexif()
+			value = exif.get_ifd(EXIF_IFD).get(EXIF_DATETIME_ORIGINAL) or exif.get(EXIF_DATETIME)
+		if value:
+			return datetime.strptime(value.strip("\x00 "), "%Y:%m:%d %H:%M:%S")
+	except Exception:
+		pass
+	return datetime.fromtimestamp(os.path.getmtime(path))
+
+
+class BulkAnalysis:
+	"""
+	Analyses images with a bounded number of workers, appending one JSONL
+	record per image. Bedrock throttling is absorbed by the adaptive limiter
+	and retries of the Bedrock guard; images failing with a retryable error
+	after those are retried later with a longer backoff, and an open circuit
+	breaker pauses the workers until it lets calls through again.
+	"""
+
+	def __init__(self, output, concurrency=4, question=BULK_QUESTION, user_id=None, max_attempts=5, report_every=10):
+		"""
+		Args:
+			output: JSONL file the records are appended to
+			concurrency: Images analysed at the same time
+			question: Text sent with each photo
+			user_id: Optional user whose consumption list the products are added to
+			max_attempts: Attempts per image for retryable errors
+			report_every: Print the progress every this many images
+		"""
+		self.output = output
+		self.concurrency = concurrency
+		self.question = question
+		self.user_id = user_id
+		self.max_attempts = max_attempts
+		self.report_every = report_every
+		self.run_id = uuid.uuid4().hex[:12]
+		self.counters = {"ok": 0, "failed": 0, "waits": 0}
+		self.sources = {}
+		self._start = None
+		self._total = 0
+
+	async def run(self, items):
+		"""
+		Analyses the items and returns the counters of the run.
+		"""
+		self._total = len(items)
+		self._start = time.perf_counter()
+		queue = asyncio.Queue()
+		for item in items:
+			queue.put_nowait(item)
+
+		with open(self.output, "a", encoding="utf-8") as file:
+			async def worker():
+				while not queue.empty():
+					record = await self._analyze(queue.get_nowait())
+					file.write(json.dumps(record, ensure_ascii=False) + "\n")
+					# Flushed per record, so an interrupted run resumes after the last one written
+					file.flush()
+					self._report()
+
+			with bedrock_priority("bulk"):
+				await asyncio.gather(*[worker() for _ in range(min(self.concurrency, len(items)))])
+		return self.stats()
+
+	async def _analyze(self, item):
+		path = item["path"]
+		record = {"path": path}
+		trace = get_tracer().trace(name="Bulk analysis", input=path, session_id=self.run_id, user_id=self.user_id)
+		start = time.perf_counter()
+		try:
+			# A bad date is found before the model is called
+			consumed_at = datetime.fromisoformat(item["consumed_at"]) if item.get("consumed_at") else photo_time(path)
+			structured_data, source = await self._extract(Path(path), trace)
+			if not structured_data:
+				raise ValueError("No JSON was generated")
+			if self.user_id:
+				await asyncio.to_thread(get_consumption_store().add_product, self.user_id, structured_data, consumed_at)
+		except Exception as e:
+			# Recorded for this image only, the other workers carry on
+			self.counters["failed"] += 1
+			record.update(status="error", error=error_code(e) or f"{type(e).__name__}: {e}")
+			print(f"Error analysing {path}: {record['error']}")
+		else:
+			self.counters["ok"] += 1
+			self.sources[source] = self.sources.get(source, 0) + 1
+			record.update(status="ok", source=source, consumed_at=consumed_at.isoformat(), structured_data=structured_data)
+		record["seconds"] = round(time.perf_counter() - start, 3)
+		trace.update(output=record.get("structured_data") or record.get("error"))
+		return record
+
+	async def _extract(self, path, trace):
+		for attempt in range(self.max_attempts):
+			try:
+				return await extract_product_data(path, trace, self.question)
+			except BedrockUnavailableError as e:
+				if attempt == self.max_attempts - 1:
+					raise
+				delay = e.retry_after
+			except Exception as e:
+				if not is_retryable(e) or attempt == self.max_attempts - 1:
+					raise
+				# The guard already retried it, back off for longer than it does
+				delay = backoff_delay(attempt, base_delay=2.0, max_delay=60.0)
+			self.counters["waits"] += 1
+			await asyncio.sleep(max(delay, 0.1))
+
+	def _report(self):
+		done = self.counters["ok"] + self.counters["failed"]
+		if done % self.report_every and done != self._total:
+			return
+		stats = self.stats()
+		print(
+			f"[{done}/{self._total}] {stats['images_per_minute']:.1f} images/min, "
+			f"{self.counters['failed']} failed, sources: {self.sources}, Bedrock: {bedrock_guard_stats()}"
+		)
+
+	def stats(self):
+		"""
+		Returns the counters, the images analysed per source and the throughput.
+		"""
+		elapsed = time.perf_counter() - self._start if self._start else 0.0
+		done = self.counters["ok"] + self.counters["failed"]
+		return {
+			**self.counters,
+			"sources": dict(self.sources),
+			"seconds": elapsed,
+			"images_per_minute": done / elapsed * 60 if elapsed else 0.0,
+		}
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("source", help="Directory of photos or manifest (.csv, .jsonl or one path per line)")
+	parser.add_argument("--output", default="bulk_analysis.jsonl", help="JSONL results, also the checkpoint")
+	parser.add_argument("--concurrency", type=int, default=4, help="Images analysed at the same time")
+	parser.add_argument("--user-id", help="Add the products to this user's consumption list")
+	parser.add_argument("--question", default=BULK_QUESTION, help="Text sent with each photo")
+	parser.add_argument("--max-attempts", type=int, default=5, help="Attempts per image for throttling and transient errors")
+	parser.add_argument("--report-every", type=int, default=10, help="Print the progress every N images")
+	args = parser.parse_args()
+
+	items = list_images(args.source)
+	done = load_checkpoint(args.output)
+	pending = [item for item in items if item["path"] not in done]
+	print(f"{len(items)} images, {len(items) - len(pending)} already in {args.output}, {len(pending)} to analyse")
+	if not pending:
+		return
+
+	bulk = BulkAnalysis(
+		args.output,
+		concurrency=args.concurrency,
+		question=args.question,
+		user_id=args.user_id,
+		max_attempts=args.max_attempts,
+		report_every=args.report_every,
+	)
+	try:
+		stats = asyncio.run(bulk.run(pending))
+	finally:
+		get_tracer().shutdown()
+	print(
+		f"Analysed {stats['ok']} images, {stats['failed']} failed, in {stats['seconds']:.1f}s: "
+		f"{stats['images_per_minute']:.1f} images/min, {stats['waits']} rate-limit waits, sources: {stats['sources']}"
+	)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,178 @@
+import os
+import threading
+from collections import OrderedDict, deque
+from datetime import date
+
+from dotenv import load_dotenv
+
+from src.storage.consumption_store import NUTRIENTS, _clean, get_consumption_store, product_nutrients
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Tokens the detailed product list may take, older products are folded into one summary line
+history_prompt_tokens = int(os.getenv("HISTORY_PROMPT_TOKENS", "800"))
+# Users whose rendered history is kept in memory
+history_prompt_users = int(os.getenv("HISTORY_PROMPT_USERS", "1024"))
+
+_history_renderer = None
+
+
+def _estimate_tokens(text):
+	# Roughly four characters per token for English text and numbers
+	return len(text) // 4 + 1
+
+
+def _render_product(index, product_data):
+	"""
+	Renders one consumed product in the detailed format of the history prompt.
+	"""
+	product = product_data.get("product", {}) if isinstance(product_data, dict) else {}
+	product_name = product.get("name", "Unknown Product")
+	nutritive_values = product.get("nutritive_value", {}) or {}
+	return (
+		f"{index}. {product_name}:\n"
+		f"   - Calories: {nutritive_values.get('calories', 0)} kcal\n"
+		f"   - Protein: {nutritive_values.get('protein', 0)} g\n"
+		f"   - Carbohydrates: {nutritive_values.get('carbohydrates', 0)} g\n"
+		f"   - Fat: {nutritive_values.get('fat', 0)} g\n"
+	)
+
+
+class _UserHistory:
+	"""
+	Rendered history of one user's day: a summary of the folded older products
+	and the most recent ones in detail.
+	"""
+
+	def __init__(self, day):
+		self.day = day
+		self.last_record_id = 0
+		self.count = 0
+		self.folded = 0
+		self.folded_totals = dict.fromkeys(NUTRIENTS, 0.0)
+		self.totals = dict.fromkeys(NUTRIENTS, 0.0)
+		# (text, tokens, nutrients) of the products shown in detail, oldest first
+		self.items = deque()
+		self.item_tokens = 0
+		self.prefix = None
+
+
+class HistoryRenderer:
+	"""
+	Renders the consumption history prompt within a token budget.
+
+	Today's products are rendered once, as they are added, and the rendered
+	prefix is cached. When the detailed list exceeds the budget the oldest
+	products are folded into a single aggregate line, so the prompt size stays
+	flat however much the user consumes.
+	"""
+
+	def __init__(self, store, token_budget=800, max_users=1024):
+		"""
+		Args:
+			store: ConsumptionStore the products are read from
+			token_budget: Tokens the detailed product list may take
+			max_users: Users whose rendered history is kept, least recently used dropped first
+		"""
+		self.store = store
+		self.token_budget = token_budget
+		self.max_users = max_users
+		self._histories = OrderedDict()
+		self._lock = threading.Lock()
+
+	def extend(self, user_id):
+		"""
+		Appends the user's products added since the last call, e.g. right after add_product.
+		"""
+		with self._lock:
+			self._sync(user_id)
+
+	def render(self, user_id):
+		"""
+		Returns the consumption history of the user's day for the prompt.
+
+		Returns:
+			str: The rendered history, empty when nothing was consumed today
+		"""
+		with self._lock:
+			history = self._sync(user_id)
+			if not history.count:
+				return ""
+			if history.prefix is None:
+				history.prefix = self._render_prefix(history)
+			return history.prefix + self._render_totals(history)
+
+	def _sync(self, user_id):
+		today = date.today()
+		history = self._histories.get(user_id)
+		if history is None or history.day != today:
+			history = _UserHistory(today)
+			self._histories[user_id] = history
+		self._histories.move_to_end(user_id)
+		while len(self._histories) > self.max_users:
+			self._histories.popitem(last=False)
+
+		for record_id, _, product_data in self.store.history(user_id, after_id=history.last_record_id, day=today):
+			self._append(history, product_data)
+			history.last_record_id = record_id
+		return history
+
+	def _append(self, history, product_data):
+		history.count += 1
+		nutrients = product_nutrients(product_data)
+		for nutrient, value in nutrients.items():
+			history.totals[nutrient] += value
+
+		text = _render_product(history.count, product_data)
+		tokens = _estimate_tokens(text)
+		history.items.append((text, tokens, nutrients))
+		history.item_tokens += tokens
+
+		folded = False
+		while history.item_tokens > self.token_budget and len(history.items) > 1:
+			_, old_tokens, old_nutrients = history.items.popleft()
+			history.item_tokens -= old_tokens
+			history.folded += 1
+			for nutrient, value in old_nutrients.items():
+				history.folded_totals[nutrient] += value
+			folded = True
+
+		if folded:
+			history.prefix = None
+		elif history.prefix is not None:
+			history.prefix += text
+
+	def _render_prefix(self, history):
+		prefix = "\nUser's previously consumed products:\n"
+		if history.folded:
+			totals = history.folded_totals
+			prefix += (
+				f"Earlier products ({history.folded}, not listed): "
+				f"{_clean(totals['calories'])} kcal, {_clean(totals['protein'])} g protein, "
+				f"{_clean(totals['carbohydrates'])} g carbohydrates, {_clean(totals['fat'])} g fat\n"
+			)
+		return prefix + "".join(text for text, _, _ in history.items)
+
+	def _render_totals(self, history):
+		totals = {nutrient: _clean(value) for nutrient, value in history.totals.items()}
+		return (
+			f"\nDaily totals so far:\n"
+			f"- Total Calories: {totals['calories']} kcal\n"
+			f"- Total Protein: {totals['protein']} g\n"
+			f"- Total Carbohydrates: {totals['carbohydrates']} g\n"
+			f"- Total Fat: {totals['fat']} g\n"
+			f"- Approximate % of 2000 kcal diet: {(totals['calories']/2000)*100:.1f}%\n"
+		)
+
+
+def get_history_renderer():
+	"""Return the process-wide history renderer over the consumption store."""
+	global _history_renderer
+	if _history_renderer is None:
+		_history_renderer = HistoryRenderer(
+			get_consumption_store(),
+			token_budget=history_prompt_tokens,
+			max_users=history_prompt_users,
+		)
+	return _history_renderer
@@ -0,0 +1,455 @@
+import os
+import re
+import threading
+import unicodedata
+from collections import namedtuple
+from dotenv import load_dotenv
+
+from src.utils.metrics import LOCAL_ANSWERS
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Answer simple factual follow-ups from the structured data instead of calling Bedrock
+local_answers_enabled = os.getenv("LOCAL_ANSWERS", "true").lower() == "true"
+# Share of the question's words the matcher must recognise, below it the question goes to the model
+local_answers_min_confidence = float(os.getenv("LOCAL_ANSWERS_MIN_CONFIDENCE", "0.75"))
+
+LocalAnswer = namedtuple("LocalAnswer", ["text", "intent", "language", "confidence"])
+
+NUTRIENT_UNITS = {
+	"calories": "kcal",
+	"protein": "g",
+	"fat": "g",
+	"carbohydrates": "g",
+	"sugar": "g",
+	"fiber": "g",
+	"sodium": "mg",
+}
+
+# Vocabulary per language, lower case without accents. Questions containing a
+# "blocker" ask for advice or a judgement and are always left to the model.
+LEXICONS = {
+	"en": {
+		"nutrients": {
+			"calories": {"calorie", "calories", "kcal", "cal", "energy"},
+			"protein": {"protein", "proteins"},
+			"fat": {"fat", "fats", "lipid", "lipids"},
+			"carbohydrates": {"carb", "carbs", "carbohydrate", "carbohydrates"},
+			"sugar": {"sugar", "sugars"},
+			"fiber": {"fiber", "fibers", "fibre", "fibres"},
+			"sodium": {"sodium"},
+		},
+		"amount": {"much", "many", "amount", "quantity"},
+		"contains": {"contain", "contains", "there", "any"},
+		"ingredients": {"ingredients", "ingredient"},
+		"origin": {"origin", "where", "come", "comes", "country"},
+		"today": {"today", "far"},
+		"stopwords": {
+			"a", "an", "the", "this", "that", "it", "its", "is", "are", "in", "of", "does", "do", "what", "whats",
+			"s", "how", "product", "food", "item", "one", "has", "have", "please", "me", "tell",
+			"about", "i", "my", "so", "total", "eaten", "ate", "consumed", "logged", "had", "grams", "g", "mg",
+			"content", "level", "and", "or", "with", "value", "from", "made", "list", "inside",
+		},
+		"blockers": {
+			"healthy", "unhealthy", "healthier", "good", "bad", "better", "worse", "best", "should", "could",
+			"would", "why", "compare", "compared", "versus", "vs", "alternative", "alternatives", "recommend",
+			"advice", "diet", "enough", "too", "high", "low", "rich", "percent", "percentage", "daily", "limit",
+			"safe", "allergic", "allergy", "vegan", "vegetarian", "halal", "kosher", "keto", "diabetic", "pregnant",
+			"lose", "weight", "burn", "if", "instead", "per", "100", "serving", "portion", "can", "ok", "okay",
+		},
+	},
+	"fr": {
+		"nutrients": {
+			"calories": {"calorie", "calories", "kcal", "energie"},
+			"protein": {"proteine", "proteines"},
+			"fat": {"lipide", "lipides", "graisse", "graisses", "grasses"},
+			"carbohydrates": {"glucide", "glucides"},
+			"sugar": {"sucre", "sucres"},
+			"fiber": {"fibre", "fibres"},
+			"sodium": {"sodium"},
+		},
+		"amount": {"combien", "quantite", "teneur", "taux"},
+		"contains": {"contient", "contiennent", "y"},
+		"ingredients": {"ingredients", "ingredient"},
+		"origin": {"origine", "provenance", "vient", "pays"},
+		"today": {"aujourd", "hui"},
+		"stopwords": {
+			"le", "la", "les", "l", "un", "une", "des", "de", "du", "d", "ce", "cet", "cette", "ca", "il", "elle",
+			"est", "a", "t", "en", "dans", "produit", "aliment", "quelle", "quel", "quelles", "quels", "contenu",
+			"j", "ai", "je", "mange", "manges", "mangees", "consomme", "consommes", "consommees", "total", "au", "aux",
+			"et", "ou", "avec", "liste", "me", "dire", "donne", "moi", "sont", "qu", "que", "quoi", "valeur",
+			"matieres", "g", "mg", "grammes", "ils", "s", "vous", "pouvez",
+		},
+		"blockers": {
+			"sain", "saine", "bon", "bonne", "mauvais", "mieux", "meilleur", "pourquoi", "devrais", "dois", "peux",
+			"comparer", "alternative", "alternatives", "recommande", "conseil", "regime", "assez", "trop", "eleve",
+			"elevee", "riche", "faible", "pourcentage", "quotidien", "si", "perdre", "poids", "100", "portion", "par",
+			"vegan", "vegetarien", "allergie", "allergique",
+		},
+	},
+	"de": {
+		"nutrients": {
+			"calories": {"kalorie", "kalorien", "kcal", "energie", "brennwert"},
+			"protein": {"protein", "proteine", "eiweiss"},
+			"fat": {"fett", "fette"},
+			"carbohydrates": {"kohlenhydrat", "kohlenhydrate"},
+			"sugar": {"zucker"},
+			"fiber": {"ballaststoff", "ballaststoffe"},
+			"sodium": {"natrium"},
+		},
+		"amount": {"viel", "viele", "menge", "gehalt"},
+		"contains": {"enthalt", "enthalten", "gibt"},
+		"ingredients": {"zutaten", "zutat"},
+		"origin": {"herkunft", "woher", "kommt", "land"},
+		"today": {"heute"},
+		"stopwords": {
+			"wie", "hat", "haben", "ist", "sind", "das", "der", "die", "dem", "den", "es", "in",
+			"im", "ein", "eine", "diesem", "dieses", "dieser", "produkt", "was", "insgesamt",
+			"ich", "habe", "gegessen", "mir", "und", "oder", "mit", "liste", "gramm", "g", "mg", "darin", "drin",
+			"davon", "welche", "sag",
+		},
+		"blockers": {
+			"gesund", "ungesund", "gut", "schlecht", "besser", "warum", "sollte", "soll", "kann", "vergleich",
+			"alternative", "empfehlen", "diat", "genug", "zuviel", "hoch", "niedrig", "reich", "prozent",
+			"taglich", "wenn", "abnehmen", "pro", "portion", "100", "vegan", "allergie",
+		},
+	},
+	"es": {
+		"nutrients": {
+			"calories": {"caloria", "calorias", "kcal", "energia"},
+			"protein": {"proteina", "proteinas"},
+			"fat": {"grasa", "grasas", "lipidos"},
+			"carbohydrates": {"carbohidrato", "carbohidratos", "hidratos"},
+			"sugar": {"azucar", "azucares"},
+			"fiber": {"fibra", "fibras"},
+			"sodium": {"sodio"},
+		},
+		"amount": {"cuanto", "cuanta", "cuantos", "cuantas", "cantidad"},
+		"contains": {"contiene", "contienen", "hay", "lleva"},
+		"ingredients": {"ingredientes", "ingrediente"},
+		"origin": {"origen", "procedencia", "donde", "viene", "pais"},
+		"today": {"hoy"},
+		"stopwords": {
+			"que", "cual", "cuales", "tiene", "tienen", "el", "la",
+			"los", "las", "lo", "un", "una", "de", "del", "en", "este", "esta", "esto", "producto", "alimento",
+			"es", "son", "contenido", "nivel", "he", "comido", "consumido", "total", "me", "y", "o",
+			"con", "lista", "gramos", "g", "mg", "algo", "alguna", "alguno", "dime", "al",
+		},
+		"blockers": {
+			"sano", "sana", "saludable", "bueno", "buena", "malo", "mejor", "peor", "por", "porque", "deberia",
+			"puedo", "comparar", "alternativa", "alternativas", "recomendar", "dieta", "suficiente", "demasiado",
+			"alto", "alta", "bajo", "baja", "rico", "porcentaje", "diario", "si", "perder", "peso", "100", "porcion",
+			"vegano", "alergia",
+		},
+	},
+}
+
+NUTRIENT_LABELS = {
+	"en": {"calories": "calories", "protein": "protein", "fat": "fat", "carbohydrates": "carbohydrates", "sugar": "sugar", "fiber": "fiber", "sodium": "sodium"},
+	"fr": {"calories": "calories", "protein": "protéines", "fat": "lipides", "carbohydrates": "glucides", "sugar": "sucres", "fiber": "fibres", "sodium": "sodium"},
+	"de": {"calories": "Kalorien", "protein": "Eiweiß", "fat": "Fett", "carbohydrates": "Kohlenhydrate", "sugar": "Zucker", "fiber": "Ballaststoffe", "sodium": "Natrium"},
+	"es": {"calories": "calorías", "protein": "proteínas", "fat": "grasas", "carbohydrates": "carbohidratos", "sugar": "azúcar", "fiber": "fibra", "sodium": "sodio"},
+}
+
+TEMPLATES = {
+	"en": {
+		"value": "{value} {unit} of {label}",
+		"and": " and ",
+		"nutrient_amount": "{product} contains {values}.",
+		"nutrient_present": "Yes, {product} contains {values}.",
+		"nutrient_absent": "No, {product} contains no {label} (0 {unit}).",
+		"ingredient_present": "Yes, {product} contains {term} (ingredients: {ingredients}).",
+		"ingredients": "Ingredients of {product}: {ingredients}.",
+		"origin": "Origin of {product}: {origin}.",
+		"daily_total": "Today you have logged {values} across {count} products.",
+		"daily_empty": "You haven't added any products to your list today.",
+	},
+	"fr": {
+		"value": "{value} {unit} de {label}",
+		"and": " et ",
+		"nutrient_amount": "{product} contient {values}.",
+		"nutrient_present": "Oui, {product} contient {values}.",
+		"nutrient_absent": "Non, {product} ne contient pas de {label} (0 {unit}).",
+		"ingredient_present": "Oui, {product} contient {term} (ingrédients : {ingredients}).",
+		"ingredients": "Ingrédients de {product} : {ingredients}.",
+		"origin": "Origine de {product} : {origin}.",
+		"daily_total": "Aujourd'hui, vous avez enregistré {values} sur {count} produits.",
+		"daily_empty": "Vous n'avez encore ajouté aucun produit à votre liste aujourd'hui.",
+	},
+	"de": {
+		"value": "{value} {unit} {label}",
+		"and": " und ",
+		"nutrient_amount": "{product} enthält {values}.",
+		"nutrient_present": "Ja, {product} enthält {values}.",
+		"nutrient_absent": "Nein, {product} enthält 0 {unit} {label}.",
+		"ingredient_present": "Ja, {product} enthält {term} (Zutaten: {ingredients}).",
+		"ingredients": "Zutaten von {product}: {ingredients}.",
+		"origin": "Herkunft von {product}: {origin}.",
+		"daily_total": "Heute hast du {values} in {count} Produkten erfasst.",
+		"daily_empty": "Du hast heute noch keine Produkte zu deiner Liste hinzugefügt.",
+	},
+	"es": {
+		"value": "{value} {unit} de {label}",
+		"and": " y ",
+		"nutrient_amount": "{product} contiene {values}.",
+		"nutrient_present": "Sí, {product} contiene {values}.",
+		"nutrient_absent": "No, {product} no contiene {label} (0 {unit}).",
+		"ingredient_present": "Sí, {product} contiene {term} (ingredientes: {ingredients}).",
+		"ingredients": "Ingredientes de {product}: {ingredients}.",
+		"origin": "Origen de {product}: {origin}.",
+		"daily_total": "Hoy has registrado {values} en {count} productos.",
+		"daily_empty": "Hoy todavía no has añadido ningún producto a tu lista.",
+	},
+}
+
+_local_answer_engine = None
+
+
+def _normalize(text):
+	"""
+	Lower case without accents, "ß" spelled "ss".
+	"""
+	text = unicodedata.normalize("NFKD", text.lower().replace("ß", "ss"))
+	return "".join(char for char in text if not unicodedata.combining(char))
+
+
+def _tokenize(text):
+	return re.findall(r"\w+", _normalize(text))
+
+
+def _word_forms(word):
+	"""
+	The word with and without a plural ending ("egg", "eggs"; "noix").
+	"""
+	forms = {word, word + "s", word + "es", word + "x"}
+	for ending in ("es", "s", "x"):
+		if word.endswith(ending) and len(word) > len(ending) + 1:
+			forms.add(word[:-len(ending)])
+	return forms
+
+
+def _contains_term(ingredient, term_tokens):
+	"""
+	Whether the ingredient's words include the term's words, in order, as whole
+	words: "egg" matches "whole eggs" but not "eggplant".
+	"""
+	tokens = _tokenize(ingredient)
+	size = len(term_tokens)
+	return any(
+		all(tokens[start + offset] in _word_forms(word) for offset, word in enumerate(term_tokens))
+		for start in range(len(tokens) - size + 1)
+	)
+
+
+def _vocabulary(lexicon):
+	words = set(lexicon["stopwords"]) | lexicon["amount"] | lexicon["contains"] | lexicon["ingredients"] | lexicon["origin"] | lexicon["today"]
+	for synonyms in lexicon["nutrients"].values():
+		words |= synonyms
+	return words
+
+
+_VOCABULARIES = {language: _vocabulary(lexicon) for language, lexicon in LEXICONS.items()}
+
+
+def _format_number(value):
+	value = float(value)
+	return str(int(value)) if value.is_integer() else f"{value:.1f}"
+
+
+def _products(product_data):
+	"""
+	Returns the product dicts of a last JSON response, for one or several products.
+	"""
+	if not product_data:
+		return []
+	entries = product_data.get("products") or [product_data]
+	return [entry.get("product", {}) for entry in entries if isinstance(entry, dict)]
+
+
+class LocalAnswerEngine:
+	"""
+	Answers factual follow-up questions from the structured product data and
+	the day's totals, without calling the model: nutrient amounts ("how much
+	protein?"), whether the product contains a nutrient or an ingredient,
+	its ingredients and origin, and the totals logged today.
+
+	The question is matched against keyword lexicons in English, French,
+	German and Spanish, and the answer is written from templates in the
+	language of the question. The confidence is the share of the question's
+	words the lexicon recognises; questions asking for advice, below the
+	confidence threshold or about data the product lacks return None and go
+	to the model, as do nutrient questions with any unrecognised word, which
+	may qualify the amount asked for.
+	"""
+
+	def __init__(self, min_confidence=0.75):
+		"""
+		Args:
+			min_confidence: Share of recognised words needed to answer locally
+		"""
+		self.min_confidence = min_confidence
+		self._lock = threading.Lock()
+		self.counters = {
+			"questions": 0,
+			"answered": 0,
+		}
+		self.intents = {}
+
+	def answer(self, question, product_data=None, daily_totals=None):
+		"""
+		Answers a question locally when it can be answered exactly.
+
+		Args:
+			question: The user's message
+			product_data: Last JSON response of the session, one product or {"products": [...]}
+			daily_totals: Today's totals from the consumption store
+
+		Returns:
+			LocalAnswer, or None when the question should go to the model
+		"""
+		result = self._answer(question or "", product_data, daily_totals)
+		with self._lock:
+			self.counters["questions"] += 1
+			if result is not None:
+				self.counters["answered"] += 1
+				self.intents[result.intent] = self.intents.get(result.intent, 0) + 1
+		LOCAL_ANSWERS.inc(result.intent if result else "none", "hit" if result else "miss")
+		return result
+
+	def _answer(self, question, product_data, daily_totals):
+		tokens = _tokenize(question)
+		if not tokens:
+			return None
+		# Language with the most recognised words, English on a tie
+		language = max(LEXICONS, key=lambda lang: sum(token in _VOCABULARIES[lang] for token in tokens))
+		lexicon = LEXICONS[language]
+		if any(token in lexicon["blockers"] for token in tokens):
+			return None
+
+		nutrients = [
+			nutrient for nutrient, synonyms in lexicon["nutrients"].items()
+			if any(token in synonyms for token in tokens)
+		]
+		unknown = [token for token in tokens if token not in _VOCABULARIES[language]]
+		asks_today = any(token in lexicon["today"] for token in tokens)
+		asks_amount = any(token in lexicon["amount"] for token in tokens)
+		asks_contains = any(token in lexicon["contains"] for token in tokens) and not asks_amount
+		products = _products(product_data)
+
+		if nutrients and asks_today:
+			if daily_totals is None or unknown:
+				return None
+			text = self._daily_total(language, nutrients, daily_totals)
+			intent = "daily_total"
+		elif asks_contains and unknown and not nutrients:
+			# The unknown words name an ingredient; they count as recognised once found
+			text = self._ingredient_presence(language, " ".join(unknown), products)
+			intent = "ingredient_presence"
+			unknown = []
+		elif nutrients and products:
+			if unknown:
+				# A qualifier ("half", "without", "added", "cup") changes the amount asked for
+				return None
+			text = self._nutrients(language, nutrients, products, presence=asks_contains)
+			intent = "nutrient_presence" if asks_contains else "nutrient_amount"
+		elif any(token in lexicon["ingredients"] for token in tokens) and products:
+			text = self._ingredients(language, products)
+			intent = "ingredients"
+		elif any(token in lexicon["origin"] for token in tokens) and products:
+			text = self._origin(language, products)
+			intent = "origin"
+		else:
+			return None
+
+		confidence = 1 - len(unknown) / len(tokens)
+		if text is None or confidence < self.min_confidence:
+			return None
+		return LocalAnswer(text, intent, language, confidence)
+
+	def _values(self, language, nutrients, values):
+		templates = TEMPLATES[language]
+		parts = []
+		for nutrient in nutrients:
+			value = _format_number(values[nutrient])
+			if nutrient == "calories":
+				parts.append(f"{value} kcal")
+			else:
+				parts.append(templates["value"].format(value=value, unit=NUTRIENT_UNITS[nutrient], label=NUTRIENT_LABELS[language][nutrient]))
+		if len(parts) == 1:
+			return parts[0]
+		return ", ".join(parts[:-1]) + templates["and"] + parts[-1]
+
+	def _nutrients(self, language, nutrients, products, presence=False):
+		templates = TEMPLATES[language]
+		lines = []
+		for product in products:
+			values = product.get("nutritive_value") or {}
+			if any(not isinstance(values.get(nutrient), (int, float)) for nutrient in nutrients):
+				return None
+			name = product.get("name") or "?"
+			if presence and len(nutrients) == 1 and values[nutrients[0]] == 0:
+				nutrient = nutrients[0]
+				lines.append(templates["nutrient_absent"].format(product=name, label=NUTRIENT_LABELS[language][nutrient], unit=NUTRIENT_UNITS[nutrient]))
+			else:
+				key = "nutrient_present" if presence else "nutrient_amount"
+				lines.append(templates[key].format(product=name, values=self._values(language, nutrients, values)))
+		return "\n".join(lines)
+
+	def _ingredient_presence(self, language, term, products):
+		lines = []
+		for product in products:
+			ingredients = product.get("ingredients") or []
+			# Only a found ingredient is a certain answer; an absent one may hide in a compound
+			# ingredient, and a partial word ("nut" in "coconut") is not the same ingredient
+			if not any(_contains_term(ingredient, term.split()) for ingredient in ingredients):
+				return None
+			lines.append(TEMPLATES[language]["ingredient_present"].format(
+				product=product.get("name") or "?", term=term, ingredients=", ".join(ingredients)
+			))
+		return "\n".join(lines) if lines else None
+
+	def _ingredients(self, language, products):
+		lines = []
+		for product in products:
+			if not product.get("ingredients"):
+				return None
+			lines.append(TEMPLATES[language]["ingredients"].format(
+				product=product.get("name") or "?", ingredients=", ".join(product["ingredients"])
+			))
+		return "\n".join(lines)
+
+	def _origin(self, language, products):
+		lines = []
+		for product in products:
+			if not product.get("origin"):
+				return None
+			lines.append(TEMPLATES[language]["origin"].format(product=product.get("name") or "?", origin=product["origin"]))
+		return "\n".join(lines)
+
+	def _daily_total(self, language, nutrients, daily_totals):
+		if not daily_totals.get("count"):
+			return TEMPLATES[language]["daily_empty"]
+		if any(nutrient not in daily_totals for nutrient in nutrients):
+			return None
+		return TEMPLATES[language]["daily_total"].format(
+			values=self._values(language, nutrients, daily_totals), count=daily_totals["count"]
+		)
+
+	def stats(self):
+		"""
+		Returns the question and answer counts, the hit rate and the answers per intent.
+		"""
+		with self._lock:
+			stats = dict(self.counters)
+			stats["intents"] = dict(self.intents)
+		stats["hit_rate"] = stats["answered"] / stats["questions"] if stats["questions"] else 0.0
+		return stats
+
+
+def get_local_answer_engine():
+	"""Return the process-wide local answer engine configured from the environment."""
+	global _local_answer_engine
+	if _local_answer_engine is None:
+		_local_answer_engine = LocalAnswerEngine(min_confidence=local_answers_min_confidence)
+	return _local_answer_engine
@@ -1,66 +1,334 @@
+import asyncio
 import json
+import os
 
 import chainlit as cl
 
-from src.model.query_claude_3_7 import query_claude_3_7, function_calling_query, create_bedrock_payload
+from src.handlers.local_answers import get_local_answer_engine, local_answers_enabled
+from src.storage.nutrition_index import get_nutrition_index
+from src.storage.session_context import get_session_context
+from src.model.query_claude_3_7 import (
+	query_claude_3_7_async,
+	function_calling_query_async,
+	explain_structured_data_async,
+	extract_response_text,
+)
+from src.utils.analysis_cache import barcode_fingerprint, get_analysis_cache, get_barcode_cache
 from src.utils.image_processor import extract_images
+from src.utils.metrics import BARCODE_LOOKUPS, stage_timer
+from src.utils.progress import emit_progress
+from src.utils.single_flight import SingleFlight, request_key
 from src.config.schemas import get_analysis_schema
 
 
-# Global variable to store the last JSON response
-last_json_response = None
+# Maximum number of images of one message analysed at the same time
+max_image_concurrency = int(os.getenv("MAX_IMAGE_CONCURRENCY", "4"))
+# Share one analysis between concurrent requests for the same image and question
+analysis_single_flight = os.getenv("ANALYSIS_SINGLE_FLIGHT", "true").lower() == "true"
 
-async def process_message(message: cl.Message, trace, consumed_products):
+_analysis_flight = SingleFlight("analysis")
+
+def _answer_locally(message, trace, product_data, daily_totals):
+	"""
+	Answers the question from the structured data when the local answer engine can.
+
+	Returns:
+		The answer text, or None to ask the model
+	"""
+	if not local_answers_enabled or not message.content:
+		return None
+	with stage_timer("local_answer"):
+		answer = get_local_answer_engine().answer(message.content, product_data, daily_totals)
+	if answer is None:
+		return None
+	span = trace.span(
+		name="Local answer",
+		input=message.content,
+		metadata={"intent": answer.intent, "language": answer.language, "confidence": answer.confidence},
+	)
+	span.end(output=answer.text)
+	return answer.text
+
+def _token_streamer(stream_msg, progress):
+	"""
+	Returns a callback streaming text deltas into stream_msg, or None when streaming is off.
+	"""
+	if stream_msg is None:
+		return None
+
+	async def on_text(token):
+		# The answer is now visible, stop animating the loading message
+		if not stream_msg.streaming and progress is not None:
+			await progress.close()
+		await stream_msg.stream_token(token)
+
+	return on_text
+
+def _detachable(on_text):
+	"""
+	Wraps a streaming callback so a failure to stream, e.g. to a disconnected
+	session, stops the streaming instead of failing an analysis other requests may share.
+	"""
+	if on_text is None:
+		return None
+	detached = False
+
+	async def stream(token):
+		nonlocal detached
+		if detached:
+			return
+		try:
+			await on_text(token)
+		except Exception as e:
+			detached = True
+			print(f"Stopped streaming the answer: {e}")
+
+	return stream
+
+async def _lookup_barcode(barcode):
+	"""
+	Looks up the structured data of a product barcode in the nutrition index,
+	then in the barcode cache filled by earlier analyses. An indexed product
+	without a package quantity only has values per 100 g, not the whole-product
+	values the answer needs, so it is left to the cache and the model. Both
+	lookups read SQLite, so they run in a thread.
+
+	Returns:
+		Tuple (structured data, "index" or "cache"), (None, None) when not found
+	"""
+	if barcode is None:
+		BARCODE_LOOKUPS.inc("none")
+		return None, None
+	index = get_nutrition_index()
+	structured_data = await asyncio.to_thread(index.lookup_barcode, barcode) if index is not None else None
+	if structured_data is not None and "nutritive_value" in structured_data["product"]:
+		BARCODE_LOOKUPS.inc("index")
+		return structured_data, "index"
+	structured_data = await get_barcode_cache().get_async(barcode_fingerprint(barcode))
+	if structured_data is not None:
+		BARCODE_LOOKUPS.inc("cache")
+		return structured_data, "cache"
+	BARCODE_LOOKUPS.inc("miss")
+	return None, None
+
+async def _analyze_image(input_text, image, trace, progress=None, on_text=None, explain=True):
+	"""
+	Analyses a single image, reusing the analysis of an identical or
+	near-identical image uploaded before, or of the product whose barcode
+	the image shows. Concurrent requests for the same image and question
+	share one analysis.
+
+	Args:
+		input_text: The user's question
+		image: Image file path or bytes, or None for a text-only extraction
+		explain: False to only extract the structured data, without answering the question
+
+	Returns:
+		Dict: Result of function_calling_query_async; "source" names the cache the data came from
+	"""
+	analysis_cache = get_analysis_cache()
+	with stage_timer("fingerprint"):
+		# Also reads the barcode, from the same decoded image as the perceptual hash
+		fingerprint = await analysis_cache.fingerprint_async(image) if image else None
+	barcode = fingerprint.barcode if fingerprint else None
+	cached_data = await analysis_cache.get_async(fingerprint) if fingerprint else None
+	cache_span = ("Analysis cache hit", fingerprint.digest if fingerprint else None)
+	source = "analysis_cache"
+
+	if image and not cached_data:
+		cached_data, barcode_source = await _lookup_barcode(barcode)
+		cache_span = (f"Barcode {barcode_source} hit", barcode)
+		source = f"barcode_{barcode_source}"
+
+	if cached_data:
+		span = trace.span(
+			name=cache_span[0],
+			input=cache_span[1]
+		)
+		explanation = ""
+		if explain:
+			explanation_response = await explain_structured_data_async(
+				input_text, cached_data, trace, progress, on_text
+			)
+			explanation = extract_response_text(explanation_response)
+		span.end(
+			output=cached_data
+		)
+		return {
+			"structured_data": cached_data,
+			"explanation": explanation,
+			"source": source
+		}
+
+	started = False
+
+	async def analyze():
+		nonlocal started
+		started = True
+		# Get structured response from Claude with images
+		function_response = await function_calling_query_async(
+			input_text=input_text,
+			json_schema=get_analysis_schema(),
+			images=[image] if image else None,
+			trace=trace,
+			progress=progress,
+			on_text=_detachable(on_text),
+			explain=explain
+		)
+		if fingerprint and function_response.get("structured_data"):
+			await analysis_cache.put_async(fingerprint, function_response["structured_data"])
+		if barcode and function_response.get("structured_data"):
+			# The next photo of this product, from any user, skips the model
+			await get_barcode_cache().put_async(barcode_fingerprint(barcode), function_response["structured_data"])
+		return function_response
+
+	if not analysis_single_flight:
+		return await analyze()
+
+	key = request_key(image=fingerprint.digest if fingerprint else None, question=input_text, explain=explain)
+	function_response = await _analysis_flight.run(key, analyze)
+	if not started:
+		# Joined the analysis of another request, which streamed the answer to its own message
+		trace.span(name="Coalesced analysis", input=key).end(output=function_response.get("structured_data"))
+		if on_text and function_response.get("explanation"):
+			await on_text(function_response["explanation"])
+	return function_response
+
+async def extract_product_data(image, trace, question):
+	"""
+	Extracts the structured data of one image without answering a question,
+	with the caches, barcode lookup and coalescing of chat uploads.
+
+	Args:
+		image: Image file path or bytes
+		question: Text sent with the image, steering the extraction
+
+	Returns:
+		Tuple (structured data or None, source: "model", "analysis_cache", "barcode_index" or "barcode_cache")
+	"""
+	function_response = await _analyze_image(question, image, trace, explain=False)
+	return function_response.get("structured_data"), function_response.get("source", "model")
+
+async def _analyze_images(input_text, image_list, trace, progress=None, on_text=None):
+	"""
+	Analyses every image of a message concurrently, at most
+	max_image_concurrency at a time.
+
+	Returns:
+		List of the successful function_calling_query_async results, in upload order
+	"""
+	if len(image_list) <= 1:
+		image = image_list[0] if image_list else None
+		return [await _analyze_image(input_text, image, trace, progress, on_text)]
+
+	# Concurrent answers cannot share one streamed message, they are merged afterwards
+	await emit_progress(progress, "extract_structured_data", f"({len(image_list)} images)")
+	semaphore = asyncio.Semaphore(max_image_concurrency)
+
+	async def analyze(image):
+		async with semaphore:
+			return await _analyze_image(input_text, image, trace)
+
+	results = await asyncio.gather(*[analyze(image) for image in image_list], return_exceptions=True)
+
+	successful = []
+	for i, result in enumerate(results):
+		if isinstance(result, Exception):
+			print(f"Error analysing image {i+1}: {result}")
+		else:
+			successful.append(result)
+	if not successful:
+		raise results[0]
+	return successful
+
+def _merge_product_responses(function_responses):
+	"""
+	Merges the per-image analyses into one multi-product answer.
+
+	Returns:
+		Tuple (response_text, products) where products lists the structured data of each product
+	"""
+	products = [r["structured_data"] for r in function_responses if r.get("structured_data")]
+	if len(function_responses) == 1:
+		return function_responses[0].get("explanation", ""), products
+
+	sections = []
+	totals = {"calories": 0, "protein": 0, "carbohydrates": 0, "fat": 0}
+	for i, response in enumerate(function_responses):
+		product = response.get("structured_data", {}).get("product", {})
+		sections.append(f"### {i+1}. {product.get('name', 'Unknown Product')}\n{response.get('explanation', '')}")
+		for key in totals:
+			totals[key] += product.get("nutritive_value", {}).get(key, 0) or 0
+
+	sections.append(
+		f"**Total:** {totals['calories']} kcal, {totals['protein']} g protein, "
+		f"{totals['carbohydrates']} g carbohydrates, {totals['fat']} g fat"
+	)
+	return "\n\n".join(sections), products
+
+async def process_message(message: cl.Message, trace, progress=None, stream_msg=None, daily_totals=None, session_id=None, consumption_history=None):
 	"""
 	Process incoming messages and generate appropriate responses.
 
 	Args:
 		message: The incoming Chainlit message
+		progress: Optional ProgressReporter updated as each stage starts
+		stream_msg: Optional cl.Message the answer is streamed into token by token
+		daily_totals: Optional running totals from the consumption store
+		session_id: Chainlit session the products analysed earlier are looked up for
+		consumption_history: Optional history of today's consumption rendered by HistoryRenderer
 
 	Returns:
-		Tuple containing response text and elements to display
+		Tuple containing response text, elements to display, the session's
+		last JSON response and the list of analysed products
 	"""
-	global last_json_response
+	session_context = get_session_context()
+	last_json_response = session_context.get(session_id) if session_id else None
+
+	products = []
+
+	on_text = _token_streamer(stream_msg, progress)
 
 	# Check if message contains images
 	if message.elements:
+		await emit_progress(progress, "extract_images")
 		span = trace.span(
 			name = "Extract images from message",
 			input = message.elements
 		)
 		# Extract images from message
-		elements, image_list = extract_images(message.elements)
+		with stage_timer("extract_images"):
+			elements, image_list = extract_images(message.elements)
 		span.end(
-			output = image_list
-		)
-
-		# Get structured response from Claude with images
-		function_response = function_calling_query(
-			input_text=message.content,
-			json_schema=get_analysis_schema(),
-			images=image_list,
-			trace=trace
+			output = [str(image) if not isinstance(image, bytes) else f"<{len(image)} bytes>" for image in image_list]
 		)
 
-		# Store the JSON response
-		last_json_response = function_response.get("structured_data", {})
-
-		# Extract structured data and explanation
-		structured_data = last_json_response
-		explanation = function_response.get("explanation", "")
+		function_responses = await _analyze_images(message.content, image_list, trace, progress, on_text)
+		response_text, products = _merge_product_responses(function_responses)
 
-		# Build an enriched response
-		response_text = explanation
+		# Remember the products of this session for follow-up questions
+		if session_id:
+			session_context.add_products(session_id, products)
+		if len(products) > 1:
+			last_json_response = {"products": products}
+		else:
+			last_json_response = products[0] if products else {}
+	elif (local_text := _answer_locally(message, trace, last_json_response, daily_totals)) is not None:
+		# Answered from the product data or today's totals, no model call
+		response_text = local_text
+		elements = None if last_json_response else []
 	else:
 		if last_json_response:
-			# Use the last JSON response to make a new query to Claude
-			explanation_prompt = f"""
+			# Use the last JSON response to make a new query to Claude.
+			# The product data goes first, in its own block, so follow-ups on the same product share a cached prefix
+			product_context = f"""
 			Here is the last known product information:
 			
 			```json
 			{json.dumps(last_json_response, ensure_ascii=False, indent=2)}
 			```
-			
+			"""
+			explanation_prompt = f"""
 			User question: {message.content}
 			
 			Please provide insights and explanations based on this data and the user's question.
@@ -71,10 +339,10 @@ async def process_message(message: cl.Message, trace, consumed_products):
 			# Create payload using create_bedrock_payload
 			span = trace.span(
 				name="Create payload for Bedrock",
-				input=explanation_prompt
+				input=product_context + explanation_prompt
 			)
 
-			explanation_response = query_claude_3_7(explanation_prompt, None, trace, goal="Answer user question")
+			explanation_response = await query_claude_3_7_async(explanation_prompt, None, trace, goal="Answer user question", progress=progress, on_text=on_text, context=product_context)
 
 			response_text = explanation_response['content'][0]['text']
 			span.end(
@@ -82,68 +350,9 @@ async def process_message(message: cl.Message, trace, consumed_products):
 			)
 			elements = None
 		else:
-			# Safe approach: don't try to check length or iterate if type is unknown
 			try:
-				# Check if consumed_products is a valid iterable (like list or dict)
-				consumed_products_info = ""
-				has_products = False
-
-				print(f"Processing consumed products: {consumed_products}")
-
-				# Try to safely iterate through products if they exist
-				try:
-					if consumed_products:
-						iterator = iter(consumed_products)
-						has_products = True
-						print("Successfully validated consumed_products as iterable")
-				except (TypeError, ValueError) as e:
-					# If consumed_products is not iterable or empty
-					has_products = False
-					print(f"Error validating consumed_products: {e}")
-
-				if has_products:
-					print("Building consumption history summary...")
-					consumed_products_info = "\nUser's previously consumed products:\n"
-					total_calories = 0
-					total_protein = 0
-					total_carbs = 0
-					total_fat = 0
-
-					for i, product in enumerate(consumed_products):
-						print(f"Processing product {i+1}: {product}")
-						if isinstance(product, dict) and 'product' in product:
-							product_name = product.get('product', {}).get('name', 'Unknown Product')
-							nutritive_values = product.get('product', {}).get('nutritive_value', {})
-							calories = nutritive_values.get('calories', 0)
-							protein = nutritive_values.get('protein', 0)
-							carbs = nutritive_values.get('carbohydrates', 0)
-							fat = nutritive_values.get('fat', 0)
-
-							print(f"Extracted values for {product_name}: cal={calories}, prot={protein}, carbs={carbs}, fat={fat}")
-
-							# Add to totals
-							total_calories += calories
-							total_protein += protein
-							total_carbs += carbs
-							total_fat += fat
-
-							# Add detailed product info
-							consumed_products_info += f"{i+1}. {product_name}:\n"
-							consumed_products_info += f"   - Calories: {calories} kcal\n"
-							consumed_products_info += f"   - Protein: {protein} g\n"
-							consumed_products_info += f"   - Carbohydrates: {carbs} g\n"
-							consumed_products_info += f"   - Fat: {fat} g\n"
-
-					print(f"Daily totals calculated: cal={total_calories}, prot={total_protein}, carbs={total_carbs}, fat={total_fat}")
-
-					# Add daily totals summary
-					consumed_products_info += f"\nDaily totals so far:\n"
-					consumed_products_info += f"- Total Calories: {total_calories} kcal\n"
-					consumed_products_info += f"- Total Protein: {total_protein} g\n"
-					consumed_products_info += f"- Total Carbohydrates: {total_carbs} g\n"
-					consumed_products_info += f"- Total Fat: {total_fat} g\n"
-					consumed_products_info += f"- Approximate % of 2000 kcal diet: {(total_calories/2000)*100:.1f}%\n"
-
+				# Rendered by HistoryRenderer within its token budget
+				consumed_products_info = consumption_history or ""
 
 				prompt = f"""
 				The user has the following consumption history:
@@ -166,9 +375,8 @@ async def process_message(message: cl.Message, trace, consumed_products):
 				print("Preparing to query Claude with consumption history...")
 
 
-				response = query_claude_3_7(prompt, None, trace, goal="Answer based on consumption history")
+				response = await query_claude_3_7_async(prompt, None, trace, goal="Answer based on consumption history", progress=progress, on_text=on_text)
 
-				print(f"Claude response received: {response}")
 				response_text = response['content'][0]['text']
 
 				elements = []
@@ -178,7 +386,7 @@ async def process_message(message: cl.Message, trace, consumed_products):
 				print(f"Error processing consumption data: {e}")
 				span = trace.span(
 					name="No image or previous JSON",
-					input=message
+					input=message.content
 				)
 				response_text = "Hello! If you have a question about a product's nutrition, please share an image of the product, and I'll be happy to assist you."
 				elements = []
@@ -190,7 +398,7 @@ async def process_message(message: cl.Message, trace, consumed_products):
 	if last_json_response:
 		print(f"Structured data: {json.dumps(last_json_response, indent=2)}")
 
-	return response_text, elements, last_json_response
+	return response_text, elements, last_json_response, products
 
 def format_response(structured_data, explanation):
 	"""
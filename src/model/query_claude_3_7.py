@@ -1,54 +1,127 @@
+import asyncio
+import functools
 import json
+import os
 import base64
+import time
+from datetime import datetime, timezone
 from io import BytesIO
 from PIL import Image
 
+from src.config.model_routes import get_model_route
+from src.config.schemas import get_analysis_schema
+from src.storage.nutrition_index import apply_index_values, get_nutrition_index
+from src.utils.bedrock_limiter import get_bedrock_guard
 from src.utils.bedrock_runtime import get_bedrock_runtime
-from src.utils.image_processor import compress_image
+from src.utils.image_processor import PreparedImage, prepare_image_base64, prepare_image_base64_async
+from src.utils.metrics import observe_stage, observe_usage, stage_timer
+from src.utils.payload_encoder import encode_payload, loads, preencode
+from src.utils.progress import emit_progress
 
 bedrock_runtime = get_bedrock_runtime()
 
-def create_bedrock_payload(input_text, images=None, system_prompt=None, tools=None):
+# The static parts of the payloads (system prompts, tools, inference parameters) are
+# serialized once with preencode() and spliced into each request body by encode_payload()
+
+# System prompt to guide Claude towards using the tool
+STRUCTURED_DATA_SYSTEM_PROMPT = preencode("""
+	You are an assistant specialized in generating structured data.
+	Analyze the request and use the 'generate_structured_data' tool to generate data in JSON format.
+	Do not provide explanations in your first response, only the JSON.
+	""")
+
+EXPLANATION_SYSTEM_PROMPT = preencode("You are an expert in data analysis. Clearly and simply explain the content of the provided JSON.")
+
+# System prompt of the single-call mode, where the tool call also carries the answer
+SINGLE_CALL_SYSTEM_PROMPT = preencode("""
+	You are an assistant specialized in generating structured data.
+	Analyze the request and use the 'generate_structured_data' tool to generate data in JSON format.
+	In the same tool call, fill 'answer' with a direct answer to the user's question based on this data.
+	Be concise (2-3 sentences) and respond in the same language as the question.
+	""")
+
+ANTHROPIC_VERSION = preencode("bedrock-2023-05-31")
+# A tuple, so no payload can append to the shared value and leave its encoding stale
+STOP_SEQUENCES = preencode(())
+
+# Extract the data and answer the question in a single model call
+single_call_extraction = os.getenv("SINGLE_CALL_EXTRACTION", "false").lower() == "true"
+
+# Call sites whose static prompt prefix is marked for Bedrock prompt caching:
+# "structured_data" (system prompt and tool schema) and "follow_up" (product JSON of follow-up questions)
+prompt_cache_sites = {site.strip() for site in os.getenv("PROMPT_CACHE_SITES", "structured_data,follow_up").split(",") if site.strip()}
+
+# Cache breakpoint: everything up to and including the marked block is cached
+CACHE_CONTROL = {"type": "ephemeral"}
+
+# System blocks of the static prompts with a cache breakpoint
+CACHED_SYSTEM_PROMPTS = {
+	prompt: preencode([{"type": "text", "text": prompt, "cache_control": CACHE_CONTROL}])
+	for prompt in (STRUCTURED_DATA_SYSTEM_PROMPT, EXPLANATION_SYSTEM_PROMPT, SINGLE_CALL_SYSTEM_PROMPT)
+}
+
+def prompt_cache_enabled(site, prompt_cache=None):
+	"""
+	Returns whether prompt caching applies to a call site.
+
+	Args:
+		site: Call site name, as listed in PROMPT_CACHE_SITES
+		prompt_cache: Explicit choice of the caller, overrides the configuration when not None
+	"""
+	if prompt_cache is not None:
+		return prompt_cache
+	return site in prompt_cache_sites
+
+def create_bedrock_payload(input_text, images=None, system_prompt=None, tools=None, cache_prefix=False, context=None, cache_context=False):
 	"""
 	Creates the payload for Claude's Bedrock API.
 	
 	Args:
 		input_text: Query text
-		images: List of base64 encoded images
+		images: List of images, as file paths, raw bytes, base64 encoded strings or PreparedImage
 		system_prompt: Optional system prompt
 		tools: List of tools for function calling
+		cache_prefix: Add a cache breakpoint after the tools and system prompt
+		context: Optional text sent before the query text, e.g. data follow-up questions refer to
+		cache_context: Add a cache breakpoint after the context
 		
 	Returns:
 		Dict: Formatted payload for Bedrock API
 	"""
 	# Initialize with text
 	content_items = [{"type": "text", "text": input_text}]
+	if context:
+		context_item = {"type": "text", "text": context}
+		if cache_context:
+			context_item["cache_control"] = CACHE_CONTROL
+		content_items.insert(0, context_item)
 	
 	# Add images if present
 	if images and len(images) > 0:
 		# Limit to the first image to avoid "Too many packets" error
-		base64_image = images[0]
+		image = images[0]
 		
-		# Compress the image
-		compressed_img, media_type = compress_image(base64_image)
+		# Compress the image unless it already was
+		prepared = image if isinstance(image, PreparedImage) else prepare_image_base64(image)
 		
 		# Add the image to content if compression was successful
-		if compressed_img and media_type:
+		if prepared:
 			content_items.append({
 				"type": "image",
 				"source": {
 					"type": "base64",
-					"media_type": media_type,
-					"data": compressed_img
+					"media_type": prepared.media_type,
+					"data": prepared.data
 				}
 			})
 	
 	# Build the base payload
 	payload = {
-		"anthropic_version": "bedrock-2023-05-31",
+		"anthropic_version": ANTHROPIC_VERSION,
+		# max_tokens and temperature are replaced by the route of the call's goal when it is invoked
 		"max_tokens": 1000,  # Increased for longer responses
 		"top_k": 250,
-		"stop_sequences": [],
+		"stop_sequences": STOP_SEQUENCES,
 		"temperature": 0.7,  # Reduced for more precision
 		"top_p": 0.999,
 		"messages": [
@@ -66,155 +139,571 @@ def create_bedrock_payload(input_text, images=None, system_prompt=None, tools=No
 	# Add tools if provided
 	if tools:
 		payload["tools"] = tools
+
+	# The prefix is cached in order tools, system, messages: one breakpoint on the last of them covers both
+	if cache_prefix:
+		if system_prompt:
+			payload["system"] = CACHED_SYSTEM_PROMPTS.get(system_prompt) or [{"type": "text", "text": system_prompt, "cache_control": CACHE_CONTROL}]
+		elif tools:
+			payload["tools"] = tools[:-1] + [{**tools[-1], "cache_control": CACHE_CONTROL}]
 	
 	return payload
 
+async def _prepare_images_async(images):
+	"""
+	Compresses the image sent to Claude on the image executor, off the event loop.
+
+	Returns:
+		List holding the PreparedImage, or None when there is no usable image
+	"""
+	if not images:
+		return None
+	image = images[0]
+	prepared = image if isinstance(image, PreparedImage) else await prepare_image_base64_async(image)
+	return [prepared] if prepared else None
+
+async def create_bedrock_payload_async(input_text, images=None, system_prompt=None, tools=None, **kwargs):
+	"""
+	Awaitable counterpart of create_bedrock_payload, compressing the image on the image executor.
+	"""
+	images = await _prepare_images_async(images)
+	return create_bedrock_payload(input_text, images, system_prompt, tools, **kwargs)
+
+def _usage_details(usage):
+	"""
+	Maps Bedrock usage to Langfuse usage details, with the prompt cache reads and writes.
+	"""
+	details = {
+		"input": usage.get("input_tokens", 0),
+		"output": usage.get("output_tokens", 0),
+	}
+	for key in ("cache_read_input_tokens", "cache_creation_input_tokens"):
+		if usage.get(key):
+			details[key] = usage[key]
+	return details
+
+def _route_payload(payload, goal):
+	"""
+	Picks the model of a call from its goal (see src/config/model_routes.py)
+	and applies the route's max_tokens and temperature to the payload.
+
+	Returns:
+		Tuple (ModelRoute, payload to send)
+	"""
+	has_images = any(
+		isinstance(item, dict) and item.get("type") == "image"
+		for message in payload.get("messages", [])
+		for item in message["content"]
+	)
+	route = get_model_route(goal, has_images)
+	return route, {**payload, "max_tokens": route.max_tokens, "temperature": route.temperature}
+
+def _start_generation(trace, goal, route, payload):
+	# The payload itself is traced, the tracer replaces the image data with its hash and dimensions
+	return trace.generation(
+		name=goal,
+		model=route.name,
+		model_parameters={"max_tokens": route.max_tokens, "temperature": route.temperature},
+		metadata={"model_id": route.model_id, "route": route.model},
+		input=payload
+	)
+
 def invoke_claude_model(payload, trace=None, goal=None):
 	"""
-	Invokes the Claude model via Bedrock.
+	Invokes the Claude model via Bedrock, with the model routed from the goal.
 	
 	Args:
 		payload: Formatted API payload
+		goal: Purpose of the call, selects the model, max_tokens and temperature
 		
 	Returns:
 		Dict: Model response
 	"""
+	route, payload = _route_payload(payload, goal)
+
 	# Convert payload to JSON
-	body_str = json.dumps(payload)
-	
-	# Claude model ID
-	model_id = "us.anthropic.claude-3-7-sonnet-20250219-v1:0"
+	body = encode_payload(payload)
 	
 	# Call Bedrock API
-	generation = trace.generation(
-		name=goal,
-		model="claude-3-7-sonnet-latest",
-		input=body_str
+	generation = _start_generation(trace, goal, route, payload)
+	with stage_timer("bedrock_invoke"):
+		try:
+			response = bedrock_runtime.invoke_model(
+				modelId=route.model_id,
+				contentType="application/json",
+				accept="application/json",
+				body=body
+			)
+			
+			# Process and return response
+			response_body = loads(response['body'].read())
+		except Exception as e:
+			# Each throttled attempt shows up as a failed generation
+			generation.end(level="ERROR", status_message=str(e))
+			raise
+	observe_usage(goal, response_body["usage"])
+
+	generation.end(
+		output=response_body,
+		usage_details=_usage_details(response_body["usage"]),
 	)
-	response = bedrock_runtime.invoke_model(
+
+	return response_body
+
+async def invoke_claude_model_async(payload, trace=None, goal=None):
+	"""
+	Awaitable counterpart of invoke_claude_model.
+
+	The blocking boto3 call runs on the shared Bedrock executor so the event loop
+	keeps serving other sessions while the request is in flight. The Bedrock
+	guard of the routed model limits the calls in flight and retries throttled ones.
+	
+	Args:
+		payload: Formatted API payload
+		
+	Returns:
+		Dict: Model response
+	"""
+	route, _ = _route_payload(payload, goal)
+	return await get_bedrock_guard(route.model_id).call(invoke_claude_model, payload, trace, goal)
+
+def _forward_open_error(queue, reader_task):
+	"""
+	Passes the error of a stream that could not be opened to the reading loop,
+	which is otherwise left waiting for events.
+	"""
+	if not reader_task.cancelled() and reader_task.exception() is not None:
+		queue.put_nowait(reader_task.exception())
+
+def _read_response_stream(model_id, body, loop, queue):
+	"""
+	Reads a Bedrock response stream on an executor thread and forwards each
+	decoded event to the event loop. A final None marks the end of the stream.
+	Errors opening the stream are raised instead, so the call can be retried.
+	"""
+	response = bedrock_runtime.invoke_model_with_response_stream(
 		modelId=model_id,
 		contentType="application/json",
 		accept="application/json",
-		body=body_str
+		body=body
 	)
+	try:
+		for event in response["body"]:
+			chunk = event.get("chunk")
+			if chunk:
+				loop.call_soon_threadsafe(queue.put_nowait, loads(chunk["bytes"]))
+	except Exception as e:
+		loop.call_soon_threadsafe(queue.put_nowait, e)
+	finally:
+		loop.call_soon_threadsafe(queue.put_nowait, None)
+
+async def invoke_claude_model_stream(payload, trace=None, goal=None, on_text=None):
+	"""
+	Invokes the Claude model via Bedrock's response-stream API.
+
+	Text deltas are passed to `on_text` as they arrive, e.g. a Chainlit
+	message's stream_token. The Langfuse generation records the time of the
+	first token and the final usage.
 	
-	# Process and return response
-	response_body = json.loads(response['body'].read().decode('utf-8'))
+	Args:
+		payload: Formatted API payload
+		on_text: Optional coroutine function called with each text delta
+		
+	Returns:
+		Dict: Model response assembled in the same shape as invoke_claude_model
+	"""
+	route, payload = _route_payload(payload, goal)
+	body = encode_payload(payload)
+
+	generation = _start_generation(trace, goal, route, payload)
+
+	loop = asyncio.get_running_loop()
+	queue = asyncio.Queue()
+	with stage_timer("bedrock_stream") as timer:
+		reader = get_bedrock_guard(route.model_id).call(_read_response_stream, route.model_id, body, loop, queue)
+		reader_task = asyncio.ensure_future(reader)
+		reader_task.add_done_callback(functools.partial(_forward_open_error, queue))
+
+		response_body = {"type": "message", "role": "assistant", "content": [], "usage": {}}
+		text = ""
+		first_token = True
+		try:
+			while True:
+				event = await queue.get()
+				if event is None:
+					break
+				if isinstance(event, Exception):
+					raise event
+
+				event_type = event.get("type")
+				if event_type == "message_start":
+					message = event.get("message", {})
+					response_body["id"] = message.get("id")
+					response_body["model"] = message.get("model")
+					response_body["usage"].update(message.get("usage", {}))
+				elif event_type == "content_block_delta":
+					delta = event.get("delta", {})
+					if delta.get("type") == "text_delta":
+						if first_token:
+							generation.update(completion_start_time=datetime.now(timezone.utc))
+							observe_stage("bedrock_first_token", time.perf_counter() - timer.start)
+							first_token = False
+						text += delta.get("text", "")
+						if on_text:
+							await on_text(delta.get("text", ""))
+				elif event_type == "message_delta":
+					response_body["stop_reason"] = event.get("delta", {}).get("stop_reason")
+					response_body["usage"].update(event.get("usage", {}))
+		except Exception as e:
+			generation.end(level="ERROR", status_message=str(e))
+			raise
+		finally:
+			await reader_task
+	observe_usage(goal, response_body["usage"])
+
+	response_body["content"] = [{"type": "text", "text": text}]
 
 	generation.end(
 		output=response_body,
-		usage_details=response_body["usage"],
+		usage_details=_usage_details(response_body["usage"]),
 	)
 
 	return response_body
 
-def query_claude_3_7(input_text, images=None, trace=None, goal=None):
+def query_claude_3_7(input_text, images=None, trace=None, goal=None, context=None, prompt_cache=None):
 	"""
 	Main function to query Claude via Bedrock.
 	
 	Args:
 		input_text: Query text
 		images: List of base64 encoded images
+		context: Optional data the question refers to, sent before it
+		prompt_cache: Cache the context, defaults to the "follow_up" entry of PROMPT_CACHE_SITES
 		
 	Returns:
 		Dict: Formatted model response
 	"""
 	# Create payload
-	payload = create_bedrock_payload(input_text, images)
+	payload = create_bedrock_payload(
+		input_text,
+		images,
+		context=context,
+		cache_context=prompt_cache_enabled("follow_up", prompt_cache)
+	)
 	
 	# Invoke model and return response
 	return invoke_claude_model(payload, trace, goal)
 
-def function_calling_query(input_text, json_schema, images=None, trace=None):
+async def query_claude_3_7_async(input_text, images=None, trace=None, goal=None, progress=None, on_text=None, context=None, prompt_cache=None):
 	"""
-	Executes a two-step query:
-	1. Generates structured JSON according to the provided schema
-	2. Explains the content of the generated JSON
+	Awaitable counterpart of query_claude_3_7.
 	
 	Args:
 		input_text: Query text
-		json_schema: JSON schema for output structure
-		images: List of base64 encoded images (optional)
+		images: List of base64 encoded images
+		progress: Optional ProgressReporter receiving stage events
+		on_text: Optional coroutine function; when set, the answer is streamed to it
+		context: Optional data the question refers to, sent before it
+		prompt_cache: Cache the context, defaults to the "follow_up" entry of PROMPT_CACHE_SITES
 		
 	Returns:
-		Dict: Contains structured JSON and its explanation
+		Dict: Formatted model response
+	"""
+	if images:
+		await emit_progress(progress, "compress_images")
+	payload = await create_bedrock_payload_async(
+		input_text,
+		images,
+		context=context,
+		cache_context=prompt_cache_enabled("follow_up", prompt_cache)
+	)
+	await emit_progress(progress, "answer")
+	with stage_timer("answer"):
+		if on_text:
+			return await invoke_claude_model_stream(payload, trace, goal, on_text)
+		return await invoke_claude_model_async(payload, trace, goal)
+
+def _create_structured_data_tools(json_schema, with_answer=False):
+	"""
+	Builds the tool definitions of the first step of function_calling_query.
+
+	With `with_answer`, the tool also takes an optional `answer` field so a
+	single call returns both the data and the answer to the question.
 	"""
+	tool_properties = {
+		"structured_data": {
+			"type": "object",
+			"description": "Structured data according to the provided schema",
+			"properties": json_schema["properties"]
+		}
+	}
+	if with_answer:
+		tool_properties["answer"] = {
+			"type": "string",
+			"description": "Direct answer to the user's question based on the structured data, in the language of the question"
+		}
+
 	# Define JSON generation tool
 	tools = [{
 		"name": "generate_structured_data",
 		"description": "Generate structured data according to a specified JSON schema",
 		"input_schema": {
 			"type": "object",
-			"properties": {
-				"structured_data": {
-					"type": "object",
-					"description": "Structured data according to the provided schema",
-					"properties": json_schema["properties"]
-				}
-			},
+			"properties": tool_properties,
 			"required": ["structured_data"]
 		}
 	}]
-	
-	# System prompt to guide Claude towards using the tool
-	system_prompt = """
-	You are an assistant specialized in generating structured data.
-	Analyze the request and use the 'generate_structured_data' tool to generate data in JSON format.
-	Do not provide explanations in your first response, only the JSON.
+	return tools
+
+# Tools of the analysis schema, with and without the answer field, serialized once
+ANALYSIS_TOOLS = {with_answer: preencode(_create_structured_data_tools(get_analysis_schema(), with_answer)) for with_answer in (False, True)}
+
+def _create_structured_data_payload(input_text, json_schema, images=None, with_answer=False, cache_prefix=False):
 	"""
-	
-	# 1. First request - Generate structured JSON
-	json_payload = create_bedrock_payload(
+	Builds the payload of the first step of function_calling_query.
+
+	With `cache_prefix`, the tool schema and system prompt, identical for
+	every image, are marked for prompt caching.
+	"""
+	# Identity, not equality: comparing the schema dicts deeply would cost more than building the tools
+	if json_schema is get_analysis_schema():
+		tools = ANALYSIS_TOOLS[with_answer]
+	else:
+		tools = _create_structured_data_tools(json_schema, with_answer)
+
+	return create_bedrock_payload(
 		input_text=input_text,
 		images=images,
-		system_prompt=system_prompt,
-		tools=tools
+		system_prompt=SINGLE_CALL_SYSTEM_PROMPT if with_answer else STRUCTURED_DATA_SYSTEM_PROMPT,
+		tools=tools,
+		cache_prefix=cache_prefix
 	)
-	
-	json_response = invoke_claude_model(json_payload, trace, goal="Extract structured data")
-	
-	# Extract generated JSON
-	tool_response = None
+
+def _extract_tool_response(json_response):
+	"""
+	Returns the structured data of the first tool_use block, or None.
+	"""
 	if "content" in json_response and len(json_response["content"]) > 0:
 		for content_item in json_response["content"]:
 			if content_item.get("type") == "tool_use":
 				# Extract JSON tool response
-				tool_response = content_item.get("input", {}).get("structured_data", {})
-				break
+				return content_item.get("input", {}).get("structured_data", {})
+	return None
+
+def _extract_answer(json_response):
+	"""
+	Returns the answer of a single-call response: the tool's `answer` field,
+	else any text block next to the tool_use block, else an empty string.
+	"""
+	for content_item in json_response.get("content", []):
+		if content_item.get("type") == "tool_use":
+			answer = content_item.get("input", {}).get("answer")
+			if answer:
+				return answer
+	return extract_response_text(json_response).strip()
+
+def _create_explanation_payload(input_text, tool_response):
+	"""
+	Builds the payload of the second step of function_calling_query.
+	"""
+	explanation_prompt = f"""
+	Data: {json.dumps(tool_response, ensure_ascii=False)}
+	Question: "{input_text}"
 	
+	Answer the question directly based on this data. Be concise (2-3 sentences).
+	Respond in the same language as the question.
+	"""
+	
+	return create_bedrock_payload(
+		input_text=explanation_prompt,
+		system_prompt=EXPLANATION_SYSTEM_PROMPT
+	)
+
+def extract_response_text(response):
+	"""
+	Concatenates the text blocks of a model response.
+	"""
+	text = ""
+	if "content" in response and len(response["content"]) > 0:
+		for content_item in response["content"]:
+			if content_item.get("type") == "text":
+				text += content_item.get("text", "")
+	return text
+
+def _apply_nutrition_index(tool_response, trace=None):
+	"""
+	Adds the values per 100 g of the local nutrition index when the extracted
+	product name and brand match an indexed product. The model's whole-product
+	values are kept.
+
+	Returns:
+		The structured data
+	"""
+	index = get_nutrition_index()
+	name = (tool_response.get("product") or {}).get("name") if isinstance(tool_response, dict) else None
+	if index is None or not name:
+		return tool_response
+	with stage_timer("nutrition_index"):
+		index_data = index.match(name)
+	if index_data is None:
+		return tool_response
+	if trace is not None:
+		trace.span(name="Nutrition index match", input=name).end(output=index_data)
+	return apply_index_values(tool_response, index_data)
+
+def function_calling_query(input_text, json_schema, images=None, trace=None, single_call=None, prompt_cache=None):
+	"""
+	Executes a two-step query:
+	1. Generates structured JSON according to the provided schema
+	2. Explains the content of the generated JSON
+
+	In single-call mode the first response also carries the answer and the
+	second request is only made when that answer is missing.
+	
+	Args:
+		input_text: Query text
+		json_schema: JSON schema for output structure
+		images: List of base64 encoded images (optional)
+		single_call: Use the single-call mode, defaults to SINGLE_CALL_EXTRACTION
+		prompt_cache: Cache the tool schema and system prompt, defaults to the "structured_data" entry of PROMPT_CACHE_SITES
+		
+	Returns:
+		Dict: Contains structured JSON and its explanation
+	"""
+	if single_call is None:
+		single_call = single_call_extraction
+
+	# 1. First request - Generate structured JSON
+	json_payload = _create_structured_data_payload(
+		input_text, json_schema, images,
+		with_answer=single_call,
+		cache_prefix=prompt_cache_enabled("structured_data", prompt_cache)
+	)
+	with stage_timer("extract_structured_data"):
+		json_response = invoke_claude_model(json_payload, trace, goal="Extract structured data")
+	
+	# Extract generated JSON
+	tool_response = _extract_tool_response(json_response)
 	if not tool_response:
 		print("Error: No JSON was generated")
 		return {
 			"error": "No JSON was generated",
 			"raw_response": json_response
 		}
+
+	tool_response = _apply_nutrition_index(tool_response, trace)
+
+	answer = _extract_answer(json_response) if single_call else ""
+	if answer:
+		return {
+			"structured_data": tool_response,
+			"explanation": answer,
+			"raw_json_response": json_response,
+			"raw_explanation_response": None
+		}
 	
 	# 2. Second request - Explain the generated JSON
-	explanation_prompt = f"""
-	Data: {json.dumps(tool_response, ensure_ascii=False)}
-	Question: "{input_text}"
+	explanation_payload = _create_explanation_payload(input_text, tool_response)
+	with stage_timer("explain"):
+		explanation_response = invoke_claude_model(explanation_payload, trace, goal="Answer user question")
 	
-	Answer the question directly based on this data. Be concise (2-3 sentences).
-	Respond in the same language as the question.
+	# Format final response
+	return {
+		"structured_data": tool_response,
+		"explanation": extract_response_text(explanation_response),
+		"raw_json_response": json_response,
+		"raw_explanation_response": explanation_response
+	}
+
+async def explain_structured_data_async(input_text, structured_data, trace=None, progress=None, on_text=None):
 	"""
+	Answers the question from already extracted structured data, i.e. the
+	second step of function_calling_query on its own.
 	
-	explanation_payload = create_bedrock_payload(
-		input_text=explanation_prompt,
-		system_prompt="You are an expert in data analysis. Clearly and simply explain the content of the provided JSON."
+	Args:
+		input_text: Query text
+		structured_data: Data previously generated with the structured data tool
+		progress: Optional ProgressReporter receiving stage events
+		on_text: Optional coroutine function; when set, the explanation is streamed to it
+		
+	Returns:
+		Dict: Raw explanation response
+	"""
+	await emit_progress(progress, "explain")
+	explanation_payload = _create_explanation_payload(input_text, structured_data)
+	with stage_timer("explain"):
+		if on_text:
+			return await invoke_claude_model_stream(explanation_payload, trace, "Answer user question", on_text)
+		return await invoke_claude_model_async(explanation_payload, trace, goal="Answer user question")
+
+async def function_calling_query_async(input_text, json_schema, images=None, trace=None, progress=None, on_text=None, single_call=None, prompt_cache=None, explain=True):
+	"""
+	Awaitable counterpart of function_calling_query.
+	
+	Args:
+		input_text: Query text
+		json_schema: JSON schema for output structure
+		images: List of base64 encoded images (optional)
+		progress: Optional ProgressReporter receiving stage events
+		on_text: Optional coroutine function; when set, the explanation is streamed to it
+		single_call: Use the single-call mode, defaults to SINGLE_CALL_EXTRACTION
+		prompt_cache: Cache the tool schema and system prompt, defaults to the "structured_data" entry of PROMPT_CACHE_SITES
+		explain: False to only extract the structured data, the explanation is then empty
+		
+	Returns:
+		Dict: Contains structured JSON and its explanation
+	"""
+	if single_call is None:
+		single_call = single_call_extraction
+	single_call = single_call and explain
+
+	if images:
+		await emit_progress(progress, "compress_images")
+		images = await _prepare_images_async(images)
+	json_payload = _create_structured_data_payload(
+		input_text, json_schema, images,
+		with_answer=single_call,
+		cache_prefix=prompt_cache_enabled("structured_data", prompt_cache)
 	)
+	await emit_progress(progress, "extract_structured_data")
+	with stage_timer("extract_structured_data"):
+		json_response = await invoke_claude_model_async(json_payload, trace, goal="Extract structured data")
 	
-	explanation_response = invoke_claude_model(explanation_payload, trace, goal="Answer user question")
+	tool_response = _extract_tool_response(json_response)
+	if not tool_response:
+		print("Error: No JSON was generated")
+		return {
+			"error": "No JSON was generated",
+			"raw_response": json_response
+		}
+
+	# The full-text query blocks on SQLite, keep it off the event loop
+	tool_response = await asyncio.to_thread(_apply_nutrition_index, tool_response, trace)
+
+	answer = _extract_answer(json_response) if single_call else ""
+	if answer:
+		if on_text:
+			await on_text(answer)
+		return {
+			"structured_data": tool_response,
+			"explanation": answer,
+			"raw_json_response": json_response,
+			"raw_explanation_response": None
+		}
 	
-	# Format final response
-	explanation_text = ""
-	if "content" in explanation_response and len(explanation_response["content"]) > 0:
-		for content_item in explanation_response["content"]:
-			if content_item.get("type") == "text":
-				explanation_text += content_item.get("text", "")
+	if not explain:
+		return {
+			"structured_data": tool_response,
+			"explanation": "",
+			"raw_json_response": json_response,
+			"raw_explanation_response": None
+		}
+
+	explanation_response = await explain_structured_data_async(input_text, tool_response, trace, progress, on_text)
 	
 	return {
 		"structured_data": tool_response,
-		"explanation": explanation_text,
+		"explanation": extract_response_text(explanation_response),
 		"raw_json_response": json_response,
 		"raw_explanation_response": explanation_response
-	}
\ No newline at end of file
+	}
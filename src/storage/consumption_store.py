@@ -0,0 +1,261 @@
+import abc
+import json
+import os
+import sqlite3
+import threading
+from datetime import date, datetime
+
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# "sqlite" (default) or "memory"
+consumption_store_kind = os.getenv("CONSUMPTION_STORE", "sqlite")
+consumption_db = os.getenv("CONSUMPTION_DB", "consumption.db")
+
+# Nutrients summed into the daily totals, as named in get_analysis_schema()
+NUTRIENTS = ["calories", "protein", "carbohydrates", "fat", "sugar", "fiber", "sodium"]
+
+_consumption_store = None
+
+
+def _number(value):
+	"""
+	Returns value as a float, 0 when the model returned nothing usable.
+	"""
+	try:
+		return float(value or 0)
+	except (TypeError, ValueError):
+		return 0.0
+
+def _clean(value):
+	"""
+	Returns whole floats as ints so totals display as "120" rather than "120.0".
+	"""
+	return int(value) if float(value).is_integer() else round(value, 2)
+
+def product_nutrients(product_data):
+	"""
+	Extracts the summed nutrients of a product record.
+
+	Args:
+		product_data: Structured data as produced with get_analysis_schema()
+
+	Returns:
+		Dict: Nutrient name to value
+	"""
+	nutritive_values = {}
+	if isinstance(product_data, dict):
+		nutritive_values = product_data.get("product", {}).get("nutritive_value", {}) or {}
+	return {nutrient: _number(nutritive_values.get(nutrient)) for nutrient in NUTRIENTS}
+
+def _day_key(day):
+	if day is None:
+		day = date.today()
+	return day.isoformat() if isinstance(day, date) else str(day)
+
+def _empty_totals():
+	totals = {"count": 0}
+	totals.update({nutrient: 0 for nutrient in NUTRIENTS})
+	return totals
+
+
+class ConsumptionStore(abc.ABC):
+	"""
+	Stores the products each user consumed and keeps running per-user,
+	per-day totals updated on insert, so summaries never re-walk the list.
+	"""
+
+	@abc.abstractmethod
+	def add_product(self, user_id, product_data, consumed_at=None):
+		"""
+		Appends a product to the user's consumption and updates the day's totals.
+
+		Args:
+			user_id: User identifier
+			product_data: Structured data as produced with get_analysis_schema()
+			consumed_at: Optional datetime, defaults to now
+		"""
+		raise NotImplementedError
+
+	@abc.abstractmethod
+	def list_products(self, user_id, day=None):
+		"""
+		Returns the products consumed by the user on a day (today by default), oldest first.
+		"""
+		raise NotImplementedError
+
+	@abc.abstractmethod
+	def daily_totals(self, user_id, day=None):
+		"""
+		Returns the product count and nutrient totals of a day (today by default).
+		"""
+		raise NotImplementedError
+
+	@abc.abstractmethod
+	def history(self, user_id, after_id=0, day=None):
+		"""
+		Returns the user's records added after `after_id`, oldest first.
+
+		Args:
+			user_id: User identifier
+			after_id: Id of the last record already seen
+			day: Optional date, restricts the records to that day
+
+		Returns:
+			List of (record_id, consumed_at_timestamp, product_data)
+		"""
+		raise NotImplementedError
+
+	def close(self):
+		pass
+
+
+class InMemoryConsumptionStore(ConsumptionStore):
+	"""
+	Process-local store, lost on restart. Useful for development and load tests.
+	"""
+
+	def __init__(self):
+		self._products = {}
+		self._records = {}
+		self._totals = {}
+		self._lock = threading.Lock()
+
+	def add_product(self, user_id, product_data, consumed_at=None):
+		consumed_at = consumed_at or datetime.now()
+		key = (user_id, _day_key(consumed_at.date()))
+		nutrients = product_nutrients(product_data)
+		with self._lock:
+			self._products.setdefault(key, []).append(product_data)
+			records = self._records.setdefault(user_id, [])
+			records.append((len(records) + 1, consumed_at.timestamp(), product_data))
+			totals = self._totals.setdefault(key, _empty_totals())
+			totals["count"] += 1
+			for nutrient, value in nutrients.items():
+				totals[nutrient] += value
+
+	def list_products(self, user_id, day=None):
+		with self._lock:
+			return list(self._products.get((user_id, _day_key(day)), []))
+
+	def daily_totals(self, user_id, day=None):
+		with self._lock:
+			totals = dict(self._totals.get((user_id, _day_key(day)), _empty_totals()))
+		return {key: _clean(value) for key, value in totals.items()}
+
+	def history(self, user_id, after_id=0, day=None):
+		with self._lock:
+			# Record ids are 1-based positions in the user's list
+			records = self._records.get(user_id, [])[after_id:]
+		if day is not None:
+			day_key = _day_key(day)
+			records = [record for record in records if _day_key(datetime.fromtimestamp(record[1]).date()) == day_key]
+		return records
+
+
+class SQLiteConsumptionStore(ConsumptionStore):
+	"""
+	SQLite store in WAL mode. Several worker processes can share the same
+	file: readers never block, and writers serialize on the database lock.
+	"""
+
+	def __init__(self, db_path, busy_timeout_ms=5000):
+		"""
+		Args:
+			db_path: Path of the SQLite file
+			busy_timeout_ms: How long a writer waits for another process's write to finish
+		"""
+		self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+		self._lock = threading.Lock()
+		self._db.execute(f"PRAGMA busy_timeout={int(busy_timeout_ms)}")
+		self._db.execute("PRAGMA journal_mode=WAL")
+		self._db.execute("PRAGMA synchronous=NORMAL")
+
+		nutrient_columns = ", ".join(f"{nutrient} REAL NOT NULL DEFAULT 0" for nutrient in NUTRIENTS)
+		self._db.execute(
+			"CREATE TABLE IF NOT EXISTS consumed_products ("
+			"id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL, day TEXT NOT NULL, "
+			"consumed_at REAL NOT NULL, product_data TEXT NOT NULL)"
+		)
+		self._db.execute(
+			"CREATE INDEX IF NOT EXISTS consumed_products_user_day ON consumed_products (user_id, day)"
+		)
+		self._db.execute(
+			"CREATE INDEX IF NOT EXISTS consumed_products_user_id ON consumed_products (user_id, id)"
+		)
+		self._db.execute(
+			"CREATE TABLE IF NOT EXISTS daily_totals ("
+			f"user_id TEXT NOT NULL, day TEXT NOT NULL, count INTEGER NOT NULL DEFAULT 0, {nutrient_columns}, "
+			"PRIMARY KEY (user_id, day))"
+		)
+
+	def add_product(self, user_id, product_data, consumed_at=None):
+		consumed_at = consumed_at or datetime.now()
+		day = _day_key(consumed_at.date())
+		nutrients = product_nutrients(product_data)
+
+		columns = ", ".join(NUTRIENTS)
+		placeholders = ", ".join("?" for _ in NUTRIENTS)
+		increments = ", ".join(f"{nutrient} = {nutrient} + excluded.{nutrient}" for nutrient in NUTRIENTS)
+		with self._lock:
+			# IMMEDIATE takes the write lock up front so concurrent workers cannot interleave the two statements
+			self._db.execute("BEGIN IMMEDIATE")
+			try:
+				self._db.execute(
+					"INSERT INTO consumed_products (user_id, day, consumed_at, product_data) VALUES (?, ?, ?, ?)",
+					(user_id, day, consumed_at.timestamp(), json.dumps(product_data, ensure_ascii=False))
+				)
+				self._db.execute(
+					f"INSERT INTO daily_totals (user_id, day, count, {columns}) VALUES (?, ?, 1, {placeholders}) "
+					f"ON CONFLICT (user_id, day) DO UPDATE SET count = count + 1, {increments}",
+					(user_id, day, *[nutrients[nutrient] for nutrient in NUTRIENTS])
+				)
+				self._db.execute("COMMIT")
+			except Exception:
+				self._db.execute("ROLLBACK")
+				raise
+
+	def list_products(self, user_id, day=None):
+		with self._lock:
+			rows = self._db.execute(
+				"SELECT product_data FROM consumed_products WHERE user_id = ? AND day = ? ORDER BY id",
+				(user_id, _day_key(day))
+			).fetchall()
+		return [json.loads(row[0]) for row in rows]
+
+	def daily_totals(self, user_id, day=None):
+		with self._lock:
+			row = self._db.execute(
+				f"SELECT count, {', '.join(NUTRIENTS)} FROM daily_totals WHERE user_id = ? AND day = ?",
+				(user_id, _day_key(day))
+			).fetchone()
+		if row is None:
+			return _empty_totals()
+		return {key: _clean(value) for key, value in zip(["count"] + NUTRIENTS, row)}
+
+	def history(self, user_id, after_id=0, day=None):
+		query = "SELECT id, consumed_at, product_data FROM consumed_products WHERE user_id = ? AND id > ?"
+		params = (user_id, after_id)
+		if day is not None:
+			query += " AND day = ?"
+			params += (_day_key(day),)
+		with self._lock:
+			rows = self._db.execute(query + " ORDER BY id", params).fetchall()
+		return [(record_id, consumed_at, json.loads(product_data)) for record_id, consumed_at, product_data in rows]
+
+	def close(self):
+		with self._lock:
+			self._db.close()
+
+
+def get_consumption_store():
+	"""Return the process-wide consumption store configured from the environment."""
+	global _consumption_store
+	if _consumption_store is None:
+		if consumption_store_kind == "memory":
+			_consumption_store = InMemoryConsumptionStore()
+		else:
+			_consumption_store = SQLiteConsumptionStore(consumption_db)
+	return _consumption_store
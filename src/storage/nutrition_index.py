@@ -0,0 +1,405 @@
+"""
+Local product nutrition index built from an Open Food Facts export.
+
+Build it once, offline, from the CSV export (en.openfoodfacts.org.products.csv[.gz])
+or the JSONL export (openfoodfacts-products.jsonl[.gz]):
+
+	python -m src.storage.nutrition_index build openfoodfacts-products.jsonl.gz --db nutrition_index.db
+
+and query it:
+
+	python -m src.storage.nutrition_index query "Nutella" --db nutrition_index.db
+	python -m src.storage.nutrition_index query 3017620422003 --db nutrition_index.db
+"""
+import argparse
+import csv
+import gzip
+import itertools
+import json
+import math
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import unicodedata
+
+from dotenv import load_dotenv
+
+from src.storage.consumption_store import NUTRIENTS, _clean
+
+# Load environment variables from .env file
+load_dotenv()
+
+# SQLite file built with `python -m src.storage.nutrition_index build`, leave empty to disable
+nutrition_index_db = os.getenv("NUTRITION_INDEX_DB", "")
+
+# Open Food Facts nutriment per 100 g of each nutrient, and the factor to the unit of get_analysis_schema()
+OFF_NUTRIMENTS = {
+	"calories": ("energy-kcal_100g", 1),
+	"protein": ("proteins_100g", 1),
+	"fat": ("fat_100g", 1),
+	"carbohydrates": ("carbohydrates_100g", 1),
+	"sugar": ("sugars_100g", 1),
+	"fiber": ("fiber_100g", 1),
+	# Grams in Open Food Facts, milligrams in the schema
+	"sodium": ("sodium_100g", 1000),
+}
+# Net quantity of the package in g (or ml), normalized by Open Food Facts
+OFF_QUANTITY = "product_quantity"
+
+# Candidates fetched from the full-text index before scoring
+SEARCH_CANDIDATES = 20
+# Words of a product name used for the search
+MAX_QUERY_TOKENS = 8
+
+_nutrition_index = None
+_nutrition_index_loaded = False
+
+
+def _normalize(text):
+	text = unicodedata.normalize("NFKD", (text or "").lower().replace("ß", "ss"))
+	return "".join(char for char in text if not unicodedata.combining(char))
+
+def _tokens(text):
+	return re.findall(r"\w+", _normalize(text))
+
+def normalize_barcode(code):
+	"""
+	Returns the digits of a barcode, UPC-A (12 digits) widened to EAN-13, or None.
+	"""
+	digits = re.sub(r"\D", "", str(code or ""))
+	if not digits:
+		return None
+	return digits.zfill(13) if len(digits) == 12 else digits
+
+def _number(value):
+	try:
+		number = float(value)
+	except (TypeError, ValueError):
+		return None
+	return number if number >= 0 else None
+
+def _split_ingredients(text):
+	"""
+	Splits an ingredients text on the commas outside parentheses.
+	"""
+	ingredients, depth, current = [], 0, ""
+	for char in text or "":
+		if char in "([":
+			depth += 1
+		elif char in ")]":
+			depth = max(0, depth - 1)
+		if char in ",;" and depth == 0:
+			ingredients.append(current)
+			current = ""
+		else:
+			current += char
+	ingredients.append(current)
+	return [ingredient.strip(" ._*") for ingredient in ingredients if ingredient.strip(" ._*")]
+
+def _off_row(product):
+	"""
+	Converts an Open Food Facts product, a CSV row or a JSONL record, to an index row, or None if unusable.
+	"""
+	code = normalize_barcode(product.get("code"))
+	name = (product.get("product_name") or "").strip()
+	if not code or not name:
+		return None
+	# The JSONL export nests the nutriments, the CSV export flattens them
+	nutriments = product.get("nutriments") or product
+	values = []
+	for nutrient in NUTRIENTS:
+		field, factor = OFF_NUTRIMENTS[nutrient]
+		value = _number(nutriments.get(field))
+		if nutrient == "calories" and value is None:
+			# Energy in kJ only
+			value = _number(nutriments.get("energy_100g"))
+			value = value / 4.184 if value is not None else None
+		values.append(value * factor if value is not None else None)
+	if values[0] is None:
+		return None
+	quantity = _number(product.get(OFF_QUANTITY))
+	origin = (product.get("origins") or product.get("manufacturing_places") or "").strip()
+	ingredients = _split_ingredients(product.get("ingredients_text"))
+	brands = product.get("brands") or ""
+	if isinstance(brands, list):
+		brands = ", ".join(brands)
+	return (code, name, brands.strip(), origin, json.dumps(ingredients, ensure_ascii=False), quantity or None, *values)
+
+def read_open_food_facts(path):
+	"""
+	Yields the products of an Open Food Facts CSV (tab-separated) or JSONL export, gzipped or not.
+	"""
+	opener = gzip.open if path.endswith(".gz") else open
+	with opener(path, "rt", encoding="utf-8", errors="replace", newline="") as file:
+		if ".jsonl" in path or ".json" in path:
+			for line in file:
+				line = line.strip()
+				if line:
+					try:
+						yield json.loads(line)
+					except json.JSONDecodeError:
+						continue
+		else:
+			csv.field_size_limit(sys.maxsize)
+			yield from csv.DictReader(file, delimiter="\t", quoting=csv.QUOTE_NONE)
+
+
+class NutritionIndex:
+	"""
+	Product nutrition values per 100 g in SQLite: a products table keyed on the
+	barcode and an FTS5 index over names and brands. Name lookups fetch a few
+	full-text candidates and score them on the share of words in common.
+
+	Lookups return the values per 100 g as `nutritive_value_per_100g`. The
+	schema's `nutritive_value`, for the whole product, is only filled when the
+	package quantity is known.
+	"""
+
+	def __init__(self, db_path, read_only=True):
+		"""
+		Args:
+			db_path: Path of the SQLite file
+			read_only: Open an existing index for lookups; False to create or fill it
+		"""
+		if read_only:
+			self._db = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+		else:
+			self._db = sqlite3.connect(db_path, check_same_thread=False)
+			nutrient_columns = ", ".join(f"{nutrient} REAL" for nutrient in NUTRIENTS)
+			self._db.execute(
+				"CREATE TABLE IF NOT EXISTS products ("
+				"id INTEGER PRIMARY KEY, code TEXT NOT NULL UNIQUE, name TEXT NOT NULL, brands TEXT NOT NULL, "
+				f"origin TEXT NOT NULL, ingredients TEXT NOT NULL, quantity REAL, {nutrient_columns})"
+			)
+			if "quantity" not in self._columns():
+				# Index built before package quantities were imported
+				self._db.execute("ALTER TABLE products ADD COLUMN quantity REAL")
+			self._db.execute(
+				"CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5("
+				"name, brands, content='products', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+			)
+		self._lock = threading.Lock()
+		# Read-only indexes built before package quantities were imported have no quantity column
+		quantity = "p.quantity" if "quantity" in self._columns() else "NULL"
+		self._select = f"SELECT p.code, p.name, p.brands, p.origin, p.ingredients, {quantity}, {', '.join('p.' + n for n in NUTRIENTS)} FROM products p"
+
+	def _columns(self):
+		return {row[1] for row in self._db.execute("PRAGMA table_info(products)")}
+
+	def import_products(self, products, batch_size=10000):
+		"""
+		Adds or replaces products, then rebuilds the full-text index.
+
+		Args:
+			products: Iterable of Open Food Facts products, e.g. read_open_food_facts(path)
+
+		Returns:
+			Tuple (products read, products indexed)
+		"""
+		columns = "code, name, brands, origin, ingredients, quantity, " + ", ".join(NUTRIENTS)
+		placeholders = ", ".join("?" for _ in range(6 + len(NUTRIENTS)))
+		read = indexed = 0
+		batch = []
+		with self._lock:
+			self._db.execute("PRAGMA journal_mode=OFF")
+			self._db.execute("PRAGMA synchronous=OFF")
+			for product in products:
+				read += 1
+				row = _off_row(product)
+				if row is not None:
+					batch.append(row)
+				if len(batch) >= batch_size:
+					indexed += len(batch)
+					self._db.executemany(f"INSERT OR REPLACE INTO products ({columns}) VALUES ({placeholders})", batch)
+					batch = []
+			if batch:
+				indexed += len(batch)
+				self._db.executemany(f"INSERT OR REPLACE INTO products ({columns}) VALUES ({placeholders})", batch)
+			self._db.execute("INSERT INTO products_fts (products_fts) VALUES ('rebuild')")
+			self._db.execute("INSERT INTO products_fts (products_fts) VALUES ('optimize')")
+			self._db.commit()
+		return read, indexed
+
+	def _product_data(self, row):
+		"""
+		Returns a products row in the get_analysis_schema() shape; unknown nutrients are left out.
+		The values per 100 g are scaled to the whole product when its quantity is known.
+		"""
+		code, name, brands, origin, ingredients, quantity, *values = row
+		per_100g = {nutrient: value for nutrient, value in zip(NUTRIENTS, values) if value is not None}
+		product = {
+			"name": name,
+			"origin": origin,
+			"ingredients": json.loads(ingredients),
+			"nutritive_value_per_100g": {nutrient: _clean(round(value, 2)) for nutrient, value in per_100g.items()},
+		}
+		if quantity:
+			product["quantity_g"] = _clean(quantity)
+			product["nutritive_value"] = {
+				nutrient: _clean(round(value * quantity / 100, 2)) for nutrient, value in per_100g.items()
+			}
+		return {"product": product}
+
+	def lookup_barcode(self, code):
+		"""
+		Returns the product with this EAN-13 or UPC-A barcode in the get_analysis_schema() shape, or None.
+		"""
+		code = normalize_barcode(code)
+		if code is None:
+			return None
+		with self._lock:
+			row = self._db.execute(f"{self._select} WHERE p.code = ?", (code,)).fetchone()
+		return self._product_data(row) if row else None
+
+	def search(self, name, limit=5, min_score=0.0):
+		"""
+		Finds the products whose name is closest to `name`.
+
+		Args:
+			name: Product name, e.g. as extracted by the model
+			limit: Maximum number of results
+			min_score: Lowest score returned; a higher one lets the full-text query skip more products
+
+		Returns:
+			List of (score, barcode, product_data), best first. The score is the
+			Dice coefficient of the query words and the product's name words,
+			brand words counting when they appear in the query.
+		"""
+		results = self._scored_rows(name, min_score)
+		return [(score, row[0], self._product_data(row)) for score, _, row in results[:limit]]
+
+	def _scored_rows(self, name, min_score):
+		"""
+		Returns the (score, known values, row) of the candidates reaching min_score, best first.
+		"""
+		query_tokens = set(_tokens(name)[:MAX_QUERY_TOKENS])
+		if not query_tokens:
+			return []
+		terms = ['"' + token.replace('"', '') + '"' for token in sorted(query_tokens)]
+		# A product sharing m of the q query words scores at most 2m / (q + m)
+		needed = max(1, math.ceil(min_score * len(terms) / (2 - min_score)))
+		queries = [" AND ".join(terms)]
+		if needed < len(terms):
+			queries.append(" OR ".join(
+				"(" + " AND ".join(combination) + ")" for combination in itertools.combinations(terms, needed)
+			))
+		rows = []
+		with self._lock:
+			# Products with every word first, then those with enough words to reach min_score
+			for query in queries:
+				rows = self._db.execute(
+					f"{self._select} JOIN products_fts ON p.id = products_fts.rowid "
+					"WHERE products_fts MATCH ? ORDER BY rank LIMIT ?",
+					(query, SEARCH_CANDIDATES)
+				).fetchall()
+				if rows:
+					break
+
+		results = []
+		for row in rows:
+			name_tokens = set(_tokens(row[1]))
+			brand_tokens = set(_tokens(row[2])) & query_tokens
+			candidate_tokens = name_tokens | brand_tokens
+			score = 2 * len(query_tokens & candidate_tokens) / (len(query_tokens) + len(candidate_tokens))
+			# Among equal names, prefer the most complete nutrition values
+			known = sum(value is not None for value in row[6:])
+			if score >= min_score:
+				results.append((score, known, row))
+		results.sort(key=lambda result: (result[0], result[1]), reverse=True)
+		return results
+
+	def match(self, name):
+		"""
+		Returns the product named exactly `name` in the get_analysis_schema() shape, else None.
+
+		The name must be made of the product's name and brand words, the brand
+		included: a similar name ("Coca-Cola" for "Coca-Cola Zero") or a generic
+		one without a brand ("Greek yogurt") may be another product.
+		"""
+		tokens = _tokens(name)
+		if len(tokens) > MAX_QUERY_TOKENS:
+			# Past this the query leaves words out
+			return None
+		words = set(tokens)
+		for _, _, row in self._scored_rows(name, min_score=1.0):
+			brand_words = set(_tokens(row[2]))
+			if brand_words and brand_words <= words:
+				return self._product_data(row)
+		return None
+
+	def stats(self):
+		with self._lock:
+			count = self._db.execute("SELECT count(*) FROM products").fetchone()[0]
+		return {"products": count}
+
+	def close(self):
+		with self._lock:
+			self._db.close()
+
+
+def apply_index_values(product_data, index_data):
+	"""
+	Returns product_data with the index's values per 100 g, and its origin and
+	ingredients when the model found none. The model's name and whole-product
+	values are kept: the same name and brand may come in several package sizes.
+	"""
+	product = dict(product_data.get("product", {}))
+	indexed = index_data["product"]
+	product["nutritive_value_per_100g"] = indexed["nutritive_value_per_100g"]
+	if not product.get("origin") and indexed["origin"]:
+		product["origin"] = indexed["origin"]
+	if not product.get("ingredients") and indexed["ingredients"]:
+		product["ingredients"] = indexed["ingredients"]
+	return {**product_data, "product": product}
+
+
+def get_nutrition_index():
+	"""Return the process-wide nutrition index, or None when NUTRITION_INDEX_DB is unset or missing."""
+	global _nutrition_index, _nutrition_index_loaded
+	if not _nutrition_index_loaded:
+		_nutrition_index_loaded = True
+		if nutrition_index_db and os.path.exists(nutrition_index_db):
+			_nutrition_index = NutritionIndex(nutrition_index_db)
+		elif nutrition_index_db:
+			print(f"Nutrition index {nutrition_index_db} not found, product values come from the model only")
+	return _nutrition_index
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--db", default=nutrition_index_db or "nutrition_index.db", help="Index SQLite file")
+	subparsers = parser.add_subparsers(dest="command", required=True)
+	build = subparsers.add_parser("build", help="Import an Open Food Facts export")
+	build.add_argument("export", help="CSV or JSONL export, optionally gzipped")
+	query = subparsers.add_parser("query", help="Look up a barcode or a product name")
+	query.add_argument("text")
+	query.add_argument("--limit", type=int, default=5)
+	args = parser.parse_args()
+
+	if args.command == "build":
+		index = NutritionIndex(args.db, read_only=False)
+		start = time.perf_counter()
+		read, indexed = index.import_products(read_open_food_facts(args.export))
+		print(f"Indexed {indexed} of {read} products into {args.db} in {time.perf_counter() - start:.1f}s")
+		index.close()
+		return
+
+	index = NutritionIndex(args.db)
+	start = time.perf_counter()
+	if args.text.isdigit():
+		product_data = index.lookup_barcode(args.text)
+		results = [(1.0, normalize_barcode(args.text), product_data)] if product_data else []
+	else:
+		results = index.search(args.text, args.limit)
+	elapsed = (time.perf_counter() - start) * 1000
+	for score, code, product_data in results:
+		print(f"{score:.2f}  {code}  {json.dumps(product_data, ensure_ascii=False)}")
+	print(f"{len(results)} results in {elapsed:.3f} ms")
+	index.close()
+
+
+if __name__ == "__main__":
+	main()
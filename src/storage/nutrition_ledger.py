@@ -0,0 +1,171 @@
+import os
+import threading
+from collections import OrderedDict
+from datetime import date, datetime
+
+import numpy as np
+from dotenv import load_dotenv
+
+from src.storage.consumption_store import NUTRIENTS, _clean, get_consumption_store, product_nutrients
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Daily reference intakes the reports compare against (FDA daily values, sodium in mg)
+DAILY_TARGETS = {
+	"calories": float(os.getenv("TARGET_CALORIES", "2000")),
+	"protein": float(os.getenv("TARGET_PROTEIN", "50")),
+	"carbohydrates": float(os.getenv("TARGET_CARBOHYDRATES", "275")),
+	"fat": float(os.getenv("TARGET_FAT", "78")),
+	"sugar": float(os.getenv("TARGET_SUGAR", "50")),
+	"fiber": float(os.getenv("TARGET_FIBER", "28")),
+	"sodium": float(os.getenv("TARGET_SODIUM", "2300")),
+}
+# Users whose history columns are kept in memory
+nutrition_ledger_users = int(os.getenv("NUTRITION_LEDGER_USERS", "1024"))
+
+_nutrition_ledger = None
+
+
+class UserLedger:
+	"""
+	Columnar intake history of one user: a timestamp column, a local day column
+	and one float column per nutrient, grown by doubling so appends are amortized O(1).
+	"""
+
+	def __init__(self, capacity=64):
+		self.size = 0
+		self.last_record_id = 0
+		self.timestamps = np.zeros(capacity, dtype=np.float64)
+		# Local calendar day (proleptic ordinal) of each entry, fixed when it is recorded
+		self.days = np.zeros(capacity, dtype=np.int32)
+		self.values = np.zeros((capacity, len(NUTRIENTS)), dtype=np.float64)
+
+	def _grow(self, needed):
+		capacity = len(self.timestamps)
+		if needed <= capacity:
+			return
+		while capacity < needed:
+			capacity *= 2
+		self.timestamps = np.resize(self.timestamps, capacity)
+		self.days = np.resize(self.days, capacity)
+		self.values = np.resize(self.values, (capacity, len(NUTRIENTS)))
+
+	def extend(self, records):
+		"""
+		Appends store records, as returned by ConsumptionStore.history().
+		"""
+		if not records:
+			return
+		self._grow(self.size + len(records))
+		end = self.size + len(records)
+		self.timestamps[self.size:end] = [consumed_at for _, consumed_at, _ in records]
+		self.days[self.size:end] = [datetime.fromtimestamp(consumed_at).toordinal() for _, consumed_at, _ in records]
+		self.values[self.size:end] = [
+			[nutrients[nutrient] for nutrient in NUTRIENTS]
+			for nutrients in (product_nutrients(product_data) for _, _, product_data in records)
+		]
+		self.size = end
+		self.last_record_id = records[-1][0]
+
+	def daily_matrix(self, first_day, last_day):
+		"""
+		Sums the entries of each day in [first_day, last_day].
+
+		Returns:
+			Tuple (totals, counts): (days, nutrients) array of daily totals and the entry count of each day
+		"""
+		window = last_day - first_day + 1
+		days = self.days[:self.size]
+		mask = (days >= first_day) & (days <= last_day)
+		offsets = days[mask] - first_day
+		counts = np.bincount(offsets, minlength=window)
+		totals = np.zeros((window, len(NUTRIENTS)), dtype=np.float64)
+		np.add.at(totals, offsets, self.values[:self.size][mask])
+		return totals, counts
+
+
+class NutritionLedger:
+	"""
+	Vectorized trend reports over each user's consumption history.
+
+	The consumption store stays the source of truth: each user's columns are
+	loaded on first use and topped up with the records added since, so entries
+	written by other worker processes are picked up too. Only the most recently
+	reported users are kept; an evicted user is simply reloaded from the store.
+	"""
+
+	def __init__(self, store, targets=None, max_users=1024):
+		"""
+		Args:
+			store: ConsumptionStore to read the history from
+			targets: Daily targets per nutrient, DAILY_TARGETS by default
+			max_users: Users whose columns are kept, least recently used dropped first
+		"""
+		self.store = store
+		self.targets = targets or DAILY_TARGETS
+		self.max_users = max_users
+		self._ledgers = OrderedDict()
+		self._lock = threading.Lock()
+
+	def _sync(self, user_id):
+		with self._lock:
+			ledger = self._ledgers.setdefault(user_id, UserLedger())
+			self._ledgers.move_to_end(user_id)
+			while len(self._ledgers) > self.max_users:
+				self._ledgers.popitem(last=False)
+			ledger.extend(self.store.history(user_id, after_id=ledger.last_record_id))
+			return ledger
+
+	def report(self, user_id, window_days=7, today=None):
+		"""
+		Builds a rolling-window report ending today.
+
+		Args:
+			user_id: User identifier
+			window_days: Length of the window in days, e.g. 7 or 30
+			today: Optional date the window ends on, defaults to today
+
+		Returns:
+			Dict: window_days, days_logged, entries and, per nutrient, the total, the average
+			per logged day, the delta of that average vs. the target and the change vs. the
+			previous window (None when the previous window has no entries)
+		"""
+		last_day = (today or date.today()).toordinal()
+		ledger = self._sync(user_id)
+		# Current and previous window in one pass
+		totals, counts = ledger.daily_matrix(last_day - 2 * window_days + 1, last_day)
+		previous_totals, current_totals = totals[:window_days], totals[window_days:]
+		previous_counts, current_counts = counts[:window_days], counts[window_days:]
+
+		days_logged = int(np.count_nonzero(current_counts))
+		previous_days_logged = int(np.count_nonzero(previous_counts))
+		window_totals = current_totals.sum(axis=0)
+		averages = window_totals / max(days_logged, 1)
+		previous_averages = previous_totals.sum(axis=0) / max(previous_days_logged, 1)
+		targets = np.array([self.targets[nutrient] for nutrient in NUTRIENTS])
+
+		nutrients = {}
+		for index, nutrient in enumerate(NUTRIENTS):
+			nutrients[nutrient] = {
+				"total": _clean(float(window_totals[index])),
+				"average": _clean(round(float(averages[index]), 1)),
+				"target": _clean(float(targets[index])),
+				"delta": _clean(round(float(averages[index] - targets[index]), 1)),
+				"change": _clean(round(float(averages[index] - previous_averages[index]), 1)) if previous_days_logged else None,
+			}
+
+		return {
+			"window_days": window_days,
+			"days_logged": days_logged,
+			"entries": int(current_counts.sum()),
+			"nutrients": nutrients,
+		}
+
+
+def get_nutrition_ledger():
+	"""Return the process-wide nutrition ledger over the consumption store."""
+	global _nutrition_ledger
+	if _nutrition_ledger is None:
+		_nutrition_ledger = NutritionLedger(get_consumption_store(), max_users=nutrition_ledger_users)
+	return _nutrition_ledger
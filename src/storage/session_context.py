@@ -0,0 +1,138 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Analysed products remembered per chat session for follow-up questions
+session_context_products = int(os.getenv("SESSION_CONTEXT_PRODUCTS", "3"))
+# Upper bound on the serialized products kept across all sessions
+session_context_max_bytes = int(os.getenv("SESSION_CONTEXT_MAX_BYTES", str(16 * 1024 * 1024)))
+# Idle sessions are dropped after this many seconds
+session_context_ttl = int(os.getenv("SESSION_CONTEXT_TTL", "3600"))
+
+_session_context = None
+
+
+class SessionContextStore:
+	"""
+	Remembers the last products analysed in each chat session, so follow-up
+	questions are answered against that session's data only.
+
+	Sessions are kept in LRU order. Idle sessions expire after the TTL and the
+	least recently used ones are evicted once the memory cap is reached.
+	"""
+
+	def __init__(self, max_products=3, max_bytes=16 * 1024 * 1024, ttl_seconds=3600):
+		"""
+		Args:
+			max_products: Products kept per session, oldest dropped first
+			max_bytes: Cap on the serialized size of all stored products
+			ttl_seconds: Idle time after which a session's context is dropped
+		"""
+		self.max_products = max_products
+		self.max_bytes = max_bytes
+		self.ttl_seconds = ttl_seconds
+		# session_id -> (last_used, [(size, product_data), ...])
+		self._sessions = OrderedDict()
+		self._bytes = 0
+		self._lock = threading.Lock()
+		self.counters = {
+			"evictions": 0,
+			"expirations": 0,
+		}
+
+	def add_products(self, session_id, products):
+		"""
+		Records the products analysed for a message of the session.
+
+		Args:
+			session_id: Chainlit session identifier
+			products: Structured data of each analysed product
+		"""
+		if not products:
+			return
+		now = time.time()
+		with self._lock:
+			self._expire(now)
+			_, entries = self._sessions.pop(session_id, (now, []))
+			for product_data in products:
+				size = len(json.dumps(product_data, ensure_ascii=False).encode("utf-8"))
+				entries.append((size, product_data))
+				self._bytes += size
+			while len(entries) > self.max_products:
+				self._bytes -= entries.pop(0)[0]
+			self._sessions[session_id] = (now, entries)
+
+			# Evict other sessions first, the current one only if it alone exceeds the cap
+			while self._bytes > self.max_bytes and self._sessions:
+				_, (_, evicted) = self._sessions.popitem(last=False)
+				self._bytes -= sum(size for size, _ in evicted)
+				self.counters["evictions"] += 1
+
+	def get(self, session_id):
+		"""
+		Returns the session's context in the shape used in prompts.
+
+		Returns:
+			Dict: The product when there is one, {"products": [...]} (oldest first)
+			when there are several, or None when the session has no context
+		"""
+		now = time.time()
+		with self._lock:
+			self._expire(now)
+			entry = self._sessions.get(session_id)
+			if entry is None:
+				return None
+			self._sessions[session_id] = (now, entry[1])
+			self._sessions.move_to_end(session_id)
+			products = [product_data for _, product_data in entry[1]]
+		if len(products) > 1:
+			return {"products": products}
+		return products[0]
+
+	def discard(self, session_id):
+		"""
+		Drops the context of a session, e.g. when its chat ends.
+		"""
+		with self._lock:
+			entry = self._sessions.pop(session_id, None)
+			if entry is not None:
+				self._bytes -= sum(size for size, _ in entry[1])
+
+	def stats(self):
+		"""
+		Returns the eviction counters and current size of the store.
+		"""
+		with self._lock:
+			stats = dict(self.counters)
+			stats["sessions"] = len(self._sessions)
+			stats["bytes"] = self._bytes
+		return stats
+
+	def _expire(self, now):
+		# Least recently used first, so stop at the first live session
+		while self._sessions:
+			session_id, (last_used, entries) = next(iter(self._sessions.items()))
+			if last_used + self.ttl_seconds > now:
+				break
+			self._sessions.popitem(last=False)
+			self._bytes -= sum(size for size, _ in entries)
+			self.counters["expirations"] += 1
+
+
+def get_session_context():
+	"""Return the process-wide session context store configured from the environment."""
+	global _session_context
+	if _session_context is None:
+		_session_context = SessionContextStore(
+			max_products=session_context_products,
+			max_bytes=session_context_max_bytes,
+			ttl_seconds=session_context_ttl,
+		)
+	return _session_context
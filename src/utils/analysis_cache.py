@@ -0,0 +1,337 @@
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from io import BytesIO
+from PIL import Image
+from dotenv import load_dotenv
+
+from src.utils.barcode import barcode_detection, barcode_scan_size, load_scan_image, scan_barcode
+from src.utils.image_executor import ImageJobTimeoutError, get_image_executor
+from src.utils.metrics import ANALYSIS_CACHE_EVENTS
+
+# Load environment variables from .env file
+load_dotenv()
+
+analysis_cache_size = int(os.getenv("ANALYSIS_CACHE_SIZE", "512"))
+analysis_cache_ttl = int(os.getenv("ANALYSIS_CACHE_TTL", "86400"))
+# Path of the SQLite file backing the on-disk tier, empty to keep the cache in memory only
+analysis_cache_db = os.getenv("ANALYSIS_CACHE_DB", "")
+# Maximum Hamming distance between perceptual hashes of near-duplicates, 0 (default) to disable
+analysis_cache_phash_distance = int(os.getenv("ANALYSIS_CACHE_PHASH_DISTANCE", "0"))
+# Most recent on-disk entries compared by perceptual hash on a miss
+analysis_cache_phash_scan = int(os.getenv("ANALYSIS_CACHE_PHASH_SCAN", "2000"))
+# Analyses by product barcode, shared by every user scanning the same product
+barcode_cache_size = int(os.getenv("BARCODE_CACHE_SIZE", "4096"))
+barcode_cache_ttl = int(os.getenv("BARCODE_CACHE_TTL", "2592000"))
+
+# The barcode shown on the image is carried along, it is not part of the key
+ImageFingerprint = namedtuple("ImageFingerprint", ["digest", "phash", "barcode"], defaults=[None])
+
+_analysis_cache = None
+_barcode_cache = None
+
+
+def _difference_hash(gray):
+    pixels = list(gray.resize((9, 8), Image.BILINEAR).getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def perceptual_hash(source):
+    """
+    Computes a 64-bit difference hash (dHash) of an image.
+
+    Args:
+        source: Image file path or raw bytes
+
+    Returns:
+        int: The hash, or None if the image cannot be decoded
+    """
+    try:
+        img = Image.open(BytesIO(source) if isinstance(source, (bytes, bytearray)) else source)
+        # Let the JPEG decoder downscale while decoding, only a 9x8 thumbnail is needed
+        img.draft("L", (64, 64))
+        return _difference_hash(img.convert("L"))
+    except Exception as e:
+        print(f"Error hashing image: {e}")
+        return None
+
+
+def image_fingerprint(image, perceptual=True, barcode_size=0):
+    """
+    Computes the cache key of an image.
+
+    Args:
+        image: Image file path, raw bytes or base64 encoded image
+        perceptual: Also compute the perceptual hash
+        barcode_size: Also look for a barcode on the image downscaled to this size, 0 not to.
+            The image is then decoded once for both the hash and the barcode.
+
+    Returns:
+        ImageFingerprint: SHA-256 digest, perceptual hash and barcode (None when not computed or found)
+    """
+    if isinstance(image, str):
+        image = base64.b64decode(image)
+    if isinstance(image, (bytes, bytearray)):
+        digest = hashlib.sha256(image).hexdigest()
+    else:
+        with open(image, "rb") as img_file:
+            digest = hashlib.file_digest(img_file, "sha256").hexdigest()
+    if not barcode_size:
+        return ImageFingerprint(digest, perceptual_hash(image) if perceptual else None)
+
+    gray = load_scan_image(image, barcode_size)
+    if gray is None:
+        return ImageFingerprint(digest, None)
+    phash = _difference_hash(gray) if perceptual else None
+    return ImageFingerprint(digest, phash, scan_barcode(gray))
+
+
+def barcode_fingerprint(code):
+    """
+    Returns the cache key of a product barcode, for the barcode cache.
+    """
+    return ImageFingerprint(f"barcode:{code}", None)
+
+
+def _hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+def _to_sqlite_int(phash):
+    # SQLite integers are signed 64-bit
+    if phash is not None and phash >= 1 << 63:
+        return phash - (1 << 64)
+    return phash
+
+
+class AnalysisCache:
+    """
+    Content-addressed cache of image analysis results (`structured_data`).
+
+    Entries are keyed on the SHA-256 of the decoded image bytes. A perceptual
+    hash additionally matches near-duplicates such as re-encoded or slightly
+    cropped uploads. The in-memory tier is an LRU with TTL; an optional SQLite
+    tier keeps entries across restarts.
+    """
+
+    def __init__(self, max_entries=512, ttl_seconds=86400, db_path=None, phash_distance=0, barcode_size=0, name="analysis", phash_scan=2000):
+        """
+        Args:
+            max_entries: Capacity of the in-memory LRU tier
+            ttl_seconds: Lifetime of an entry in both tiers
+            db_path: Optional SQLite file for the on-disk tier
+            phash_distance: Maximum Hamming distance for near-duplicate hits, 0 to disable
+            barcode_size: Size images are scanned for a barcode at when fingerprinted, 0 to disable
+            name: Value of the "cache" label of the exported counters
+            phash_scan: Most recent on-disk entries compared by perceptual hash on a miss
+        """
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.phash_distance = phash_distance
+        self.phash_scan = phash_scan
+        self.barcode_size = barcode_size
+        # digest -> (expires_at, phash, structured_data)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {
+            "hits_exact": 0,
+            "hits_perceptual": 0,
+            "hits_disk": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+        }
+
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS analysis_cache ("
+                "digest TEXT PRIMARY KEY, phash INTEGER, expires_at REAL, structured_data TEXT)"
+            )
+            # Serves the near-duplicate scan of the most recent entries
+            self._db.execute("CREATE INDEX IF NOT EXISTS analysis_cache_expires_at ON analysis_cache (expires_at)")
+            self._db.execute("DELETE FROM analysis_cache WHERE expires_at < ?", (time.time(),))
+            self._db.commit()
+
+    def fingerprint(self, image):
+        """
+        Computes the cache key of an image.
+
+        Args:
+            image: Image file path, raw bytes or base64 encoded image
+
+        Returns:
+            ImageFingerprint: SHA-256 digest, perceptual hash and barcode (None when disabled)
+        """
+        return image_fingerprint(image, self.phash_distance > 0, self.barcode_size)
+
+    async def fingerprint_async(self, image):
+        """
+        Awaitable counterpart of fingerprint, hashing on the image executor.
+
+        Raises:
+            ImageJobTimeoutError: If hashing the image timed out; like a timed out
+                compression, it fails the request
+        """
+        try:
+            return await get_image_executor().run(image_fingerprint, image, self.phash_distance > 0, self.barcode_size)
+        except ImageJobTimeoutError as e:
+            print(f"Error fingerprinting image: {e}")
+            raise
+
+    def get(self, fingerprint):
+        """
+        Looks up the analysis of an image.
+
+        Args:
+            fingerprint: ImageFingerprint of the image
+
+        Returns:
+            Dict: The cached structured_data, or None on a miss
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(fingerprint.digest)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(fingerprint.digest)
+                    self._count("hits_exact")
+                    return entry[2]
+                del self._entries[fingerprint.digest]
+                self._count("expirations")
+
+            if fingerprint.phash is not None:
+                for digest, (expires_at, phash, structured_data) in self._entries.items():
+                    if expires_at > now and phash is not None and _hamming(phash, fingerprint.phash) <= self.phash_distance:
+                        self._entries.move_to_end(digest)
+                        self._count("hits_perceptual")
+                        return structured_data
+
+            structured_data = self._get_from_disk(fingerprint, now)
+            if structured_data is not None:
+                self._count("hits_disk")
+                self._put_in_memory(fingerprint, structured_data, now + self.ttl_seconds)
+                return structured_data
+
+            self._count("misses")
+            return None
+
+    async def get_async(self, fingerprint):
+        """
+        Awaitable counterpart of get, run in a thread so the SQLite tier is
+        never read on the event loop.
+        """
+        return await asyncio.to_thread(self.get, fingerprint)
+
+    def put(self, fingerprint, structured_data):
+        """
+        Stores the analysis of an image in every tier.
+
+        Args:
+            fingerprint: ImageFingerprint of the image
+            structured_data: Result of the structured data extraction
+        """
+        expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            self._put_in_memory(fingerprint, structured_data, expires_at)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO analysis_cache VALUES (?, ?, ?, ?)",
+                    (fingerprint.digest, _to_sqlite_int(fingerprint.phash), expires_at, json.dumps(structured_data, ensure_ascii=False))
+                )
+                self._db.commit()
+
+    async def put_async(self, fingerprint, structured_data):
+        """
+        Awaitable counterpart of put, run in a thread so the SQLite tier is
+        never written on the event loop.
+        """
+        await asyncio.to_thread(self.put, fingerprint, structured_data)
+
+    def stats(self):
+        """
+        Returns the hit/miss counters and current size of the cache.
+        """
+        with self._lock:
+            stats = dict(self.counters)
+            stats["size"] = len(self._entries)
+        lookups = stats["hits_exact"] + stats["hits_perceptual"] + stats["hits_disk"] + stats["misses"]
+        stats["hit_rate"] = (lookups - stats["misses"]) / lookups if lookups else 0.0
+        return stats
+
+    def _count(self, event):
+        self.counters[event] += 1
+        ANALYSIS_CACHE_EVENTS.inc(self.name, event)
+
+    def _put_in_memory(self, fingerprint, structured_data, expires_at):
+        self._entries[fingerprint.digest] = (expires_at, fingerprint.phash, structured_data)
+        self._entries.move_to_end(fingerprint.digest)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._count("evictions")
+
+    def _get_from_disk(self, fingerprint, now):
+        if self._db is None:
+            return None
+        row = self._db.execute(
+            "SELECT structured_data FROM analysis_cache WHERE digest = ? AND expires_at > ?",
+            (fingerprint.digest, now)
+        ).fetchone()
+        if row is None and fingerprint.phash is not None:
+            # Bounded to the newest entries: the scan runs under the lock on every disk miss
+            for (phash, data) in self._db.execute(
+                "SELECT phash, structured_data FROM analysis_cache WHERE expires_at > ? AND phash IS NOT NULL "
+                "ORDER BY expires_at DESC LIMIT ?",
+                (now, self.phash_scan)
+            ):
+                if _hamming(phash & 0xFFFFFFFFFFFFFFFF, fingerprint.phash) <= self.phash_distance:
+                    row = (data,)
+                    break
+        return json.loads(row[0]) if row else None
+
+
+def get_analysis_cache():
+    """Return the process-wide analysis cache configured from the environment."""
+    global _analysis_cache
+    if _analysis_cache is None:
+        _analysis_cache = AnalysisCache(
+            max_entries=analysis_cache_size,
+            ttl_seconds=analysis_cache_ttl,
+            db_path=analysis_cache_db or None,
+            phash_distance=analysis_cache_phash_distance,
+            phash_scan=analysis_cache_phash_scan,
+            barcode_size=barcode_scan_size if barcode_detection else 0,
+        )
+    return _analysis_cache
+
+
+def get_barcode_cache():
+    """
+    Return the process-wide barcode cache, keyed with barcode_fingerprint().
+    It shares the SQLite file of the analysis cache.
+    """
+    global _barcode_cache
+    if _barcode_cache is None:
+        _barcode_cache = AnalysisCache(
+            max_entries=barcode_cache_size,
+            ttl_seconds=barcode_cache_ttl,
+            db_path=analysis_cache_db or None,
+            phash_distance=0,
+            name="barcode",
+        )
+    return _barcode_cache
@@ -0,0 +1,191 @@
+import os
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+from dotenv import load_dotenv
+
+try:
+    import zxingcpp
+except ImportError:
+    zxingcpp = None
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Look for an EAN-13/UPC-A barcode on uploaded images before calling the model
+barcode_detection = os.getenv("BARCODE_DETECTION", "true").lower() == "true"
+# Long edge in pixels the image is scanned at; the bars of a barcode need about 2 pixels each
+barcode_scan_size = int(os.getenv("BARCODE_SCAN_SIZE", "1000"))
+
+# Widths of the 4 elements of each digit in the L code (space, bar, space, bar).
+# The R code has the same widths starting with a bar, the G code the reversed widths.
+DIGIT_WIDTHS = np.array([
+    [3, 2, 1, 1], [2, 2, 2, 1], [2, 1, 2, 2], [1, 4, 1, 1], [1, 1, 3, 2],
+    [1, 2, 3, 1], [1, 1, 1, 4], [1, 3, 1, 2], [1, 2, 1, 3], [3, 1, 1, 2],
+], dtype=np.float64)
+LEFT_WIDTHS = np.vstack([DIGIT_WIDTHS, DIGIT_WIDTHS[:, ::-1]])
+
+# First digit of an EAN-13 from the L/G parity of the 6 left digits
+FIRST_DIGIT = {
+    "LLLLLL": "0", "LLGLGG": "1", "LLGGLG": "2", "LLGGGL": "3", "LGLLGG": "4",
+    "LGGLLG": "5", "LGGGLL": "6", "LGLGLG": "7", "LGLGGL": "8", "LGGLGL": "9",
+}
+
+# Runs of an EAN-13: 3 guard, 6 x 4 left digits, 5 middle guard, 6 x 4 right digits, 3 guard
+EAN13_RUNS = 59
+# Positions of the guard runs in a symbol
+GUARD_RUNS = np.array([0, 1, 2, 27, 28, 29, 30, 31, 56, 57, 58])
+# Largest total deviation, in modules, between a digit's 4 widths and its pattern
+MAX_DIGIT_ERROR = 1.6
+# Rows scanned across the image, in each orientation
+SCAN_LINES = 24
+# Rows that must read the same code before it is returned
+MIN_AGREEING_LINES = 2
+
+
+def ean13_check_digit(digits):
+    """
+    Returns the check digit of the first 12 digits of an EAN-13.
+    """
+    total = sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(digits[:12]))
+    return str((10 - total % 10) % 10)
+
+
+def _runs(row):
+    """
+    Binarizes a row of gray levels against a local mean and returns the run
+    lengths and whether the first run is dark.
+    """
+    window = max(15, len(row) // 8) | 1
+    padded = np.pad(row, window // 2, mode="edge")
+    cumsum = np.concatenate(([0.0], np.cumsum(padded, dtype=np.float64)))
+    local_mean = (cumsum[window:] - cumsum[:-window]) / window
+    dark = row < local_mean - 4
+    edges = np.flatnonzero(dark[1:] != dark[:-1]) + 1
+    bounds = np.concatenate(([0], edges, [len(row)]))
+    return np.diff(bounds).astype(np.float64), bool(dark[0])
+
+
+def _decode_runs(runs, first_dark):
+    """
+    Looks for an EAN-13 in a sequence of run lengths alternating dark and light.
+
+    Returns:
+        str: The 13 digits, or None
+    """
+    # Candidate starts are dark runs preceded by a light quiet zone, with guards of one module each
+    starts = np.arange(0 if first_dark else 1, len(runs) - EAN13_RUNS + 1, 2)
+    if not len(starts):
+        return None
+    cumsum = np.concatenate(([0.0], np.cumsum(runs)))
+    modules = (cumsum[starts + EAN13_RUNS] - cumsum[starts]) / 95
+    quiet = np.where(starts > 0, runs[np.maximum(starts - 1, 0)], np.inf) >= 3 * modules
+    guards = runs[starts[:, None] + GUARD_RUNS] / modules[:, None]
+    candidates = starts[quiet & (np.abs(guards - 1).max(axis=1) <= 0.7)]
+
+    for start in candidates:
+        symbol = runs[start:start + EAN13_RUNS]
+        digits = []
+        parity = ""
+        for position in range(12):
+            offset = 3 + position * 4 + (5 if position >= 6 else 0)
+            widths = symbol[offset:offset + 4]
+            widths = widths * 7 / widths.sum()
+            table = LEFT_WIDTHS if position < 6 else DIGIT_WIDTHS
+            errors = np.abs(table - widths).sum(axis=1)
+            best = int(errors.argmin())
+            if errors[best] > MAX_DIGIT_ERROR:
+                break
+            digits.append(str(best % 10))
+            if position < 6:
+                parity += "G" if best >= 10 else "L"
+        else:
+            first = FIRST_DIGIT.get(parity)
+            if first is not None:
+                code = first + "".join(digits)
+                if ean13_check_digit(code) == code[12]:
+                    return code
+    return None
+
+
+def _scan(gray):
+    """
+    Scans horizontal lines of a gray image, both ways, and returns the code
+    read on at least MIN_AGREEING_LINES lines more often than any other code.
+    A code read on a single line may be a misread that passed the check digit.
+    """
+    height = gray.shape[0]
+    votes = {}
+    for y in np.linspace(height * 0.1, height * 0.9, SCAN_LINES).astype(int):
+        runs, first_dark = _runs(gray[y])
+        if len(runs) < EAN13_RUNS:
+            continue
+        code = _decode_runs(runs, first_dark)
+        if code is None:
+            reversed_first_dark = first_dark if len(runs) % 2 else not first_dark
+            code = _decode_runs(runs[::-1], reversed_first_dark)
+        if code is not None:
+            votes[code] = votes.get(code, 0) + 1
+    ranked = sorted(votes.values(), reverse=True) + [0]
+    if ranked[0] >= MIN_AGREEING_LINES and ranked[0] > ranked[1]:
+        return max(votes, key=votes.get)
+    return None
+
+
+def load_scan_image(source, max_dimension=1000):
+    """
+    Decodes an image in grayscale, downscaled to fit in a max_dimension square.
+
+    Args:
+        source: Image file path or raw bytes
+
+    Returns:
+        PIL.Image: The gray image, or None if it cannot be decoded
+    """
+    try:
+        img = Image.open(BytesIO(source) if isinstance(source, (bytes, bytearray)) else source)
+        with img:
+            # Let libjpeg scale by 1/2, 1/4 or 1/8 while decoding, never below the scan size
+            scale = min(1.0, max_dimension / max(img.size))
+            img.draft("L", (int(img.width * scale), int(img.height * scale)))
+            gray = img.convert("L")
+        gray.thumbnail((max_dimension, max_dimension), Image.BILINEAR)
+        return gray
+    except Exception as e:
+        print(f"Error reading image for barcode: {e}")
+        return None
+
+
+def scan_barcode(gray):
+    """
+    Reads an EAN-13 or UPC-A barcode from a gray image, with zxing-cpp when
+    installed, else with a NumPy scanline decoder (horizontal and vertical
+    barcodes) that only returns a code read on several lines.
+
+    Args:
+        gray: PIL image in mode "L", e.g. from load_scan_image()
+
+    Returns:
+        str: The 13-digit EAN (UPC-A with a leading 0), or None
+    """
+    pixels = np.asarray(gray)
+    if zxingcpp is not None:
+        formats = zxingcpp.BarcodeFormat.EAN13 | zxingcpp.BarcodeFormat.UPCA
+        codes = {result.text.zfill(13) for result in zxingcpp.read_barcodes(pixels, formats=formats)}
+        # Two different codes on one photo leave the product uncertain
+        return codes.pop() if len(codes) == 1 else None
+
+    pixels = pixels.astype(np.float64)
+    return _scan(pixels) or _scan(pixels.T)
+
+
+def decode_barcode(source, max_dimension=1000):
+    """
+    Reads an EAN-13 or UPC-A barcode from an image file or bytes.
+
+    Returns:
+        str: The 13-digit EAN, or None
+    """
+    gray = load_scan_image(source, max_dimension)
+    return scan_barcode(gray) if gray is not None else None
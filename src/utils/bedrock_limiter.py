@@ -0,0 +1,361 @@
+import asyncio
+import contextlib
+import contextvars
+import heapq
+import itertools
+import os
+import random
+import time
+from botocore.exceptions import ClientError, ConnectionClosedError, ConnectTimeoutError, EndpointConnectionError
+from dotenv import load_dotenv
+
+from src.utils.bedrock_runtime import bedrock_max_in_flight, run_in_bedrock_executor
+from src.utils.metrics import BEDROCK_CIRCUIT_OPENED, BEDROCK_CONCURRENCY_LIMIT, BEDROCK_RETRIES, observe_stage
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Adapt the number of Bedrock calls in flight to throttling (AIMD), between the bounds below
+bedrock_adaptive_concurrency = os.getenv("BEDROCK_ADAPTIVE_CONCURRENCY", "true").lower() == "true"
+bedrock_min_in_flight = int(os.getenv("BEDROCK_MIN_IN_FLIGHT", "1"))
+# Attempts per call for throttling and transient errors, with jittered exponential backoff
+bedrock_max_attempts = int(os.getenv("BEDROCK_MAX_ATTEMPTS", "4"))
+bedrock_retry_base_delay = float(os.getenv("BEDROCK_RETRY_BASE_DELAY", "0.5"))
+bedrock_retry_max_delay = float(os.getenv("BEDROCK_RETRY_MAX_DELAY", "8"))
+# Consecutive failed calls opening the circuit, and seconds before a probe call is let through
+bedrock_circuit_failures = int(os.getenv("BEDROCK_CIRCUIT_FAILURES", "5"))
+bedrock_circuit_reset = float(os.getenv("BEDROCK_CIRCUIT_RESET", "30"))
+
+# Calls are served in this order when the limit is reached
+PRIORITIES = {"interactive": 0, "background": 1, "bulk": 2}
+
+# Error codes meaning Bedrock is over capacity, the limit is lowered on them
+THROTTLING_ERRORS = {"ThrottlingException", "TooManyRequestsException", "ServiceUnavailableException"}
+# Further error codes worth retrying
+TRANSIENT_ERRORS = {"ModelNotReadyException", "InternalServerException", "ModelTimeoutException"}
+
+_priority = contextvars.ContextVar("bedrock_priority", default="interactive")
+# Model id -> BedrockGuard, as Bedrock quotas are per model
+_bedrock_guards = {}
+
+
+class BedrockUnavailableError(Exception):
+    """
+    Raised without calling Bedrock while the circuit breaker is open.
+    """
+
+    def __init__(self, message, retry_after=0.0):
+        super().__init__(message)
+        # Seconds until the breaker lets a probe call through
+        self.retry_after = retry_after
+
+
+@contextlib.contextmanager
+def bedrock_priority(priority):
+    """
+    Sets the priority of the Bedrock calls made in the block, e.g. for a batch job:
+
+        with bedrock_priority("bulk"):
+            await function_calling_query_async(...)
+
+    Args:
+        priority: "interactive" (the default), "background" or "bulk"
+    """
+    if priority not in PRIORITIES:
+        raise ValueError(f"Unknown Bedrock priority: {priority}")
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def error_code(error):
+    """
+    Returns the Bedrock error code of an exception, or None for other exceptions.
+    """
+    if isinstance(error, ClientError):
+        return error.response.get("Error", {}).get("Code")
+    return None
+
+
+def is_throttling(error):
+    return error_code(error) in THROTTLING_ERRORS
+
+
+def is_retryable(error):
+    """
+    Returns whether a failed call may succeed when retried: throttling,
+    transient server errors and dropped connections.
+    """
+    if isinstance(error, (EndpointConnectionError, ConnectionClosedError, ConnectTimeoutError)):
+        return True
+    return error_code(error) in THROTTLING_ERRORS | TRANSIENT_ERRORS
+
+
+def backoff_delay(attempt, base_delay=0.5, max_delay=8.0):
+    """
+    Full-jitter exponential backoff: a random delay up to base_delay * 2^attempt, capped.
+    """
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit adapted with AIMD: while the limit is used up, each
+    successful call raises it by 1/limit (one per round of calls), and a
+    throttled call multiplies it by `backoff_ratio`. Waiting calls are
+    admitted by priority, then in arrival order.
+    """
+
+    def __init__(self, initial_limit=16, min_limit=1, max_limit=16, backoff_ratio=0.5, model=""):
+        """
+        Args:
+            initial_limit: Calls in flight allowed at first
+            min_limit: Lowest limit
+            max_limit: Highest limit, e.g. the size of the Bedrock executor
+            backoff_ratio: Factor applied to the limit on throttling
+            model: Model id the limit applies to, the "model" label of its gauge
+        """
+        self.model = model
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff_ratio = backoff_ratio
+        self.in_flight = 0
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._last_decrease = float("-inf")
+        BEDROCK_CONCURRENCY_LIMIT.set(self.limit, self.model)
+
+    async def acquire(self, priority="interactive"):
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (PRIORITIES[priority], next(self._sequence), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Admitted just before being cancelled, hand the slot on
+                self.release()
+            raise
+
+    def release(self):
+        self.in_flight -= 1
+        self._admit()
+
+    def _admit(self):
+        while self._waiters and self.in_flight < int(self.limit):
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self.in_flight += 1
+                future.set_result(None)
+
+    def on_success(self):
+        # A limit that is not reached says nothing about the capacity, it is not raised
+        if self._waiters or self.in_flight + 1 >= int(self.limit):
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            BEDROCK_CONCURRENCY_LIMIT.set(self.limit, self.model)
+            self._admit()
+
+    def on_throttle(self, started_at):
+        """
+        Lowers the limit for a throttled call started at `started_at` (time.monotonic()).
+        Calls started before the last decrease ran under the former limit and are ignored.
+        """
+        if started_at >= self._last_decrease:
+            self.limit = max(self.min_limit, self.limit * self.backoff_ratio)
+            self._last_decrease = time.monotonic()
+            BEDROCK_CONCURRENCY_LIMIT.set(self.limit, self.model)
+
+    @contextlib.asynccontextmanager
+    async def slot(self, priority="interactive"):
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class CircuitBreaker:
+    """
+    Stops calling Bedrock after `failure_threshold` consecutive failed calls.
+    After `reset_timeout` seconds one probe call is let through; its success
+    closes the circuit, its failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, model=""):
+        self.model = model
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+    def allow(self):
+        """
+        Returns whether a call may be made now.
+        """
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self.state = "half_open"
+            self._probing = False
+        if self.state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                BEDROCK_CIRCUIT_OPENED.inc(self.model)
+            self.state = "open"
+            self._opened_at = time.monotonic()
+            self._probing = False
+
+    def release_probe(self):
+        """
+        Lets another probe through after one ended without an outcome, e.g. cancelled.
+        """
+        self._probing = False
+
+    def retry_after(self):
+        """
+        Returns the seconds until a probe call is let through.
+        """
+        return max(0.0, self._opened_at + self.reset_timeout - time.monotonic())
+
+
+class BedrockGuard:
+    """
+    Runs blocking Bedrock calls on the Bedrock executor behind the adaptive
+    limiter, retrying throttled and transient failures with jittered
+    exponential backoff, and failing fast while the circuit breaker is open.
+    """
+
+    def __init__(self, limiter=None, breaker=None, max_attempts=4, base_delay=0.5, max_delay=8.0):
+        """
+        Args:
+            limiter: AdaptiveLimiter, None for no limit besides the executor size
+            breaker: CircuitBreaker, None to always call Bedrock
+            max_attempts: Attempts per call, 1 disables retries
+            base_delay: Upper bound of the first backoff in seconds
+            max_delay: Cap of the backoff in seconds
+        """
+        self.limiter = limiter
+        self.breaker = breaker
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    async def call(self, func, *args, **kwargs):
+        """
+        Runs `func(*args, **kwargs)` on the Bedrock executor with the priority set by bedrock_priority().
+
+        Raises:
+            BedrockUnavailableError: The circuit breaker is open
+            The last error of `func` once retries are exhausted or for errors that are not retried
+        """
+        priority = _priority.get()
+        for attempt in range(self.max_attempts):
+            probe = False
+            if self.breaker is not None:
+                if not self.breaker.allow():
+                    retry_after = self.breaker.retry_after()
+                    raise BedrockUnavailableError(f"Bedrock is unavailable, retry in {retry_after:.0f} s", retry_after)
+                probe = self.breaker.state == "half_open"
+            # "success" or "failure" once the call has an outcome for the breaker
+            outcome = None
+            try:
+                result = await self._call_once(priority, func, *args, **kwargs)
+                outcome = "success"
+            except Exception as e:
+                retryable = is_retryable(e)
+                if retryable:
+                    BEDROCK_RETRIES.inc(error_code(e) or type(e).__name__)
+                # A probe is not retried, its failure reopens the circuit at once
+                if not retryable or probe or attempt == self.max_attempts - 1:
+                    # Errors of the request itself, e.g. validation, say nothing about Bedrock's health
+                    outcome = "failure" if retryable else "success"
+                    raise
+            finally:
+                if self.breaker is not None:
+                    if outcome == "success":
+                        self.breaker.record_success()
+                    elif outcome == "failure":
+                        self.breaker.record_failure()
+                    elif probe:
+                        # Cancelled probe: the next call probes instead
+                        self.breaker.release_probe()
+            if outcome == "success":
+                if self.limiter is not None:
+                    self.limiter.on_success()
+                return result
+            await asyncio.sleep(backoff_delay(attempt, self.base_delay, self.max_delay))
+
+    async def _call_once(self, priority, func, *args, **kwargs):
+        if self.limiter is None:
+            return await run_in_bedrock_executor(func, *args, **kwargs)
+        start = time.perf_counter()
+        async with self.limiter.slot(priority):
+            observe_stage("bedrock_queue", time.perf_counter() - start)
+            started_at = time.monotonic()
+            try:
+                return await run_in_bedrock_executor(func, *args, **kwargs)
+            except Exception as e:
+                if is_throttling(e):
+                    self.limiter.on_throttle(started_at)
+                raise
+
+    def stats(self):
+        """
+        Returns the current limit, calls in flight and waiting, and the circuit state.
+        """
+        stats = {}
+        if self.limiter is not None:
+            stats.update(limit=self.limiter.limit, in_flight=self.limiter.in_flight, waiting=len(self.limiter._waiters))
+        if self.breaker is not None:
+            stats.update(circuit=self.breaker.state, failures=self.breaker.failures)
+        return stats
+
+
+def get_bedrock_guard(model_id=""):
+    """
+    Return the process-wide Bedrock guard of a model, configured from the environment.
+    Bedrock quotas are per model, so each model has its own limiter and circuit breaker.
+    """
+    guard = _bedrock_guards.get(model_id)
+    if guard is None:
+        limiter = None
+        if bedrock_adaptive_concurrency:
+            limiter = AdaptiveLimiter(
+                initial_limit=bedrock_max_in_flight,
+                min_limit=bedrock_min_in_flight,
+                max_limit=bedrock_max_in_flight,
+                model=model_id,
+            )
+        guard = _bedrock_guards[model_id] = BedrockGuard(
+            limiter=limiter,
+            breaker=CircuitBreaker(bedrock_circuit_failures, bedrock_circuit_reset, model=model_id),
+            max_attempts=bedrock_max_attempts,
+            base_delay=bedrock_retry_base_delay,
+            max_delay=bedrock_retry_max_delay,
+        )
+    return guard
+
+
+def bedrock_guard_stats():
+    """
+    Returns the stats() of the guard of each model called so far.
+    """
+    return {model_id: guard.stats() for model_id, guard in list(_bedrock_guards.items())}
@@ -1,5 +1,9 @@
+import asyncio
+import functools
 import boto3
 import os
+from concurrent.futures import ThreadPoolExecutor
+from botocore.config import Config
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -11,6 +15,12 @@ aws_secret_key = os.getenv("AWS_SECRET_ACCESS_KEY")
 aws_session_token = os.getenv("AWS_SESSION_TOKEN")
 aws_region = os.getenv("AWS_DEFAULT_REGION", "us-west-2")  # Ensure this matches the Inference Profile Region
 
+# Maximum number of Bedrock calls in flight per worker process
+bedrock_max_in_flight = int(os.getenv("BEDROCK_MAX_IN_FLIGHT", "16"))
+bedrock_read_timeout = int(os.getenv("BEDROCK_READ_TIMEOUT", "120"))
+
+_bedrock_executor = None
+
 def get_bedrock_runtime():
     """Initialize and return the Bedrock runtime client."""
     return boto3.client(
@@ -18,5 +28,45 @@ def get_bedrock_runtime():
         region_name=aws_region,
         aws_access_key_id=aws_access_key,
         aws_secret_access_key=aws_secret_key,
-        aws_session_token=aws_session_token  # Include if using temporary credentials
-    )
\ No newline at end of file
+        aws_session_token=aws_session_token,  # Include if using temporary credentials
+        config=Config(
+            # One pooled keep-alive connection per executor worker
+            max_pool_connections=bedrock_max_in_flight,
+            tcp_keepalive=True,
+            read_timeout=bedrock_read_timeout,
+            # Retries are made by BedrockGuard, so that throttling reaches the adaptive limiter
+            retries={"mode": "standard", "total_max_attempts": 1},
+        )
+    )
+
+def get_bedrock_executor():
+    """
+    Return the shared thread pool that runs blocking Bedrock calls.
+
+    The pool size caps the number of Bedrock calls in flight; further calls
+    queue until a worker is free.
+    """
+    global _bedrock_executor
+    if _bedrock_executor is None:
+        _bedrock_executor = ThreadPoolExecutor(
+            max_workers=bedrock_max_in_flight,
+            thread_name_prefix="bedrock"
+        )
+    return _bedrock_executor
+
+async def run_in_bedrock_executor(func, *args, **kwargs):
+    """
+    Run a blocking Bedrock call on the shared executor without blocking the event loop.
+
+    Args:
+        func: Blocking callable to run
+        *args, **kwargs: Arguments forwarded to func
+
+    Returns:
+        The return value of func
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_bedrock_executor(),
+        functools.partial(func, *args, **kwargs)
+    )
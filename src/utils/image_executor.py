@@ -0,0 +1,152 @@
+import asyncio
+import functools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# "thread" relies on Pillow releasing the GIL while decoding, resizing and encoding;
+# "process" isolates image work completely at the cost of one interpreter per worker
+image_executor_kind = os.getenv("IMAGE_EXECUTOR", "thread")
+image_workers = int(os.getenv("IMAGE_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Jobs waiting or running at once; further callers wait for a slot
+image_max_pending = int(os.getenv("IMAGE_MAX_PENDING", "32"))
+image_job_timeout = float(os.getenv("IMAGE_JOB_TIMEOUT", "30"))
+
+_image_executor = None
+
+
+class ImageJobTimeoutError(TimeoutError):
+    """
+    Raised when an image job runs for longer than the job timeout.
+    """
+
+
+class ImageExecutor:
+    """
+    Runs CPU-bound image work off the event loop, on a bounded pool of
+    threads or processes, with backpressure and a per-job timeout.
+    """
+
+    def __init__(self, kind="thread", workers=4, max_pending=32, job_timeout=30.0):
+        """
+        Args:
+            kind: "thread" or "process"
+            workers: Number of pool workers
+            max_pending: Maximum number of jobs queued or running at once
+            job_timeout: Seconds a job may run before its caller gives up, not counting the wait for a worker
+        """
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown image executor kind: {kind}")
+        self.kind = kind
+        self.workers = workers
+        self.max_pending = max_pending
+        self.job_timeout = job_timeout
+        self._pool = None
+        self._slots = None
+        self._free_workers = None
+        self._slots_loop = None
+
+    def _get_pool(self):
+        if self._pool is None:
+            if self.kind == "process":
+                # spawn: forking a process that already runs threads can deadlock the children
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            else:
+                self._pool = ThreadPoolExecutor(
+                    max_workers=self.workers,
+                    thread_name_prefix="image"
+                )
+        return self._pool
+
+    def _get_slots(self):
+        loop = asyncio.get_running_loop()
+        if self._slots is None or self._slots_loop is not loop:
+            self._slots = asyncio.Semaphore(self.max_pending)
+            self._free_workers = asyncio.Semaphore(self.workers)
+            self._slots_loop = loop
+        return self._slots, self._free_workers
+
+    async def run(self, func, *args, **kwargs):
+        """
+        Runs func(*args, **kwargs) on the pool.
+
+        A job is only submitted once a worker is free, so the timeout covers
+        its execution, not the wait for a worker. A timed out thread or
+        process job cannot be interrupted: its result is discarded, and its
+        slot and worker are only handed to another job once it has finished.
+
+        For the process pool, func and its arguments must be picklable.
+
+        Raises:
+            ImageJobTimeoutError: If the job runs for longer than job_timeout
+        """
+        slots, free_workers = self._get_slots()
+        await slots.acquire()
+        try:
+            await free_workers.acquire()
+        except BaseException:
+            slots.release()
+            raise
+        loop = asyncio.get_running_loop()
+
+        def release(_):
+            free_workers.release()
+            slots.release()
+
+        try:
+            job = self._get_pool().submit(functools.partial(func, *args, **kwargs))
+        except BaseException:
+            release(None)
+            raise
+        # Called from the worker thread, or the pool's management thread for processes
+        job.add_done_callback(lambda _: _call_soon(loop, release, None))
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(job), self.job_timeout)
+        except asyncio.TimeoutError:
+            raise ImageJobTimeoutError(f"The image took longer than {self.job_timeout:g}s to process") from None
+
+    def start(self):
+        """
+        Creates the pool ahead of the first job so process workers start with the app.
+        """
+        pool = self._get_pool()
+        if self.kind == "process":
+            # Start the workers now rather than on the first upload
+            for _ in range(self.workers):
+                pool.submit(os.getpid)
+
+    def shutdown(self):
+        """
+        Stops the pool, dropping queued jobs and waiting for running ones.
+        """
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+
+def _call_soon(loop, callback, *args):
+    try:
+        loop.call_soon_threadsafe(callback, *args)
+    except RuntimeError:
+        # The loop is closed, nothing waits for its semaphores any more
+        pass
+
+
+def get_image_executor():
+    """Return the process-wide image executor configured from the environment."""
+    global _image_executor
+    if _image_executor is None:
+        _image_executor = ImageExecutor(
+            kind=image_executor_kind,
+            workers=image_workers,
+            max_pending=image_max_pending,
+            job_timeout=image_job_timeout,
+        )
+    return _image_executor
@@ -1,15 +1,152 @@
 import base64
-from typing import List, Tuple, Any
+import os
+from collections import namedtuple
+from pathlib import Path
+from typing import List, Tuple, Any, Union
 import chainlit as cl
 from io import BytesIO
 from PIL import Image
 
+from src.utils.image_executor import ImageJobTimeoutError, get_image_executor
+from src.utils.metrics import observe_image_bytes, stage_timer
+
+# Claude downscales any image whose long edge exceeds this, so larger images only cost upload time
+MAX_IMAGE_DIMENSION = 1568
+
+# Range searched for the highest JPEG quality that fits the byte budget
+JPEG_QUALITY_MAX = 85
+JPEG_QUALITY_MIN = 40
+
+# An image is referenced by its file path or given as the raw bytes of the file
+ImageSource = Union[os.PathLike, bytes]
+
+# An image ready for the Bedrock payload
+PreparedImage = namedtuple("PreparedImage", ["data", "media_type"])
+
+
+def _fit_within(size, max_dimension):
+    """
+    Returns `size` scaled down to fit in a max_dimension square, keeping the aspect ratio.
+    """
+    width, height = size
+    scale = min(1.0, max_dimension / max(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _encode(img, img_format, **params):
+    buffer = BytesIO()
+    img.save(buffer, format=img_format, **params)
+    return buffer.getvalue()
+
+
+def _encode_jpeg(img, budget):
+    """
+    Encodes at the highest quality in [JPEG_QUALITY_MIN, JPEG_QUALITY_MAX] that fits
+    the byte budget, downscaling when even the lowest quality does not fit.
+    """
+    data = _encode(img, "JPEG", quality=JPEG_QUALITY_MAX)
+    if len(data) <= budget:
+        return data
+
+    best = None
+    low, high = JPEG_QUALITY_MIN, JPEG_QUALITY_MAX - 1
+    while low <= high:
+        quality = (low + high) // 2
+        data = _encode(img, "JPEG", quality=quality)
+        if len(data) <= budget:
+            best, low = data, quality + 1
+        else:
+            high = quality - 1
+    if best is not None:
+        return best
+
+    # Bytes grow roughly with the pixel count
+    scale = (budget / len(data)) ** 0.5 * 0.9
+    print("Image still too large, reducing further...")
+    return _encode_jpeg(img.resize(_fit_within(img.size, max(img.size) * scale), Image.LANCZOS), budget)
+
+
+def _encode_png(img, budget):
+    """
+    Encodes as PNG, downscaling until the byte budget is met.
+    """
+    data = _encode(img, "PNG", compress_level=6)
+    while len(data) > budget and max(img.size) > 64:
+        print("Image still too large, reducing further...")
+        scale = (budget / len(data)) ** 0.5 * 0.9
+        img = img.resize(_fit_within(img.size, max(img.size) * scale), Image.LANCZOS)
+        data = _encode(img, "PNG", compress_level=6)
+    return data
+
+
+def prepare_image(source: Union[ImageSource, str], max_size_kb=2048):
+    """
+    Prepares an image for Claude with a single decode.
+
+    JPEG and PNG files that already fit the size and dimension limits are sent
+    unchanged. Larger JPEGs are decoded at a reduced scale (draft mode), resized
+    once and encoded at the highest quality that fits the byte budget.
+
+    Args:
+        source: Image file path or raw bytes
+        max_size_kb: Maximum desired size in KB
+
+    Returns:
+        Tuple (image_bytes, media_type): Prepared image and its MIME type, or (None, None) on error
+    """
+    try:
+        budget = max_size_kb * 1024
+        if isinstance(source, (bytes, bytearray)):
+            original_size = len(source)
+            img = Image.open(BytesIO(source))
+        else:
+            original_size = os.path.getsize(source)
+            img = Image.open(source)
+
+        with img:
+            print(f"Original image size: {original_size / 1024:.2f} KB")
+
+            # Opening only reads the header, nothing is decoded yet
+            if (
+                original_size <= budget
+                and max(img.size) <= MAX_IMAGE_DIMENSION
+                and (img.format, img.mode) in (("JPEG", "RGB"), ("JPEG", "L"), ("PNG", "RGB"), ("PNG", "RGBA"))
+            ):
+                print("Image already within limits, sending it unchanged")
+                if isinstance(source, (bytes, bytearray)):
+                    return bytes(source), f"image/{img.format.lower()}"
+                with open(source, "rb") as img_file:
+                    return img_file.read(), f"image/{img.format.lower()}"
+
+            target_size = _fit_within(img.size, MAX_IMAGE_DIMENSION)
+            if img.format == "JPEG":
+                # Let libjpeg scale by 1/2, 1/4 or 1/8 while decoding, never below the target size
+                img.draft(None, target_size)
+            img.thumbnail(target_size, Image.LANCZOS)
+
+            is_transparent = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+            if is_transparent:
+                data = _encode_png(img.convert("RGBA"), budget)
+                media_type = "image/png"
+            else:
+                data = _encode_jpeg(img if img.mode in ("RGB", "L") else img.convert("RGB"), budget)
+                media_type = "image/jpeg"
+
+        print(f"Compressed image size: {len(data) / 1024:.2f} KB")
+        print(f"Compression ratio: {len(data) / original_size:.2f}")
+        return data, media_type
+
+    except Exception as e:
+        print(f"Error processing image: {e}")
+        return None, None
 
 
 def compress_image(base64_image, max_size_kb=2048):
     """
     Compresses and resizes a base64 encoded image.
 
+    Prefer prepare_image, which works from the file and avoids the base64 round trip.
+
     Args:
         base64_image: Base64 encoded image
         max_size_kb: Maximum desired size in KB (increased to 2MB)
@@ -18,77 +155,92 @@ def compress_image(base64_image, max_size_kb=2048):
         Tuple (compressed_img_base64, media_type): Compressed base64 image and its MIME type
     """
     try:
-        # Decode base64 to binary
         img_data = base64.b64decode(base64_image)
-        img = Image.open(BytesIO(img_data))
+    except Exception as e:
+        print(f"Error processing image: {e}")
+        return None, None
 
-        # Get original size for logging
-        original_size = len(img_data)
-        print(f"Original image size: {original_size / 1024:.2f} KB")
+    data, media_type = prepare_image(img_data, max_size_kb)
+    if data is None:
+        return None, None
+    return base64.b64encode(data).decode("utf-8"), media_type
 
-        # First compression - resize to maximum allowed size
-        max_size = (2048, 2048)  # Increased to 2048x2048
-        img.thumbnail(max_size, Image.LANCZOS)
 
-        # Determine format based on image mode
-        is_transparent = img.mode == 'RGBA'
-        img_format = "PNG" if is_transparent else "JPEG"
-        media_type = f"image/{img_format.lower()}"
+def prepare_image_base64(image, max_size_kb=2048):
+    """
+    Prepares an image and base64 encodes it for the Bedrock payload.
 
-        # Initial compression with higher quality
-        buffer = BytesIO()
-        if is_transparent:
-            img.save(buffer, format="PNG", optimize=True, compress_level=6)
-        else:
-            img.save(buffer, format="JPEG", quality=80, optimize=True)
-
-        compressed_data = buffer.getvalue()
-        compressed_size = len(compressed_data)
-        print(f"Compressed image size: {compressed_size / 1024:.2f} KB")
-        print(f"Compression ratio: {compressed_size / original_size:.2f}")
-
-        # If still too large, reduce further but maintain higher quality
-        if compressed_size > max_size_kb * 1024:
-            print("Image still too large, reducing further...")
-            img.thumbnail((1600, 1600), Image.LANCZOS)  # Fallback size
-            buffer = BytesIO()
-            if is_transparent:
-                img.save(buffer, format="PNG", optimize=True, compress_level=6)
-            else:
-                img.save(buffer, format="JPEG", quality=70, optimize=True)
-            compressed_data = buffer.getvalue()
-            print(f"Final image size: {len(compressed_data) / 1024:.2f} KB")
+    Args:
+        image: Image file path, raw bytes or base64 encoded string
+        max_size_kb: Maximum desired size in KB
 
-        # Encode to base64 and return
-        compressed_img = base64.b64encode(compressed_data).decode("utf-8")
-        return compressed_img, media_type
+    Returns:
+        PreparedImage, or None if the image could not be processed
+    """
+    if isinstance(image, str):
+        data, media_type = compress_image(image, max_size_kb)
+    else:
+        image_bytes, media_type = prepare_image(image, max_size_kb)
+        data = base64.b64encode(image_bytes).decode("utf-8") if image_bytes else None
+    if data and media_type:
+        return PreparedImage(data, media_type)
+    return None
 
-    except Exception as e:
+
+async def prepare_image_base64_async(image, max_size_kb=2048):
+    """
+    Awaitable counterpart of prepare_image_base64, run on the image executor.
+
+    Returns:
+        PreparedImage, or None if the image could not be processed
+
+    Raises:
+        ImageJobTimeoutError: If processing the image timed out, so the request
+            fails rather than being sent without its photo
+    """
+    try:
+        # Timed here rather than in prepare_image, which may run in a worker process
+        with stage_timer("compress_images"):
+            prepared = await get_image_executor().run(prepare_image_base64, image, max_size_kb)
+    except ImageJobTimeoutError as e:
         print(f"Error processing image: {e}")
-        return None, None
+        raise
+    # Base64 carries 3 bytes in 4 characters
+    if isinstance(image, (bytes, bytearray)):
+        bytes_in = len(image)
+    elif isinstance(image, str):
+        bytes_in = len(image) * 3 // 4
+    else:
+        bytes_in = os.path.getsize(image)
+    observe_image_bytes(bytes_in, len(prepared.data) * 3 // 4 if prepared else None)
+    return prepared
+
 
-def extract_images(elements: List[Any]) -> Tuple[List[Any], List[str]]:
+def extract_images(elements: List[Any]) -> Tuple[List[Any], List[ImageSource]]:
     """
-    Extract images from Chainlit elements and convert them to base64.
-    
+    Extract images from Chainlit elements.
+
+    Images are referenced by their uploaded file path and only read when
+    they are prepared for Claude.
+
     Args:
         elements: List of Chainlit elements
-        
+
     Returns:
-        Tuple containing elements to display and list of base64 encoded images
+        Tuple containing elements to display and list of image sources (file paths or raw bytes)
     """
     processed_elements = []
     image_list = []
-    
+
     for element in elements:
         if isinstance(element, cl.Image):
             # Add image to response elements
             processed_elements.append(element)
-            
+
             # Get image data for Claude
-            image_data = element.path
-            with open(image_data, "rb") as img_file:
-                base64_image = base64.b64encode(img_file.read()).decode("utf-8")
-                image_list.append(base64_image)
-    
-    return processed_elements, image_list
\ No newline at end of file
+            if element.path:
+                image_list.append(Path(element.path))
+            elif element.content:
+                image_list.append(element.content)
+
+    return processed_elements, image_list
@@ -0,0 +1,299 @@
+import asyncio
+import ipaddress
+import os
+import threading
+import time
+from bisect import bisect_left
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Serve the metrics on the Chainlit server
+metrics_enabled = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+metrics_path = os.getenv("METRICS_PATH", "/metrics")
+# Only answer scrapes from loopback or private addresses
+metrics_local_only = os.getenv("METRICS_LOCAL_ONLY", "true").lower() == "true"
+# Seconds between two event loop lag probes
+metrics_loop_lag_interval = float(os.getenv("METRICS_LOOP_LAG_INTERVAL", "0.5"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BYTES_BUCKETS = (1024, 16 * 1024, 64 * 1024, 256 * 1024, 1024 ** 2, 2 * 1024 ** 2, 5 * 1024 ** 2, 10 * 1024 ** 2, 25 * 1024 ** 2)
+TOKEN_BUCKETS = (10, 50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+
+def _format_labels(labelnames, labels, extra=None):
+    pairs = list(zip(labelnames, labels))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+
+class Counter(_Metric):
+    """
+    Monotonic counter, e.g. requests or dropped events.
+    """
+
+    kind = "counter"
+
+    def inc(self, *labels, value=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield self.name + "_total" + _format_labels(self.labelnames, labels), value
+
+
+class Gauge(_Metric):
+    """
+    Value going up and down, e.g. operations in flight.
+    """
+
+    kind = "gauge"
+
+    def inc(self, *labels, value=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+    def dec(self, *labels, value=1):
+        self.inc(*labels, value=-value)
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield self.name + _format_labels(self.labelnames, labels), value
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values in fixed buckets, with their sum and count.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                # Per-bucket counts (last one is +Inf), sum
+                series = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def samples(self):
+        with self._lock:
+            values = {labels: (list(counts), total) for labels, (counts, total) in self._values.items()}
+        for labels, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield self.name + "_bucket" + _format_labels(self.labelnames, labels, ("le", _format_value(float(bound)))), cumulative
+            yield self.name + "_sum" + _format_labels(self.labelnames, labels), total
+            yield self.name + "_count" + _format_labels(self.labelnames, labels), cumulative
+
+
+class MetricsRegistry:
+    """
+    Holds the application metrics and renders them in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """
+        Returns:
+            str: All metrics in the Prometheus text exposition format
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for sample, value in metric.samples():
+                lines.append(f"{sample} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "nutritrack_stage_seconds", "Duration of each pipeline stage", ["stage"], LATENCY_BUCKETS
+))
+STAGE_IN_FLIGHT = REGISTRY.register(Gauge(
+    "nutritrack_stage_in_flight", "Pipeline stages currently running", ["stage"]
+))
+STAGE_ERRORS = REGISTRY.register(Counter(
+    "nutritrack_stage_errors", "Pipeline stages that raised an exception", ["stage"]
+))
+IMAGE_BYTES = REGISTRY.register(Histogram(
+    "nutritrack_image_bytes", "Size of images before (in) and after (out) preparation", ["direction"], BYTES_BUCKETS
+))
+BEDROCK_TOKENS = REGISTRY.register(Histogram(
+    "nutritrack_bedrock_tokens", "Tokens per Bedrock call, from the response usage", ["goal", "kind"], TOKEN_BUCKETS
+))
+BEDROCK_CONCURRENCY_LIMIT = REGISTRY.register(Gauge(
+    "nutritrack_bedrock_concurrency_limit", "Bedrock calls allowed in flight by the adaptive limiter of each model", ["model"]
+))
+BEDROCK_RETRIES = REGISTRY.register(Counter(
+    "nutritrack_bedrock_retries", "Bedrock calls failed with a retryable error, by error code", ["error"]
+))
+BEDROCK_CIRCUIT_OPENED = REGISTRY.register(Counter(
+    "nutritrack_bedrock_circuit_opened", "Times the Bedrock circuit breaker of each model opened", ["model"]
+))
+SINGLE_FLIGHT_CALLS = REGISTRY.register(Counter(
+    "nutritrack_single_flight_calls", "Calls that started a shared call (leader), joined one (coalesced) or cancelled it (abandoned)", ["flight", "role"]
+))
+LOCAL_ANSWERS = REGISTRY.register(Counter(
+    "nutritrack_local_answers", "Follow-up questions answered from the structured data (hit) or sent to the model (miss)", ["intent", "outcome"]
+))
+BARCODE_LOOKUPS = REGISTRY.register(Counter(
+    "nutritrack_barcode_lookups", "Uploaded images by barcode outcome: none found, nutrition index, barcode cache or miss", ["result"]
+))
+ANALYSIS_CACHE_EVENTS = REGISTRY.register(Counter(
+    "nutritrack_analysis_cache_events", "Analysis and barcode cache hits by tier, misses, evictions and expirations", ["cache", "event"]
+))
+EVENT_LOOP_LAG = REGISTRY.register(Histogram(
+    "nutritrack_event_loop_lag_seconds", "Delay of the event loop in running a scheduled callback", [], LAG_BUCKETS
+))
+
+
+class stage_timer:
+    """
+    Context manager timing a pipeline stage and counting it as in flight.
+
+    Usable in sync and async code alike:
+
+        with stage_timer("explain"):
+            ...
+    """
+
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.start = None
+
+    def __enter__(self):
+        STAGE_IN_FLIGHT.inc(self.stage)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        STAGE_SECONDS.observe(time.perf_counter() - self.start, self.stage)
+        STAGE_IN_FLIGHT.dec(self.stage)
+        if exc_type is not None and not issubclass(exc_type, asyncio.CancelledError):
+            STAGE_ERRORS.inc(self.stage)
+        return False
+
+
+def observe_stage(stage, seconds):
+    """
+    Records the duration of a stage timed by the caller, e.g. a time to first token.
+    """
+    STAGE_SECONDS.observe(seconds, stage)
+
+
+def observe_image_bytes(bytes_in=None, bytes_out=None):
+    """
+    Records the size of an image before and after preparation.
+    """
+    if bytes_in is not None:
+        IMAGE_BYTES.observe(bytes_in, "in")
+    if bytes_out is not None:
+        IMAGE_BYTES.observe(bytes_out, "out")
+
+
+def observe_usage(goal, usage):
+    """
+    Records the token counts of a Bedrock response.
+
+    Args:
+        goal: Name of the call, e.g. "Extract structured data"
+        usage: The `usage` dict of the response
+    """
+    for kind, key in (
+        ("input", "input_tokens"),
+        ("output", "output_tokens"),
+        ("cache_read", "cache_read_input_tokens"),
+        ("cache_write", "cache_creation_input_tokens"),
+    ):
+        if usage.get(key):
+            BEDROCK_TOKENS.observe(usage[key], goal or "unknown", kind)
+
+
+async def monitor_event_loop_lag(interval=0.5):
+    """
+    Measures how late the event loop wakes up from a sleep, which is the
+    time any coroutine waits behind blocking work. Runs until cancelled.
+    """
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(0.0, time.perf_counter() - start - interval))
+
+
+def _is_local(host):
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return host in ("localhost", "testclient")
+    return address.is_loopback or address.is_private
+
+
+def mount_metrics(app, path="/metrics", local_only=True):
+    """
+    Serves the metrics on a FastAPI app, e.g. the Chainlit server.
+
+    The route is moved in front of the app's other routes, since Chainlit
+    serves its frontend on a catch-all path.
+
+    Args:
+        app: FastAPI application
+        path: Path of the endpoint
+        local_only: Refuse scrapes from public addresses
+    """
+    from fastapi import Request
+    from fastapi.responses import PlainTextResponse
+
+    async def metrics(request: Request):
+        if local_only and not (request.client and _is_local(request.client.host)):
+            return PlainTextResponse("Forbidden\n", status_code=403)
+        return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+    app.add_api_route(path, metrics, methods=["GET"], include_in_schema=False)
+    routes = app.router.routes
+    routes.insert(0, routes.pop())
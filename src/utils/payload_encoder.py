@@ -0,0 +1,161 @@
+import json
+import os
+from dotenv import load_dotenv
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Load environment variables from .env file
+load_dotenv()
+
+# "auto" uses orjson when it is installed, "json" the standard library
+json_backend = os.getenv("JSON_BACKEND", "auto").lower()
+if json_backend not in ("auto", "orjson", "json"):
+    raise ValueError(f"Unknown JSON backend: {json_backend}")
+if json_backend == "orjson" and orjson is None:
+    print("JSON_BACKEND=orjson but orjson is not installed, using the json module")
+use_orjson = orjson is not None and json_backend != "json"
+
+# Bytes allowed in the base64 data of an image block, spliced without escaping
+BASE64_ALPHABET = b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/="
+
+# dumps() serializes a value to JSON bytes, loads() parses JSON bytes or text
+if use_orjson:
+    dumps = orjson.dumps
+    loads = orjson.loads
+    # orjson only writes compact JSON
+    ITEM_SEPARATOR = b","
+    KEY_SEPARATOR = b":"
+else:
+    # Same output as json.dumps() with its default separators
+    _encoder = json.JSONEncoder()
+
+    def dumps(value):
+        return _encoder.encode(value).encode("utf-8")
+
+    loads = json.loads
+    ITEM_SEPARATOR = b", "
+    KEY_SEPARATOR = b": "
+
+# id -> (object, JSON bytes) of the objects registered with preencode()
+_fragments = {}
+# Encoded "key": prefixes of payload keys
+_keys = {}
+# (key, type, value) -> JSON bytes of numbers and booleans of the payload's top level
+_scalars = {}
+
+
+def preencode(value):
+    """
+    Serializes a value once and registers it, so encode_payload() splices its
+    bytes wherever the same object appears. The value must never be modified.
+
+    Returns:
+        The value itself
+    """
+    _fragments[id(value)] = (value, dumps(value))
+    return value
+
+
+def _fragment(value):
+    fragment = _fragments.get(id(value))
+    if fragment is not None and fragment[0] is value:
+        return fragment[1]
+    return None
+
+
+def _key(key):
+    prefix = _keys.get(key)
+    if prefix is None:
+        prefix = _keys[key] = dumps(key) + KEY_SEPARATOR
+    return prefix
+
+
+def _encode_value(parts, key, value):
+    fragment = _fragment(value)
+    if fragment is not None:
+        parts.append(fragment)
+    elif isinstance(value, (bool, int, float)):
+        # Inference parameters take a handful of values, routes included
+        cache_key = (key, type(value), value)
+        encoded = _scalars.get(cache_key)
+        if encoded is None:
+            encoded = _scalars[cache_key] = dumps(value)
+        parts.append(encoded)
+    elif key == "messages" and isinstance(value, list):
+        _encode_list(parts, value, _encode_message)
+    else:
+        parts.append(dumps(value))
+
+
+def _encode_list(parts, values, encode):
+    parts.append(b"[")
+    for index, value in enumerate(values):
+        if index:
+            parts.append(ITEM_SEPARATOR)
+        encode(parts, value)
+    parts.append(b"]")
+
+
+def _encode_message(parts, message):
+    content = message.get("content")
+    if list(message) != ["role", "content"] or not isinstance(content, list):
+        parts.append(dumps(message))
+        return
+    parts += [b"{", _key("role"), dumps(message["role"]), ITEM_SEPARATOR, _key("content")]
+    _encode_list(parts, content, _encode_content_item)
+    parts.append(b"}")
+
+
+def _encode_content_item(parts, item):
+    """
+    Encodes a content block. The base64 data of an image is copied into the
+    body rather than escaped character by character.
+    """
+    source = item.get("source")
+    if item.get("type") != "image" or list(item) != ["type", "source"] or not isinstance(source, dict) or list(source) != ["type", "media_type", "data"]:
+        parts.append(dumps(item))
+        return
+    try:
+        data = source["data"].encode("ascii")
+    except (AttributeError, UnicodeEncodeError):
+        data = None
+    if data is None or data.translate(None, BASE64_ALPHABET):
+        # Not plain base64, e.g. with line breaks: leave the escaping to the backend
+        parts.append(dumps(item))
+        return
+    parts += [
+        b"{", _key("type"), dumps(item["type"]), ITEM_SEPARATOR,
+        _key("source"), b"{", _key("type"), dumps(source["type"]), ITEM_SEPARATOR,
+        _key("media_type"), dumps(source["media_type"]), ITEM_SEPARATOR,
+        _key("data"), b'"', data, b'"}}',
+    ]
+
+
+def encode_payload(payload):
+    """
+    Serializes a Bedrock payload to the request body.
+
+    Values registered with preencode() (system prompts, tool definitions,
+    constant inference parameters) are spliced in as bytes encoded at import
+    time, and the base64 data of images is copied as is. Everything else is
+    encoded with the configured backend. The parts are joined once, so the
+    image data is copied twice in all. With the json module the body is
+    byte-identical to json.dumps(payload).
+
+    Args:
+        payload: Payload dict, e.g. from create_bedrock_payload()
+
+    Returns:
+        bytes: The JSON body
+    """
+    parts = [b"{"]
+    for index, (key, value) in enumerate(payload.items()):
+        if index:
+            parts.append(ITEM_SEPARATOR)
+        parts.append(_key(key))
+        _encode_value(parts, key, value)
+    parts.append(b"}")
+    return b"".join(parts)
@@ -0,0 +1,104 @@
+import asyncio
+
+
+# Loading message shown for each pipeline stage
+PROGRESS_STAGES = {
+    "start": "🔍 Analyzing your request...",
+    "extract_images": "📸 Processing image data...",
+    "compress_images": "🗜️ Optimizing image...",
+    "extract_structured_data": "📊 Extracting nutritional information...",
+    "explain": "📝 Formulating response...",
+    "answer": "🧠 Thinking...",
+    "send": "✨ Almost done...",
+}
+
+
+async def animate_progress(message, label, delay=3.0, interval=0.8):
+    """
+    Fallback ticker for long stages: once a stage has lasted `delay` seconds,
+    keeps the loading message alive by cycling dots after its label.
+
+    Args:
+        message: The message object to update
+        label: Text of the current stage
+        delay: Seconds to wait before the first tick
+        interval: Seconds between ticks
+    """
+    try:
+        await asyncio.sleep(delay)
+        base = label.rstrip(".")
+        dots = 1
+        while True:
+            message.content = f"{base}{'.' * dots}"
+            await message.update()
+            dots = (dots % 3) + 1
+            await asyncio.sleep(interval)
+    except asyncio.CancelledError:
+        # Task was cancelled, which is expected when the stage completes
+        pass
+    except Exception as e:
+        # Log any unexpected errors
+        print(f"Animation error: {e}")
+
+
+class ProgressReporter:
+    """
+    Updates a loading message from the stage events emitted by the pipeline.
+    """
+
+    def __init__(self, message, ticker_delay=3.0):
+        """
+        Args:
+            message: The Chainlit loading message to update
+            ticker_delay: Seconds a stage may run before the fallback ticker starts
+        """
+        self.message = message
+        self.ticker_delay = ticker_delay
+        self.stage = None
+        self._ticker = None
+        self._closed = False
+
+    async def emit(self, stage, detail=None):
+        """
+        Reports that a pipeline stage has started.
+
+        Args:
+            stage: Key of PROGRESS_STAGES, or free text
+            detail: Optional suffix such as "(2/4)"
+        """
+        if self._closed:
+            # e.g. an analysis shared with other requests outliving the cancelled request
+            return
+        self._stop_ticker()
+        self.stage = stage
+        label = PROGRESS_STAGES.get(stage, stage)
+        if detail:
+            label = f"{label} {detail}"
+        self.message.content = label
+        await self.message.update()
+        self._ticker = asyncio.create_task(
+            animate_progress(self.message, label, delay=self.ticker_delay)
+        )
+
+    def _stop_ticker(self):
+        if self._ticker is not None:
+            self._ticker.cancel()
+            self._ticker = None
+
+    async def close(self):
+        """
+        Stops the fallback ticker once the pipeline is done. Later stage events are ignored.
+        """
+        self._closed = True
+        if self._ticker is not None:
+            ticker = self._ticker
+            self._stop_ticker()
+            await asyncio.gather(ticker, return_exceptions=True)
+
+
+async def emit_progress(progress, stage, detail=None):
+    """
+    Emits a stage event if a progress reporter was provided.
+    """
+    if progress is not None:
+        await progress.emit(stage, detail)
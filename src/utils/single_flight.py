@@ -0,0 +1,102 @@
+import asyncio
+import hashlib
+import json
+
+from src.utils.metrics import SINGLE_FLIGHT_CALLS
+
+
+def request_key(**fields):
+    """
+    Hashes the fields identifying a request into a single-flight key.
+
+    Strings are compared without case and extra whitespace, so
+    "Is this healthy?" and "is this  healthy?" share a key.
+
+    Returns:
+        str: SHA-256 of the normalized fields
+    """
+    normalized = {
+        name: " ".join(value.split()).casefold() if isinstance(value, str) else value
+        for name, value in fields.items()
+    }
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls: while a call for a key is in flight,
+    further callers with the same key await its result instead of starting
+    their own.
+
+    Each caller awaits the shared call through asyncio.shield(), so a caller
+    being cancelled (e.g. its session disconnected) leaves the call running
+    for the others. The call is only cancelled once every caller is gone.
+    Results are not kept after the call completes.
+    """
+
+    def __init__(self, name):
+        """
+        Args:
+            name: Label of the coalesced calls in the metrics, e.g. "analysis"
+        """
+        self.name = name
+        self._calls = {}
+        self.counters = {
+            "leaders": 0,
+            "coalesced": 0,
+            "abandoned": 0,
+        }
+
+    async def run(self, key, func, *args, **kwargs):
+        """
+        Returns the result of `func(*args, **kwargs)`, shared with the concurrent callers using the same key.
+
+        Args:
+            key: Identity of the request, e.g. from request_key()
+            func: Coroutine function making the call, only invoked by the first caller
+        """
+        call = self._calls.get(key)
+        if call is None:
+            call = self._calls[key] = _Call(asyncio.ensure_future(func(*args, **kwargs)))
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+            self._count("leaders", "leader")
+        else:
+            self._count("coalesced", "coalesced")
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if call.waiters == 1 and not call.task.done():
+                # Last caller gone, nobody needs the result any more
+                call.task.cancel()
+                self._count("abandoned", "abandoned")
+            raise
+        finally:
+            call.waiters -= 1
+
+    def _forget(self, key, call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def _count(self, counter, role):
+        self.counters[counter] += 1
+        SINGLE_FLIGHT_CALLS.inc(self.name, role)
+
+    def stats(self):
+        """
+        Returns the leader, coalesced and abandoned counts and the calls in flight.
+        """
+        stats = dict(self.counters)
+        stats["in_flight"] = len(self._calls)
+        calls = stats["leaders"] + stats["coalesced"]
+        stats["coalesced_rate"] = stats["coalesced"] / calls if calls else 0.0
+        return stats
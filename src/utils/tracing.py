@@ -0,0 +1,317 @@
+import base64
+import hashlib
+import os
+import queue
+import random
+import threading
+from io import BytesIO
+from PIL import Image
+from dotenv import load_dotenv
+from langfuse import Langfuse
+
+# Load environment variables from .env file
+load_dotenv()
+
+# "langfuse" exports traces, "off" records nothing (e.g. for load tests)
+tracing_mode = os.getenv("TRACING_MODE", "langfuse")
+# Share of requests traced, decided once per trace
+tracing_sample_rate = float(os.getenv("TRACING_SAMPLE_RATE", "1.0"))
+# Trace operations waiting for export; further ones are dropped
+tracing_queue_size = int(os.getenv("TRACING_QUEUE_SIZE", "10000"))
+# Bytes of strings (e.g. base64 images) the queued operations may hold before redaction
+tracing_queue_bytes = int(os.getenv("TRACING_QUEUE_BYTES", str(128 * 1024 * 1024)))
+# Operations handed to the Langfuse client per batch, and its upload batch size
+tracing_batch_size = int(os.getenv("TRACING_BATCH_SIZE", "50"))
+tracing_flush_interval = float(os.getenv("TRACING_FLUSH_INTERVAL", "1.0"))
+# Longer strings are replaced by their hash and length
+tracing_max_string = int(os.getenv("TRACING_MAX_STRING", "20000"))
+
+_tracer = None
+
+
+def describe_image(data):
+    """
+    Summarizes image bytes for a trace: content hash, size and, when the
+    header can be read, format and dimensions.
+
+    Args:
+        data: Raw image bytes
+
+    Returns:
+        Dict: sha256, bytes and, for images, format, width and height
+    """
+    summary = {"sha256": hashlib.sha256(data).hexdigest(), "bytes": len(data)}
+    try:
+        # Only the header is read
+        with Image.open(BytesIO(data)) as img:
+            summary.update(format=img.format, width=img.width, height=img.height)
+    except Exception:
+        pass
+    return summary
+
+
+def redact(value, max_string=20000):
+    """
+    Returns a copy of a trace input or output without image payloads.
+
+    Base64 image sources and raw bytes are replaced by describe_image(),
+    Chainlit elements by their name and type, and overlong strings by their hash.
+    """
+    if isinstance(value, dict):
+        if value.get("type") == "base64" and isinstance(value.get("data"), str):
+            try:
+                data = base64.b64decode(value["data"])
+            except ValueError:
+                data = value["data"].encode("utf-8")
+            return {**value, "data": describe_image(data)}
+        return {key: redact(item, max_string) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(item, max_string) for item in value]
+    if isinstance(value, (bytes, bytearray)):
+        return describe_image(bytes(value))
+    if isinstance(value, str):
+        if len(value) > max_string:
+            return {"sha256": hashlib.sha256(value.encode("utf-8")).hexdigest(), "chars": len(value)}
+        return value
+    if hasattr(value, "mime") and hasattr(value, "name"):
+        # Chainlit element, never ship its content
+        return {"element": type(value).__name__, "name": value.name, "mime": value.mime}
+    return value
+
+
+def payload_bytes(value):
+    """
+    Estimates the memory held by a trace input or output: the length of its
+    strings and bytes. Only lengths are read, the payload is not copied.
+    """
+    if isinstance(value, dict):
+        return sum(payload_bytes(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(payload_bytes(item) for item in value)
+    if isinstance(value, (str, bytes, bytearray)):
+        return len(value)
+    return 0
+
+
+class _NullObservation:
+    """
+    Trace, span or generation that records nothing, returned for unsampled requests.
+    """
+
+    def span(self, **kwargs):
+        return self
+
+    def generation(self, **kwargs):
+        return self
+
+    def update(self, **kwargs):
+        pass
+
+    def end(self, **kwargs):
+        pass
+
+
+NULL_OBSERVATION = _NullObservation()
+
+
+class _Observation:
+    """
+    Stand-in for a Langfuse trace, span or generation. Calls are queued and
+    replayed in order on the Langfuse client by the export thread.
+    """
+
+    def __init__(self, tracer):
+        self._tracer = tracer
+        # Langfuse object, set by the export thread once the creation is replayed
+        self._target = None
+
+    def span(self, **kwargs):
+        return self._tracer._create(self, "span", kwargs)
+
+    def generation(self, **kwargs):
+        return self._tracer._create(self, "generation", kwargs)
+
+    def update(self, **kwargs):
+        self._tracer._enqueue((self, "update", None, kwargs))
+
+    def end(self, **kwargs):
+        self._tracer._enqueue((self, "end", None, kwargs))
+
+
+class Tracer:
+    """
+    Tracing adapter keeping Langfuse off the request path.
+
+    Requests only append to a bounded queue; a background thread redacts the
+    payloads and hands them to the Langfuse client in batches. The queue is
+    bounded both in operations and in the bytes of their unredacted payloads,
+    so a slow Langfuse cannot pile up image data. When either is full,
+    operations are dropped rather than slowing requests down.
+    Whether a request is traced is decided once, when its trace is created.
+    """
+
+    def __init__(self, client=None, sample_rate=1.0, queue_size=10000, batch_size=50, max_string=20000, queue_bytes=128 * 1024 * 1024):
+        """
+        Args:
+            client: Langfuse client, None to record nothing
+            sample_rate: Share of traces recorded
+            queue_size: Maximum number of operations waiting for export
+            batch_size: Operations replayed per batch
+            max_string: Longer strings are replaced by their hash
+            queue_bytes: Maximum bytes of payloads waiting for export, see payload_bytes()
+        """
+        self.client = client
+        self.sample_rate = sample_rate
+        self.batch_size = batch_size
+        self.max_string = max_string
+        self.queue_bytes = queue_bytes
+        self._queued_bytes = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._worker = None
+        self._lock = threading.Lock()
+        self.counters = {
+            "traces": 0,
+            "sampled_out": 0,
+            "enqueued": 0,
+            "dropped": 0,
+            "exported": 0,
+            "errors": 0,
+        }
+
+    def trace(self, **kwargs):
+        """
+        Starts a trace, taking the same arguments as Langfuse.trace().
+
+        Returns:
+            The trace, or a no-op stand-in when tracing is off or the request is not sampled
+        """
+        if self.client is None:
+            return NULL_OBSERVATION
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            self._count("sampled_out")
+            return NULL_OBSERVATION
+        self._count("traces")
+        return self._create(None, "trace", kwargs)
+
+    def _create(self, parent, kind, kwargs):
+        observation = _Observation(self)
+        self._enqueue((parent, kind, observation, kwargs))
+        return observation
+
+    def _count(self, counter, value=1):
+        with self._lock:
+            self.counters[counter] += value
+
+    def _enqueue(self, operation):
+        if self._worker is None:
+            self._start()
+        size = payload_bytes(operation[3])
+        with self._lock:
+            if self._queued_bytes + size > self.queue_bytes:
+                self.counters["dropped"] += 1
+                return
+            self._queued_bytes += size
+        try:
+            self._queue.put_nowait(operation + (size,))
+            self._count("enqueued")
+        except queue.Full:
+            with self._lock:
+                self._queued_bytes -= size
+                self.counters["dropped"] += 1
+
+    def _start(self):
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._export, name="tracing", daemon=True)
+                self._worker.start()
+
+    def _export(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = False
+            for operation in batch:
+                if operation is None:
+                    stop = True
+                else:
+                    self._replay(*operation)
+                self._queue.task_done()
+            if stop:
+                return
+
+    def _replay(self, observation, method, created, kwargs, size):
+        with self._lock:
+            self._queued_bytes -= size
+        try:
+            kwargs = {key: redact(value, self.max_string) for key, value in kwargs.items()}
+            if created is not None:
+                if observation is None:
+                    created._target = self.client.trace(**kwargs)
+                elif observation._target is not None:
+                    created._target = getattr(observation._target, method)(**kwargs)
+            elif observation._target is not None:
+                # Calls on an observation whose creation was dropped are dropped too
+                getattr(observation._target, method)(**kwargs)
+            self._count("exported")
+        except Exception as e:
+            self._count("errors")
+            print(f"Tracing error: {e}")
+
+    def flush(self):
+        """
+        Waits until the queued operations are exported.
+        """
+        if self._worker is not None:
+            self._queue.join()
+        if self.client is not None:
+            self.client.flush()
+
+    def stats(self):
+        """
+        Returns the tracing counters and current queue length.
+        """
+        with self._lock:
+            stats = dict(self.counters)
+            stats["queued_bytes"] = self._queued_bytes
+        stats["queued"] = self._queue.qsize()
+        return stats
+
+    def shutdown(self):
+        """
+        Exports the queued operations and stops the export thread.
+        """
+        if self._worker is not None:
+            self._queue.put(None)
+            self._worker.join()
+            self._worker = None
+        if self.client is not None:
+            self.client.shutdown()
+
+
+def get_tracer():
+    """Return the process-wide tracer configured from the environment."""
+    global _tracer
+    if _tracer is None:
+        client = None
+        if tracing_mode == "langfuse":
+            client = Langfuse(
+                secret_key=os.getenv("LANGFUSE_SECRET_KEY"),
+                public_key=os.getenv("LANGFUSE_PUBLIC_KEY"),
+                host=os.getenv("LANGFUSE_HOST"),
+                flush_at=tracing_batch_size,
+                flush_interval=tracing_flush_interval,
+            )
+        _tracer = Tracer(
+            client=client,
+            sample_rate=tracing_sample_rate,
+            queue_size=tracing_queue_size,
+            batch_size=tracing_batch_size,
+            max_string=tracing_max_string,
+            queue_bytes=tracing_queue_bytes,
+        )
+    return _tracer
@@ -0,0 +1,58 @@
+import numpy as np
+
+from src.utils import barcode
+from src.utils.barcode import DIGIT_WIDTHS, FIRST_DIGIT
+
+CODE = "3017620422003"
+OTHER_CODE = "5449000131805"
+
+
+def modules(code):
+	"""
+	Returns the 95 modules of an EAN-13, True for a bar.
+	"""
+	parity = {first: pattern for pattern, first in FIRST_DIGIT.items()}[code[0]]
+	bits = [True, False, True]
+	for position, digit in enumerate(code[1:]):
+		widths = DIGIT_WIDTHS[int(digit)]
+		if position == 6:
+			bits += [False, True, False, True, False]
+		if position < 6 and parity[position] == "G":
+			widths = widths[::-1]
+		# L and G digits start with a space, R digits with a bar
+		dark = position >= 6
+		for width in widths:
+			bits += [dark] * int(width)
+			dark = not dark
+	return bits + [True, False, True]
+
+def barcode_rows(code, module_px=3, height=20):
+	row = np.full(len(modules(code)) * module_px + 40 * module_px, 255.0)
+	for index, bit in enumerate(modules(code)):
+		if bit:
+			row[(20 + index) * module_px:(21 + index) * module_px] = 0
+	return np.tile(row, (height, 1))
+
+def image_with(rows):
+	"""
+	A white image with the given barcode rows pasted in, at the positions of scan lines.
+	"""
+	gray = np.full((1000, rows[0][1].shape[1]), 255.0)
+	lines = np.linspace(100, 900, barcode.SCAN_LINES).astype(int)
+	for line, symbol in rows:
+		gray[lines[line] - 1:lines[line] + symbol.shape[0] - 1] = symbol
+	return gray
+
+
+def test_code_read_on_several_lines_is_returned():
+	symbol = barcode_rows(CODE, height=100)
+	assert barcode._scan(image_with([(3, symbol)])) == CODE
+
+def test_code_read_on_a_single_line_is_ignored():
+	symbol = barcode_rows(CODE, height=3)
+	assert barcode._scan(image_with([(3, symbol)])) is None
+
+def test_conflicting_codes_are_ignored():
+	rows = [(3, barcode_rows(CODE, height=3)), (6, barcode_rows(CODE, height=3)),
+		(9, barcode_rows(OTHER_CODE, height=3)), (12, barcode_rows(OTHER_CODE, height=3))]
+	assert barcode._scan(image_with(rows)) is None
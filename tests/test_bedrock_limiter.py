@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+from botocore.exceptions import ClientError
+
+from src.utils.bedrock_limiter import BedrockGuard, BedrockUnavailableError, CircuitBreaker
+
+
+def throttled():
+	raise ClientError({"Error": {"Code": "ThrottlingException", "Message": "Too many requests"}}, "InvokeModel")
+
+def ok():
+	return "ok"
+
+def open_breaker(reset_timeout=0.0):
+	breaker = CircuitBreaker(failure_threshold=1, reset_timeout=reset_timeout)
+	breaker.record_failure()
+	return breaker
+
+
+def test_failed_call_opens_circuit():
+	guard = BedrockGuard(breaker=CircuitBreaker(failure_threshold=1, reset_timeout=60), max_attempts=2, base_delay=0.001)
+	with pytest.raises(ClientError):
+		asyncio.run(guard.call(throttled))
+	assert guard.breaker.state == "open"
+	with pytest.raises(BedrockUnavailableError):
+		asyncio.run(guard.call(ok))
+
+def test_throttled_probe_reopens_circuit_without_retrying():
+	calls = []
+
+	def probe():
+		calls.append(1)
+		throttled()
+
+	guard = BedrockGuard(breaker=open_breaker(), max_attempts=4, base_delay=0.001)
+	with pytest.raises(ClientError):
+		asyncio.run(guard.call(probe))
+	assert len(calls) == 1
+	assert guard.breaker.state == "open"
+	assert not guard.breaker._probing
+
+	# Once the reset timeout has passed again, the next probe goes through and closes the circuit
+	assert asyncio.run(guard.call(ok)) == "ok"
+	assert guard.breaker.state == "closed"
+
+def test_cancelled_probe_lets_next_call_probe():
+	async def scenario(guard):
+		started = asyncio.Event()
+
+		async def hang(*args):
+			started.set()
+			await asyncio.sleep(60)
+
+		guard._call_once = hang
+		task = asyncio.create_task(guard.call(ok))
+		await started.wait()
+		task.cancel()
+		with pytest.raises(asyncio.CancelledError):
+			await task
+		assert guard.breaker.state == "half_open"
+		assert not guard.breaker._probing
+		assert guard.breaker.allow()
+
+	asyncio.run(scenario(BedrockGuard(breaker=open_breaker(), base_delay=0.001)))
+
+def test_request_errors_do_not_open_circuit():
+	def invalid():
+		raise ClientError({"Error": {"Code": "ValidationException", "Message": "Bad request"}}, "InvokeModel")
+
+	guard = BedrockGuard(breaker=open_breaker(), base_delay=0.001)
+	with pytest.raises(ClientError):
+		asyncio.run(guard.call(invalid))
+	assert guard.breaker.state == "closed"
+
+def test_each_model_has_its_own_guard(monkeypatch):
+	from src.utils import bedrock_limiter
+	monkeypatch.setattr(bedrock_limiter, "_bedrock_guards", {})
+	sonnet = bedrock_limiter.get_bedrock_guard("sonnet")
+	haiku = bedrock_limiter.get_bedrock_guard("haiku")
+	assert sonnet is not haiku
+	assert bedrock_limiter.get_bedrock_guard("sonnet") is sonnet
+	for _ in range(sonnet.breaker.failure_threshold):
+		sonnet.breaker.record_failure()
+	assert sonnet.breaker.state == "open"
+	assert haiku.breaker.state == "closed"
+	assert asyncio.run(haiku.call(ok)) == "ok"
@@ -0,0 +1,45 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from src.utils.image_executor import ImageExecutor, ImageJobTimeoutError
+
+
+def test_timeout_does_not_count_the_wait_for_a_worker():
+	executor = ImageExecutor(workers=1, job_timeout=0.3)
+
+	async def main():
+		# The second job waits 0.2s for the worker, then runs 0.2s: 0.4s in all
+		return await asyncio.gather(
+			executor.run(time.sleep, 0.2),
+			executor.run(time.sleep, 0.2),
+		)
+
+	try:
+		assert asyncio.run(main()) == [None, None]
+	finally:
+		executor.shutdown()
+
+def test_timed_out_job_keeps_its_worker_until_it_finishes():
+	executor = ImageExecutor(workers=1, max_pending=2, job_timeout=0.05)
+	release = threading.Event()
+	started = []
+
+	async def main():
+		with pytest.raises(ImageJobTimeoutError):
+			await executor.run(release.wait, 5)
+		# The worker is still busy, so the next job is not submitted yet
+		second = asyncio.create_task(executor.run(started.append, "second"))
+		await asyncio.sleep(0.1)
+		assert started == []
+		release.set()
+		await second
+		assert started == ["second"]
+
+	try:
+		asyncio.run(main())
+	finally:
+		release.set()
+		executor.shutdown()
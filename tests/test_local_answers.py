@@ -0,0 +1,19 @@
+from src.handlers.local_answers import LocalAnswerEngine
+
+
+def product(*ingredients):
+	return {"product": {"name": "Test product", "ingredients": list(ingredients), "nutritive_value": {"calories": 120}}}
+
+
+def test_ingredient_is_matched_as_a_whole_word():
+	engine = LocalAnswerEngine()
+	answer = engine.answer("Does it contain egg?", product("sugar", "whole eggs"))
+	assert answer is not None and answer.intent == "ingredient_presence"
+
+def test_nut_is_not_found_in_coconut():
+	engine = LocalAnswerEngine()
+	assert engine.answer("Is there any nut?", product("coconut", "sugar")) is None
+
+def test_egg_is_not_found_in_eggplant():
+	engine = LocalAnswerEngine()
+	assert engine.answer("Does it contain egg?", product("eggplant", "olive oil")) is None
@@ -0,0 +1,42 @@
+import threading
+
+from src.utils.tracing import Tracer
+
+
+class SlowClient:
+	"""
+	Langfuse stand-in whose export blocks until released, like an unreachable server.
+	"""
+
+	def __init__(self):
+		self.release = threading.Event()
+
+	def trace(self, **kwargs):
+		self.release.wait(5)
+		return self
+
+	def generation(self, **kwargs):
+		return self
+
+	def flush(self):
+		pass
+
+	def shutdown(self):
+		pass
+
+
+def test_queue_is_bounded_by_payload_bytes():
+	client = SlowClient()
+	tracer = Tracer(client=client, queue_bytes=3 * 1024 * 1024)
+	image = "A" * (1024 * 1024)
+	try:
+		trace = tracer.trace(name="Question")
+		for _ in range(5):
+			trace.generation(input={"type": "base64", "data": image})
+		stats = tracer.stats()
+		assert stats["queued_bytes"] <= 3 * 1024 * 1024
+		assert stats["dropped"] >= 2
+	finally:
+		client.release.set()
+		tracer.shutdown()
+	assert tracer.stats()["queued_bytes"] == 0